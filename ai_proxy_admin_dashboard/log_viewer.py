@@ -1,7 +1,8 @@
-from flask import Flask, render_template, request, redirect, session
+from flask import Flask, render_template, request, redirect, session, url_for
 from auth import check_admin_password
 import json
 import os
+from datetime import datetime
 from sqlite_logger import get_logs, init_db
 
 app = Flask(__name__)
@@ -9,6 +10,9 @@ app.secret_key = "secret_key"
 
 LOG_FILE = "proxy_logs.json"
 
+# Events per dashboard page
+PAGE_SIZE = 100
+
 def load_logs():
     logs = []
     if os.path.exists(LOG_FILE):
@@ -40,18 +44,37 @@ def dashboard():
         return redirect("/login")
     masked_type = request.args.get("masked_type", "")
     min_count = request.args.get("min_count", "")
-    # Load logs from SQLite
-    logs = get_logs(masked_type if masked_type else None)
-    # Filtering by min_count
-    if min_count:
-        try:
-            min_count = int(min_count)
-            logs = [log for log in logs if log.get("count", 0) >= min_count]
-        except ValueError:
-            pass
+    file_type = request.args.get("file_type", "")
+    status = request.args.get("status", "")
+    date = request.args.get("date", "")
+    filters = {"masked_type": masked_type, "min_count": min_count, "file_type": file_type, "status": status, "date": date}
+    filters = {name: value for name, value in filters.items() if value}
+    # Malformed filters are ignored, as before
+    try:
+        count_filter = int(min_count) if min_count else None
+    except ValueError:
+        count_filter = None
+    try:
+        date_filter = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") if date else None
+    except ValueError:
+        date_filter = None
+    before = None
+    if request.args.get("before") and request.args.get("before_id", "").isdigit():
+        before = (request.args["before"], int(request.args["before_id"]))
+
+    # Every logged event is a masking, so "masked" (or no status) is the only status with events
+    logs = []
+    if status.lower() in ("", "masked"):
+        # One row past the page says whether there is an older page
+        logs = get_logs(masked_type or None, count_filter, file_type or None, date_filter, before, PAGE_SIZE + 1)
+    older_url = None
+    if len(logs) > PAGE_SIZE:
+        logs = logs[:PAGE_SIZE]
+        older_url = url_for("dashboard", before=logs[-1]["timestamp"], before_id=logs[-1]["id"], **filters)
+    newest_url = url_for("dashboard", **filters) if before else None
     for log in logs:
         log["avatar"] = avatar_for_hash(log.get("masked_value", "0"))
-    return render_template("dashboard.html", logs=logs, masked_type=masked_type, min_count=min_count, file_type="", status="", date="")
+    return render_template("dashboard.html", logs=logs, masked_type=masked_type, min_count=min_count, file_type=file_type, status=status, date=date, older_url=older_url, newest_url=newest_url)
 
 @app.route("/logout")
 def logout():
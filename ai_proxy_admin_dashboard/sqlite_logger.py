@@ -1,56 +1,141 @@
+import os
+import queue
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
 
 DB_PATH = 'masking_logs.db'
 
+# Idle connections kept open for reuse; busier moments open extra ones and close them afterwards
+POOL_SIZE = 4
+
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_owner = None
+_pool_lock = threading.Lock()
+
+def _open() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    # With WAL a commit no longer waits on fsync, and the dashboard's reads do not block the gateway's writes
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+@contextmanager
+def _connection():
+    """
+    A pooled connection for the block, committed when it ends (rolled back on error).
+
+    The pool belongs to one process and DB_PATH: forked server workers and a
+    changed DB_PATH start a fresh one rather than share connections.
+    """
+    global _pool, _pool_owner
+    owner = (os.getpid(), DB_PATH)
+    if _pool_owner != owner:
+        with _pool_lock:
+            if _pool_owner != owner:
+                _pool, _pool_owner = queue.LifoQueue(maxsize=POOL_SIZE), owner
+    pool = _pool
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open()
+    try:
+        with conn:
+            yield conn
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS masking_events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            masked_type TEXT NOT NULL,
-            masked_value TEXT NOT NULL,
-            count INTEGER NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def log_masking_event(masked_type: str, masked_value: str, count: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO masking_events (timestamp, masked_type, masked_value, count)
-        VALUES (?, ?, ?, ?)
-    ''', (datetime.utcnow().isoformat(), masked_type, masked_value, count))
-    conn.commit()
-    conn.close()
-
-def get_logs(masked_type: Optional[str] = None) -> List[Dict[str, Any]]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    with _connection() as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS masking_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                masked_type TEXT NOT NULL,
+                masked_value TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                request_id TEXT
+            )
+        ''')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(masking_events)')]
+        if "request_id" not in columns:
+            conn.execute('ALTER TABLE masking_events ADD COLUMN request_id TEXT')
+        # Each index also orders by id (the rowid), so the dashboard's newest-first pages read straight off one
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_masking_events_timestamp ON masking_events (timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_masking_events_type_timestamp ON masking_events (masked_type, timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_masking_events_value_timestamp ON masking_events (masked_value, timestamp)')
+
+def log_masking_event(masked_type: str, masked_value: str, count: int, request_id: Optional[str] = None):
+    with _connection() as conn:
+        conn.execute('''
+            INSERT INTO masking_events (timestamp, masked_type, masked_value, count, request_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (datetime.utcnow().isoformat(), masked_type, masked_value, count, request_id))
+
+def log_masking_events(events: List[Tuple[str, str, int]], request_id: Optional[str] = None):
+    """Insert several (masked_type, masked_value, count) rows in one transaction"""
+    if not events:
+        return
+    timestamp = datetime.utcnow().isoformat()
+    with _connection() as conn:
+        conn.executemany('''
+            INSERT INTO masking_events (timestamp, masked_type, masked_value, count, request_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(timestamp, masked_type, masked_value, count, request_id) for masked_type, masked_value, count in events])
+
+def get_logs(masked_type: Optional[str] = None, min_count: Optional[int] = None, file_type: Optional[str] = None,
+             date: Optional[str] = None, before: Optional[Tuple[str, int]] = None,
+             limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Events newest first, filtered by sqlite.
+
+    file_type matches masked_value, which is where smart_mask records it;
+    date is a UTC day as YYYY-MM-DD (ValueError otherwise). For keyset
+    pagination pass limit, then the (timestamp, id) of the last event
+    returned as before to get the next page.
+    """
+    conditions, params = [], []
     if masked_type:
-        c.execute('''SELECT timestamp, masked_type, masked_value, count FROM masking_events WHERE masked_type = ? ORDER BY timestamp DESC''', (masked_type,))
-    else:
-        c.execute('''SELECT timestamp, masked_type, masked_value, count FROM masking_events ORDER BY timestamp DESC''')
-    rows = c.fetchall()
-    conn.close()
+        conditions.append('masked_type = ?')
+        params.append(masked_type)
+    if file_type:
+        conditions.append('masked_value = ?')
+        params.append(file_type)
+    if min_count is not None:
+        conditions.append('count >= ?')
+        params.append(min_count)
+    if date:
+        day = datetime.strptime(date, '%Y-%m-%d')
+        # ISO timestamps sort as text, so a day is a range of the index rather than a function of every row
+        conditions.append('timestamp >= ? AND timestamp < ?')
+        params += [day.date().isoformat(), (day + timedelta(days=1)).date().isoformat()]
+    if before is not None:
+        conditions.append('(timestamp, id) < (?, ?)')
+        params += [before[0], before[1]]
+    query = 'SELECT id, timestamp, masked_type, masked_value, count FROM masking_events'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY timestamp DESC, id DESC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    with _connection() as conn:
+        rows = conn.execute(query, params).fetchall()
     return [
         {
-            'timestamp': row[0],
-            'masked_type': row[1],
-            'masked_value': row[2],
-            'count': row[3]
+            'id': row[0],
+            'timestamp': row[1],
+            'masked_type': row[2],
+            'masked_value': row[3],
+            'count': row[4]
         } for row in rows
     ]
 
 def get_masked_types() -> List[str]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''SELECT DISTINCT masked_type FROM masking_events''')
-    types = [row[0] for row in c.fetchall()]
-    conn.close()
-    return types 
\ No newline at end of file
+    with _connection() as conn:
+        return [row[0] for row in conn.execute('''SELECT DISTINCT masked_type FROM masking_events''')]
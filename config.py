@@ -1,5 +1,13 @@
 import os
 
+
+def _parse_mapping(value, cast):
+    """Parse "name=value,name=value" environment settings into a dict"""
+    return {
+        name.strip(): cast(item.strip())
+        for name, _, item in (part.partition("=") for part in value.split(",") if "=" in part)
+    }
+
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
 print("OPENROUTER_API_KEY loaded:", OPENROUTER_API_KEY)
@@ -8,6 +16,13 @@ if not OPENROUTER_API_KEY:
     OPENROUTER_API_KEY = "sk-or-v1-----"
     print("Using hardcoded API key for testing")
 
+# Upstream endpoints can be overridden (e.g. to point at a local stub upstream).
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1")
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+
 USE_SECURE_FILTER = os.getenv("USE_SECURE_FILTER", "True").lower() == "true"
 SECURITY_LEVEL = os.getenv("SECURITY_LEVEL", "high")  
 
@@ -54,7 +69,9 @@ SENSITIVE_PATTERNS = {
         r"\b[A-Z][a-z]+\s+[A-Z][a-z]+\s+[A-Z][a-z]+\s+[A-Z][a-z]+\b", 
     ],
     "companies": [
-        r"\b[A-Z]{2,}(?:[A-Z][a-z]+)*\s+(?:Inc|Corp|LLC|Ltd|Company|Corporation|Limited|Partnership|Associates)\b",
+        # Matched case-insensitively, where "[A-Z]{2,}(?:[A-Z][a-z]+)*" means the same as
+        # "[A-Z]{2,}" but backtracks exponentially on a long word not followed by a space
+        r"\b[A-Z]{2,}\s+(?:Inc|Corp|LLC|Ltd|Company|Corporation|Limited|Partnership|Associates)\b",
         r"\b(?:company|organization|enterprise|business)\s+[A-Z][a-z]+\b",
         r"\b[A-Z][a-z]+\s+(?:Technologies|Systems|Solutions|Services|Group|Industries|International|Global)\b",
     ],
@@ -101,7 +118,7 @@ BUSINESS_PATTERNS = {
         r"\b(project|initiative|strategy|roadmap|milestone|deadline)\b",
     ],
     "company_identifiers": [
-        r"\b[A-Z]{2,}(?:[A-Z][a-z]+)*\s+(?:Inc|Corp|LLC|Ltd|Company|Corporation)\b",
+        r"\b[A-Z]{2,}\s+(?:Inc|Corp|LLC|Ltd|Company|Corporation)\b",
         r"\b(?:company|organization|enterprise|business)\s+[A-Z][a-z]+\b",
     ],
     "document_types": [
@@ -110,3 +127,185 @@ BUSINESS_PATTERNS = {
         r"\b(policy|procedure|process|workflow|standard|protocol)\b",
     ]
 }
+
+# Upstream response cache for deterministic (temperature 0) chat completions.
+# Keys are built from the masked request body only, never from raw user input.
+# RESPONSE_CACHE_DISK_PATH (e.g. response_cache.db) adds a sqlite tier that
+# survives restarts.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "False").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_DISK_PATH = os.getenv("RESPONSE_CACHE_DISK_PATH", "")
+RESPONSE_CACHE_DISK_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Share one upstream call between concurrent identical (masked) chat requests.
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "True").lower() == "true"
+
+# Latency-aware routing across upstream providers.
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))
+ROUTER_RESET_TIMEOUT = float(os.getenv("ROUTER_RESET_TIMEOUT", "30"))
+ROUTER_HALF_OPEN_PROBES = int(os.getenv("ROUTER_HALF_OPEN_PROBES", "1"))
+ROUTER_EXPLORE_RATIO = float(os.getenv("ROUTER_EXPLORE_RATIO", "0.05"))
+
+# Hedged requests: after HEDGING_PERCENTILE of recent latency with no response
+# (or first token), send a duplicate; at most HEDGING_MAX_RATIO extra load.
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "False").lower() == "true"
+HEDGING_PERCENTILE = float(os.getenv("HEDGING_PERCENTILE", "95"))
+HEDGING_MAX_RATIO = float(os.getenv("HEDGING_MAX_RATIO", "0.1"))
+HEDGING_MIN_DELAY_MS = float(os.getenv("HEDGING_MIN_DELAY_MS", "50"))
+HEDGING_MIN_SAMPLES = int(os.getenv("HEDGING_MIN_SAMPLES", "20"))
+
+# Admission control: concurrent calls per upstream, and a bounded priority
+# queue in front of each one. A full queue answers 503 with Retry-After.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "32"))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "64"))
+UPSTREAM_MAX_QUEUE_WAIT = float(os.getenv("UPSTREAM_MAX_QUEUE_WAIT", "10"))
+# e.g. "openrouter=16,openai=8"
+UPSTREAM_CONCURRENCY_OVERRIDES = _parse_mapping(os.getenv("UPSTREAM_CONCURRENCY_OVERRIDES", ""), int)
+
+# Gateway-wide request rate limits for /proxy routes (raise them for load tests)
+RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+RATE_LIMIT_PER_HOUR = int(os.getenv("RATE_LIMIT_PER_HOUR", "1000"))
+
+# Chat responses are passed through as upstream bytes. Security metadata is
+# always sent as X-* headers; set this to False to stop also splicing it into
+# the JSON body as "security_metadata".
+SECURITY_METADATA_IN_BODY = os.getenv("SECURITY_METADATA_IN_BODY", "True").lower() == "true"
+
+# /proxy/chat/batch: maximum entries per batch and concurrent upstream calls per batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "8"))
+
+# Durable submit-and-poll job queue (/jobs) for long chat and masking work.
+# Results are kept for JOB_RESULT_TTL seconds; jobs interrupted by a restart
+# are retried up to JOB_MAX_ATTEMPTS times. Jobs not finished JOB_MAX_AGE
+# seconds after submission expire without running. JOB_WORKERS=0 disables
+# the workers.
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_MAX_AGE = int(os.getenv("JOB_MAX_AGE", "86400"))
+JOB_UPSTREAM_TIMEOUT = float(os.getenv("JOB_UPSTREAM_TIMEOUT", "600"))
+
+# Opt-in prompt token budgets enforced before forwarding (estimated locally).
+# A model's budget is its context window less room for the response;
+# TOKEN_BUDGETS overrides per model, e.g. "anthropic/claude-3-haiku=150000,gpt-4=6000",
+# and TOKEN_BUDGET_DEFAULT covers models whose window is not known.
+# COMPACT_PREAMBLE swaps the multi-line masking notice for a one-line version.
+TOKEN_BUDGET_ENABLED = os.getenv("TOKEN_BUDGET_ENABLED", "False").lower() == "true"
+TOKEN_BUDGET_DEFAULT = int(os.getenv("TOKEN_BUDGET_DEFAULT", "16000"))
+TOKEN_BUDGETS = _parse_mapping(os.getenv("TOKEN_BUDGETS", ""), int)
+COMPACT_PREAMBLE = os.getenv("COMPACT_PREAMBLE", "True").lower() == "true"
+
+# Opt-in capture of post-masking request shapes and timings for tools/replay.py.
+# TRAFFIC_CAPTURE_CONTENT is "shape" (sizes and parameters only) or "masked"
+# (also the masked message text); raw content is never captured.
+TRAFFIC_CAPTURE_ENABLED = os.getenv("TRAFFIC_CAPTURE_ENABLED", "False").lower() == "true"
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "traffic_capture.ndjson.gz")
+TRAFFIC_CAPTURE_CONTENT = os.getenv("TRAFFIC_CAPTURE_CONTENT", "shape")
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Compressed bodies (middleware/compression.py). Requests may be sent gzip,
+# deflate or br (br needs the brotli package) and may expand to at most
+# REQUEST_MAX_DECOMPRESSED_BYTES; responses of COMPRESSION_MIN_SIZE bytes or
+# more are compressed for clients that accept it.
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "True").lower() == "true"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+REQUEST_MAX_DECOMPRESSED_BYTES = int(os.getenv("REQUEST_MAX_DECOMPRESSED_BYTES", str(32 * 1024 * 1024)))
+
+# serve.py: pre-forked multi-worker server. SIGHUP to the master restarts the
+# workers one at a time; worker stats are served on SERVER_STATS_PORT (0 = off).
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+SERVER_STATS_PORT = int(os.getenv("SERVER_STATS_PORT", "0"))
+
+# Streaming file uploads (/chat/upload). Text is masked piece by piece as it
+# arrives: STREAM_MASK_HOLDBACK characters before the last partial word (and
+# any match that could still grow) stay buffered so no pattern is split, but
+# never more than STREAM_MASK_MAX_BUFFER characters. Content type and context
+# clues are detected on the first STREAM_MASK_SAMPLE_CHARS of the file.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_UPSTREAM_TIMEOUT = float(os.getenv("UPLOAD_UPSTREAM_TIMEOUT", "300"))
+STREAM_MASK_HOLDBACK = int(os.getenv("STREAM_MASK_HOLDBACK", "256"))
+STREAM_MASK_MAX_BUFFER = int(os.getenv("STREAM_MASK_MAX_BUFFER", str(1024 * 1024)))
+STREAM_MASK_SAMPLE_CHARS = int(os.getenv("STREAM_MASK_SAMPLE_CHARS", str(64 * 1024)))
+
+# Masking of AI responses on /proxy/chat, /chat and /chat/upload, on for every
+# request or per request ("mask_response" / X-Mask-Response). Only the
+# RESPONSE_MASK_CATEGORIES of SENSITIVE_PATTERNS apply, since the names and
+# paths patterns would match most prose. Streamed deltas hold back
+# RESPONSE_MASK_HOLDBACK characters before the last partial word; after
+# RESPONSE_MASK_MAX_HOLD_MS with nothing new upstream, that holdback is
+# released early (0 = never), which caps the delay masking adds.
+RESPONSE_MASKING_ENABLED = os.getenv("RESPONSE_MASKING_ENABLED", "False").lower() == "true"
+RESPONSE_MASK_CATEGORIES = [
+    name.strip() for name in
+    os.getenv("RESPONSE_MASK_CATEGORIES", "api_keys,passwords,emails,phone_numbers,credit_cards,ssn").split(",")
+    if name.strip()
+]
+RESPONSE_MASK_HOLDBACK = int(os.getenv("RESPONSE_MASK_HOLDBACK", "32"))
+RESPONSE_MASK_MAX_HOLD_MS = float(os.getenv("RESPONSE_MASK_MAX_HOLD_MS", "500"))
+
+# SecurityMiddleware: a client making more than SECURITY_MAX_REQUESTS_PER_MINUTE
+# requests in a sliding minute is blocked. Counts are kept for the
+# SECURITY_TRACKED_IPS most recently seen addresses.
+SECURITY_MAX_REQUESTS_PER_MINUTE = int(os.getenv("SECURITY_MAX_REQUESTS_PER_MINUTE", "100"))
+SECURITY_TRACKED_IPS = int(os.getenv("SECURITY_TRACKED_IPS", "10000"))
+# Addresses blocked for suspicious activity are released after
+# SECURITY_BLOCK_TTL seconds (0 keeps them blocked). The block and allow list
+# files hold one IP or CIDR range per line (# starts a comment) and are loaded
+# at startup; allowlisted addresses are never blocked.
+SECURITY_BLOCK_TTL = float(os.getenv("SECURITY_BLOCK_TTL", "3600"))
+SECURITY_BLOCKLIST_PATH = os.getenv("SECURITY_BLOCKLIST_PATH", "")
+SECURITY_ALLOWLIST_PATH = os.getenv("SECURITY_ALLOWLIST_PATH", "")
+# Requests kept in the security history (a ring buffer, well under 100 bytes per request)
+SECURITY_LOG_CAPACITY = int(os.getenv("SECURITY_LOG_CAPACITY", "100000"))
+
+# API keys. With API_KEY_STORE_ENABLED, SecurityMiddleware only accepts keys
+# from the hashed key table in API_KEY_DB_PATH (manage them with
+# tools/api_keys.py); otherwise any non-empty key is accepted. Lookups are
+# cached for API_KEY_CACHE_TTL seconds (unknown keys for API_KEY_NEGATIVE_TTL),
+# and changes made by other processes are picked up within
+# API_KEY_RELOAD_INTERVAL seconds.
+API_KEY_STORE_ENABLED = os.getenv("API_KEY_STORE_ENABLED", "False").lower() == "true"
+API_KEY_DB_PATH = os.getenv("API_KEY_DB_PATH", "api_keys.db")
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "300"))
+API_KEY_NEGATIVE_TTL = float(os.getenv("API_KEY_NEGATIVE_TTL", "30"))
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_RELOAD_INTERVAL = float(os.getenv("API_KEY_RELOAD_INTERVAL", "5"))
+# Admin endpoints (SecurityMiddleware's ADMIN_PATHS) need one of the
+# comma-separated ADMIN_API_KEYS, or a stored key with the "admin"
+# permission; with neither configured they are closed.
+ADMIN_API_KEYS = [key.strip() for key in os.getenv("ADMIN_API_KEYS", "").split(",") if key.strip()]
+
+# Request tracing. A TRACE_SAMPLE_RATE fraction of requests record per-stage
+# spans (security checks, masking, cache, upstream calls, log writes).
+# TRACE_EXPORT is "ring" (kept in memory, see /debug/traces), "file"
+# (appended to TRACE_FILE_PATH as NDJSON) or "ring,file".
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "False").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "ring")
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", "traces.ndjson")
+TRACE_FILE_MAX_BYTES = int(os.getenv("TRACE_FILE_MAX_BYTES", str(100 * 1024 * 1024)))
+TRACE_RING_SIZE = int(os.getenv("TRACE_RING_SIZE", "1000"))
+
+# Logging goes through a bounded queue to a background listener thread.
+# LOG_FORMAT is "text" or "json"; LOG_SAMPLE_RATES is per event type,
+# e.g. "request=0.1,response=0.1" (warnings and errors are never sampled out).
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = _parse_mapping(os.getenv("LOG_SAMPLE_RATES", ""), float)
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "512"))
+
+# Debug capture of masked prompts into an in-memory ring buffer (never stdout).
+PROMPT_CAPTURE_ENABLED = os.getenv("PROMPT_CAPTURE_ENABLED", "False").lower() == "true"
+PROMPT_CAPTURE_SIZE = int(os.getenv("PROMPT_CAPTURE_SIZE", "50"))
+PROMPT_CAPTURE_MAX_CHARS = int(os.getenv("PROMPT_CAPTURE_MAX_CHARS", "65536"))
@@ -1,17 +1,42 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from routes import router
+from routes import router, job_queue
+from contextlib import asynccontextmanager
 import os
 import httpx
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from middleware.security import SecurityMiddleware
+from middleware.metrics import MetricsMiddleware
+from middleware.traffic_capture import TrafficCaptureMiddleware
+from middleware.compression import CompressionMiddleware
+from services.traffic_capture import TRAFFIC_RECORDER
+from services.request_log import SECURITY_LOG
+from services.tracing import TRACER
+from services.metrics import REGISTRY
+from services import json_codec
+from services.structured_logging import setup_logging, get_logging_stats, PROMPT_CAPTURE
+from config import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_MAX_FIELD_CHARS
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE
+
+# Configure the queue-backed root logger before anything else starts logging
+setup_logging(LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_MAX_FIELD_CHARS)
+
 from services.proxy_service import ProxyService
 
-app = FastAPI(title="Secure AI Proxy Gateway")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    # uvicorn re-raises the exit signal after shutdown, so atexit alone would leave the gzip stream unterminated
+    TRAFFIC_RECORDER.stop()
+    TRACER.stop()
+
+app = FastAPI(title="Secure AI Proxy Gateway", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +48,15 @@ app.add_middleware(
 
 app.add_middleware(SecurityMiddleware)
 
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+if TRAFFIC_RECORDER.enabled:
+    app.add_middleware(TrafficCaptureMiddleware)
+
+# Added last so it is outermost and also times requests rejected by the security checks
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router)
 
 templates = Jinja2Templates(directory="templates")
@@ -32,42 +66,64 @@ proxy_service = ProxyService()
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     """Serve the main web interface"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return templates.TemplateResponse(request, "index.html", {
+        # The page gzips request bodies this large when the gateway can decompress them
+        "compress_min_bytes": COMPRESSION_MIN_SIZE if COMPRESSION_ENABLED else 0
+    })
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "Secure AI Proxy Gateway"}
 
-@app.api_route("/proxy/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
-async def proxy_request(request: Request, path: str):
-    """
-    Main proxy endpoint that forwards requests to various AI services
-    """
-    try:
-        target_service = request.query_params.get("target", "openrouter")
-
-        response = await proxy_service.forward_request(request, path, target_service)
-        return response
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Proxy error: {str(e)}")
-
 @app.post("/proxy/chat")
 async def proxy_chat(request: Request):
     """
     Specialized chat endpoint for AI conversations
     """
     try:
-        body = await request.json()
-        target_service = body.get("target", "openrouter")
+        body = json_codec.loads(await request.body())
+        # No explicit target lets the router pick the fastest healthy provider
+        target_service = body.get("target")
         
         response = await proxy_service.forward_chat_request(request, body, target_service)
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat proxy error: {str(e)}")
 
+@app.post("/proxy/chat/batch")
+async def proxy_chat_batch(request: Request):
+    """
+    Batch chat endpoint; accepts a JSON array of chat requests, or
+    {"requests": [...], "target": ..., "parallelism": ...}, and streams NDJSON results
+    """
+    try:
+        body = json_codec.loads(await request.body())
+        options = body if isinstance(body, dict) else {}
+        items = body if isinstance(body, list) else options.get("requests")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of chat requests")
+        parallelism = options.get("parallelism")
+        if parallelism is not None and (not isinstance(parallelism, int) or parallelism < 1):
+            raise HTTPException(status_code=400, detail="parallelism must be a positive integer")
+
+        return await proxy_service.forward_chat_batch(
+            request, items, options.get("target"), parallelism
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch proxy error: {str(e)}")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics in the text exposition format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/proxy/status")
 async def proxy_status():
     """Get proxy status and available services"""
@@ -75,5 +131,76 @@ async def proxy_status():
         "status": "operational",
         "available_services": proxy_service.get_available_services(),
         "active_connections": proxy_service.get_active_connections(),
-        "security_enabled": True
+        "security_enabled": True,
+        "response_cache": proxy_service.response_cache.get_stats(),
+        "coalescing": proxy_service.single_flight.get_stats(),
+        "routing": proxy_service.router.get_stats(),
+        "hedging": proxy_service.hedging.get_stats(),
+        "token_budget": proxy_service.token_budget.get_stats(),
+        "response_masking": proxy_service.response_masking.get_stats(),
+        "queued_requests": proxy_service.admission.queued(),
+        "admission": proxy_service.admission.get_stats(),
+        "logging": get_logging_stats(),
+        "jobs": await job_queue.get_stats(),
+        "traffic_capture": TRAFFIC_RECORDER.get_stats(),
+        "tracing": TRACER.get_stats()
     }
+
+@app.get("/debug/prompts")
+async def debug_prompts(limit: int = 20):
+    """Most recent masked prompts, newest first (requires PROMPT_CAPTURE_ENABLED)"""
+    if not PROMPT_CAPTURE.enabled:
+        raise HTTPException(status_code=404, detail="Prompt capture is disabled")
+    return {"prompts": PROMPT_CAPTURE.recent(max(1, min(limit, 500)))}
+
+@app.delete("/debug/prompts")
+async def clear_debug_prompts():
+    """Drop all captured prompts"""
+    PROMPT_CAPTURE.clear()
+    return {"cleared": True}
+
+@app.get("/debug/traces")
+async def debug_traces(limit: int = 20, min_ms: float = 0.0):
+    """Most recent request traces, newest first, optionally only those slower than min_ms"""
+    if not TRACER.enabled or TRACER.ring is None:
+        raise HTTPException(status_code=404, detail="Tracing to the in-memory ring is disabled")
+    return {"traces": TRACER.recent(max(1, min(limit, 500)), min_ms)}
+
+@app.get("/debug/traces/{trace_id}")
+async def debug_trace(trace_id: str):
+    """One trace by its ID (the X-Request-ID response header)"""
+    trace = TRACER.get(trace_id) if TRACER.enabled else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+# Admin keys only; see ADMIN_PATHS in middleware/security.py
+@app.get("/admin/security/requests")
+async def security_requests(ip: Optional[str] = None, start: Optional[float] = None, end: Optional[float] = None,
+                            cursor: Optional[int] = None, limit: int = 100):
+    """
+    Page through the security request history, newest first.
+
+    start/end are Unix timestamps; pass next_cursor from a page as cursor to get the next one.
+    """
+    requests, next_cursor = SECURITY_LOG.query(start, end, ip, cursor, max(1, min(limit, 1000)))
+    return {"requests": requests, "next_cursor": next_cursor, "log": SECURITY_LOG.get_stats()}
+
+# The catch-all proxy route must be registered last so it does not shadow
+# /proxy/chat and /proxy/status above.
+@app.api_route("/proxy/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
+async def proxy_request(request: Request, path: str):
+    """
+    Main proxy endpoint that forwards requests to various AI services
+    """
+    try:
+        target_service = request.query_params.get("target", "openrouter")
+
+        response = await proxy_service.forward_request(request, path, target_service)
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Proxy error: {str(e)}")
+
@@ -4,11 +4,44 @@ from typing import Dict, List, Tuple, Optional
 from config import SENSITIVE_PATTERNS, CODE_PATTERNS, BUSINESS_PATTERNS, USE_SECURE_FILTER, SECURITY_LEVEL
 import hashlib
 import sys
+import time
+from services.metrics import MASKING_LATENCY, MASKED_ENTITIES, current_route
+from services.tracing import current_request_id, span
 sys.path.append('../ai_proxy_admin_dashboard')
-from ai_proxy_admin_dashboard.sqlite_logger import log_masking_event
+from ai_proxy_admin_dashboard.sqlite_logger import log_masking_event, log_masking_events
 from ai_proxy_admin_dashboard.sqlite_logger import init_db
 init_db()
 
+# Patterns of the code and business masking stages, module level so the
+# streaming masker can tell where a match may cross a chunk boundary
+IMPORT_PATTERNS = [
+    r"^(import|from|using|require|include)\s+[^\n]+",
+    r"^\s*(import|from|using|require|include)\s+[^\n]+"
+]
+FILE_PATH_PATTERNS = [
+    r"['\"][^'\"]*\.(py|js|ts|java|cpp|c|cs|php|rb|go|rs|swift|kt|scala|r|m|pl|sh|bash|ps1|vbs|sql|html|css|xml|json|yaml|yml|toml|ini|cfg|conf|config)['\"]",
+    r"['\"][^'\"]*/(?:[^/\n]+/)*[^/\n]*['\"]",
+    r"['\"][^'\"]*[A-Za-z]:\\(?:[^\\\n]+\\)*[^\\\n]*['\"]"
+]
+CONFIG_PATTERNS = [
+    r"(\w+)\s*[:=]\s*['\"][^'\"]+['\"]",  # key: "value" or key = "value"
+    r"(\w+)\s*[:=]\s*\d+",  # key: 123 or key = 123
+]
+
+COMPANY_PATTERNS = [
+    r"\b[A-Z]{2,}\s+(?:Inc|Corp|LLC|Ltd|Company|Corporation)\b",
+    r"\b(?:company|organization|enterprise|business)\s+[A-Z][a-z]+\b",
+]
+FINANCIAL_PATTERNS = [
+    r"\$\d+(?:,\d{3})*(?:\.\d{2})?",  # Currency amounts
+    r"\b\d+(?:,\d{3})*(?:\.\d{2})?\s*(?:dollars?|USD|EUR|GBP)\b",
+    r"\b(?:revenue|profit|margin|cost|budget)\s*[:=]\s*[\$]?\d+",
+]
+PROJECT_PATTERNS = [
+    r"\b(?:project|initiative|strategy|roadmap)\s+[A-Z][a-zA-Z\s]+",
+    r"\b[A-Z][a-zA-Z\s]{3,}(?:Project|Initiative|Strategy|Roadmap)\b",
+]
+
 
 class SmartMasker:
     def __init__(self, security_level: str = "high"):
@@ -58,11 +91,13 @@ class SmartMasker:
         
         return content_types
     
-    def mask_sensitive_patterns(self, text: str) -> str:
-        """Mask sensitive patterns while preserving context"""
+    def mask_sensitive_patterns(self, text: str, categories: Optional[List[str]] = None) -> str:
+        """Mask sensitive patterns while preserving context (only the given categories, if any)"""
         masked_text = text
         
         for category, patterns in SENSITIVE_PATTERNS.items():
+            if categories is not None and category not in categories:
+                continue
             for pattern in patterns:
                 matches = re.finditer(pattern, masked_text, re.IGNORECASE)
                 for match in matches:
@@ -121,29 +156,13 @@ class SmartMasker:
         """Intelligently mask code while preserving structure and logic"""
         masked_text = text
         
-        import_patterns = [
-            r"^(import|from|using|require|include)\s+[^\n]+",
-            r"^\s*(import|from|using|require|include)\s+[^\n]+"
-        ]
-        
-        for pattern in import_patterns:
+        for pattern in IMPORT_PATTERNS:
             masked_text = re.sub(pattern, "<IMPORT_STATEMENT>", masked_text, flags=re.MULTILINE | re.IGNORECASE)
         
-        file_path_patterns = [
-            r"['\"][^'\"]*\.(py|js|ts|java|cpp|c|cs|php|rb|go|rs|swift|kt|scala|r|m|pl|sh|bash|ps1|vbs|sql|html|css|xml|json|yaml|yml|toml|ini|cfg|conf|config)['\"]",
-            r"['\"][^'\"]*/(?:[^/\n]+/)*[^/\n]*['\"]",
-            r"['\"][^'\"]*[A-Za-z]:\\(?:[^\\\n]+\\)*[^\\\n]*['\"]"
-        ]
-        
-        for pattern in file_path_patterns:
+        for pattern in FILE_PATH_PATTERNS:
             masked_text = re.sub(pattern, '"<FILE_PATH>"', masked_text)
         
-        config_patterns = [
-            r"(\w+)\s*[:=]\s*['\"][^'\"]+['\"]",  # key: "value" or key = "value"
-            r"(\w+)\s*[:=]\s*\d+",  # key: 123 or key = 123
-        ]
-        
-        for pattern in config_patterns:
+        for pattern in CONFIG_PATTERNS:
             masked_text = re.sub(pattern, r"\1 = <CONFIG_VALUE>", masked_text)
         
         return masked_text
@@ -152,29 +171,13 @@ class SmartMasker:
         """Mask business-sensitive content while preserving document structure"""
         masked_text = text
         
-        company_patterns = [
-            r"\b[A-Z]{2,}(?:[A-Z][a-z]+)*\s+(?:Inc|Corp|LLC|Ltd|Company|Corporation)\b",
-            r"\b(?:company|organization|enterprise|business)\s+[A-Z][a-z]+\b",
-        ]
-        
-        for pattern in company_patterns:
+        for pattern in COMPANY_PATTERNS:
             masked_text = re.sub(pattern, "<COMPANY_NAME>", masked_text, flags=re.IGNORECASE)
         
-        financial_patterns = [
-            r"\$\d+(?:,\d{3})*(?:\.\d{2})?",  # Currency amounts
-            r"\b\d+(?:,\d{3})*(?:\.\d{2})?\s*(?:dollars?|USD|EUR|GBP)\b",
-            r"\b(?:revenue|profit|margin|cost|budget)\s*[:=]\s*[\$]?\d+",
-        ]
-        
-        for pattern in financial_patterns:
+        for pattern in FINANCIAL_PATTERNS:
             masked_text = re.sub(pattern, "<FINANCIAL_AMOUNT>", masked_text, flags=re.IGNORECASE)
         
-        project_patterns = [
-            r"\b(?:project|initiative|strategy|roadmap)\s+[A-Z][a-zA-Z\s]+",
-            r"\b[A-Z][a-zA-Z\s]{3,}(?:Project|Initiative|Strategy|Roadmap)\b",
-        ]
-        
-        for pattern in project_patterns:
+        for pattern in PROJECT_PATTERNS:
             masked_text = re.sub(pattern, "<PROJECT_NAME>", masked_text, flags=re.IGNORECASE)
         
         return masked_text
@@ -209,8 +212,12 @@ class SmartMasker:
         
         return clues
     
-    def generate_ai_prompt(self, content_types: Dict[str, bool], clues: List[str], masking_stats: Dict) -> str:
+    def generate_ai_prompt(self, content_types: Dict[str, bool], clues: List[str], masking_stats: Dict,
+                           compact: bool = False) -> str:
         """Generate an AI-friendly prompt that explains the masking and provides context"""
+        if compact:
+            return self.generate_compact_prompt(content_types, clues, masking_stats)
+
         prompt_parts = []
         
         prompt_parts.append(" SECURITY NOTICE: This content has been automatically redacted to protect sensitive information.")
@@ -243,7 +250,19 @@ class SmartMasker:
         
         return "\n".join(prompt_parts)
 
-def smart_mask(text: str, file_name: str = "", use_secure_filter: bool = None) -> Tuple[str, str]:
+    def generate_compact_prompt(self, content_types: Dict[str, bool], clues: List[str], masking_stats: Dict) -> str:
+        """One-line variant of generate_ai_prompt carrying the same information in far fewer tokens"""
+        parts = ["Redacted content"]
+        content_type = next((name for name in ("code", "business_document", "technical_document") if content_types[name]), None)
+        if content_type:
+            parts.append(f"type: {content_type.replace('_', ' ')}")
+        if masking_stats["pii_masked"] > 0:
+            parts.append(f"{masking_stats['pii_masked']} sensitive elements masked")
+        if clues:
+            parts.append("context: " + "; ".join(clues))
+        return "[" + " | ".join(parts) + "] Analyze structure, logic and design; suggest improvements.\n\n"
+
+def smart_mask(text: str, file_name: str = "", use_secure_filter: bool = None, compact: bool = False) -> Tuple[str, str]:
     """
     Enhanced smart masking function that filters PII, source code, and business secrets
     while maintaining context and accuracy.
@@ -252,6 +271,7 @@ def smart_mask(text: str, file_name: str = "", use_secure_filter: bool = None) -
         text: Input text to mask
         file_name: Name of the file (for context)
         use_secure_filter: Override the global setting
+        compact: Use the one-line preamble instead of the full notice
     
     Returns:
         Tuple of (masked_text, ai_prompt)
@@ -262,6 +282,57 @@ def smart_mask(text: str, file_name: str = "", use_secure_filter: bool = None) -
     if not use_secure_filter:
         return text, " PERSONAL MODE: Content is being processed without security filtering.\n\n"
     
+    masked_text, ai_prompt, masked_type_counts = _mask_text(text, compact)
+    file_type = file_name.split('.')[-1] if '.' in file_name else "txt"
+    request_id = current_request_id.get()
+    with span("masking.log_write", events=len(masked_type_counts)):
+        for masked_type, count in masked_type_counts.items():
+            log_masking_event(masked_type, file_type, count, request_id)
+    return masked_text, ai_prompt
+
+
+def smart_mask_batch(texts: List[str], file_name: str = "", use_secure_filter: bool = None,
+                     compact: bool = False) -> List[Tuple[str, str]]:
+    """
+    Mask several texts in one call.
+
+    Each text is masked exactly as smart_mask would, but the masking events
+    are aggregated and written to the log database in a single transaction.
+
+    Returns:
+        List of (masked_text, ai_prompt), in input order
+    """
+    if use_secure_filter is None:
+        use_secure_filter = USE_SECURE_FILTER
+
+    if not use_secure_filter:
+        return [smart_mask(text, file_name, False) for text in texts]
+
+    results = []
+    totals: Dict[str, int] = {}
+    for text in texts:
+        masked_text, ai_prompt, masked_type_counts = _mask_text(text, compact)
+        results.append((masked_text, ai_prompt))
+        for masked_type, count in masked_type_counts.items():
+            totals[masked_type] = totals.get(masked_type, 0) + count
+
+    file_type = file_name.split('.')[-1] if '.' in file_name else "txt"
+    with span("masking.log_write", events=len(totals)):
+        log_masking_events([(masked_type, file_type, count) for masked_type, count in totals.items()],
+                           current_request_id.get())
+    return results
+
+
+def _mask_text(text: str, compact: bool = False) -> Tuple[str, str, Dict[str, int]]:
+    """Run the masking pipeline on one text; returns (masked_text, ai_prompt, counts per masked type)"""
+    with span("mask", chars=len(text)) as mask_span:
+        masked_text, ai_prompt, masked_type_counts = _run_masking(text, compact)
+        mask_span.set(entities=sum(masked_type_counts.values()))
+    return masked_text, ai_prompt, masked_type_counts
+
+
+def _run_masking(text: str, compact: bool) -> Tuple[str, str, Dict[str, int]]:
+    start = time.perf_counter()
     masker = SmartMasker(SECURITY_LEVEL)
     
    
@@ -280,18 +351,40 @@ def smart_mask(text: str, file_name: str = "", use_secure_filter: bool = None) -
     
     clues = masker.extract_context_clues(text, content_types)
     
-    ai_prompt = masker.generate_ai_prompt(content_types, clues, masker.masking_stats)
+    ai_prompt = masker.generate_ai_prompt(content_types, clues, masker.masking_stats, compact)
     
-    user_id = "user@example.com"  # Replace with session, IP, or random for real use
-    user_hash = hashlib.sha256(user_id.encode()).hexdigest()[:8]
-    file_type = file_name.split('.')[-1] if '.' in file_name else "txt"
     masked_type_counts = {t: masker.masking_stats["sensitive_patterns_found"].count(t) for t in set(masker.masking_stats["sensitive_patterns_found"])}
+    route = current_route.get()
+    MASKING_LATENCY.observe(time.perf_counter() - start, route)
     for masked_type, count in masked_type_counts.items():
-        log_masking_event(masked_type, file_type, count)
-    return masked_text, ai_prompt
+        MASKED_ENTITIES.inc(route, masked_type, amount=count)
+    return masked_text, ai_prompt, masked_type_counts
     
 
 
+_WARMUP_TEXT = (
+    "import os\n"
+    "def charge(card_number, amount):\n"
+    "    api_key = \"sk-test-1234567890abcdef\"  # Acme Corp revenue: $1,200.00\n"
+    "    return post(\"https://payments.example.com/v1\", timeout=30)\n"
+    "Contact jane.doe@example.com or 555-123-4567 about Project Apollo.\n"
+)
+
+
+def warmup():
+    """
+    Compile every masking pattern into the re module cache without logging
+    or counting anything. Run once before forking server workers so they
+    share the compiled patterns instead of each compiling their own.
+    """
+    masker = SmartMasker(SECURITY_LEVEL)
+    masker.detect_content_type(_WARMUP_TEXT)
+    masked_text = masker.mask_sensitive_patterns(_WARMUP_TEXT)
+    masker.mask_code_content(masked_text)
+    masker.mask_business_content(masked_text)
+    masker.extract_context_clues(_WARMUP_TEXT, {"code": True})
+
+
 def get_masking_stats() -> Dict:
     """Get statistics about the last masking operation"""
     return {
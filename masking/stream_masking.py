@@ -0,0 +1,251 @@
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from config import (
+    SENSITIVE_PATTERNS, SECURITY_LEVEL, STREAM_MASK_HOLDBACK, STREAM_MASK_MAX_BUFFER
+)
+from masking.smart_masking import (
+    SmartMasker, log_masking_events, IMPORT_PATTERNS, FILE_PATH_PATTERNS, CONFIG_PATTERNS,
+    COMPANY_PATTERNS, FINANCIAL_PATTERNS, PROJECT_PATTERNS
+)
+from services.metrics import MASKING_LATENCY, MASKED_ENTITIES, current_route
+
+_SENSITIVE_RES = {
+    category: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for category, patterns in SENSITIVE_PATTERNS.items()
+}
+_CODE_RES = ([re.compile(pattern, re.MULTILINE | re.IGNORECASE) for pattern in IMPORT_PATTERNS]
+             + [re.compile(pattern) for pattern in FILE_PATH_PATTERNS + CONFIG_PATTERNS])
+_BUSINESS_RES = [re.compile(pattern, re.IGNORECASE) for pattern in COMPANY_PATTERNS + FINANCIAL_PATTERNS + PROJECT_PATTERNS]
+
+_NON_SPACE_RE = re.compile(r"\S*")
+
+# Times the cut steps back past a match before the head is released anyway
+_MAX_RETRIES = 8
+
+# With align_lines, cuts go to a line start only if one is this close; long
+# lines (minified code, text without line breaks) are cut between words
+_LINE_LOOKBACK = 4096
+
+_NO_CONTENT_TYPES = {"code": False, "business_document": False, "technical_document": False, "personal_data": False}
+
+
+class StreamMasker:
+    """
+    Incremental version of smart_mask's pipeline for text that arrives in pieces.
+
+    feed() masks and returns everything but the end of the buffer, which is
+    kept until more text arrives: the trailing partial word and holdback
+    characters before it, so a multi-word match such as "api_key = ..." is
+    not split. The cut goes to a line start (with align_lines, which keeps
+    ^-anchored code patterns correct) or else between words, and steps back
+    past a match that crosses it. Each released window is masked once, so
+    the cost stays linear in the text and the buffer stays around one piece
+    plus holdback. If nothing can be released and the buffer reaches
+    max_buffer characters, it is cut anyway; forced_cuts counts how often.
+
+    Content types gate the code and business stages like in smart_mask, but
+    are decided up front (from_sample) since the whole text is never held.
+    categories limits the sensitive patterns applied to those SENSITIVE_PATTERNS
+    categories.
+    """
+
+    def __init__(self, content_types: Optional[Dict[str, bool]] = None, holdback: int = STREAM_MASK_HOLDBACK,
+                 max_buffer: int = STREAM_MASK_MAX_BUFFER, align_lines: bool = True,
+                 security_level: str = SECURITY_LEVEL, categories: Optional[List[str]] = None):
+        self.security_level = security_level
+        self.masker = SmartMasker(security_level)
+        self.content_types = content_types or dict(_NO_CONTENT_TYPES)
+        self.clues: List[str] = []
+        self.holdback = holdback
+        self.max_buffer = max(max_buffer, holdback + 1)
+        self.align_lines = align_lines
+        self.categories = categories
+        self._regexes = [
+            regex for category, regexes in _SENSITIVE_RES.items()
+            if categories is None or category in categories for regex in regexes
+        ]
+        if self.content_types["code"]:
+            self._regexes += _CODE_RES
+        if self.content_types["business_document"]:
+            self._regexes += _BUSINESS_RES
+        self._buffer = ""
+        self._counts: Dict[str, int] = {}
+
+        self.chars_in = 0
+        self.chars_out = 0
+        self.peak_buffer = 0
+        self.forced_cuts = 0
+        self.mask_seconds = 0.0
+
+    @classmethod
+    def from_sample(cls, sample: str, **kwargs) -> "StreamMasker":
+        """
+        Detect content types and context clues on the start of the text
+        """
+        probe = SmartMasker(kwargs.get("security_level", SECURITY_LEVEL))
+        content_types = probe.detect_content_type(sample)
+        stream = cls(content_types, **kwargs)
+        stream.masker.masking_stats.update(
+            code_detected=probe.masking_stats["code_detected"],
+            business_content_detected=probe.masking_stats["business_content_detected"]
+        )
+        stream.clues = probe.extract_context_clues(sample, content_types)
+        return stream
+
+    def preamble(self, compact: bool = False) -> str:
+        """
+        The AI notice for this text. The number of masked elements is not known
+        until the end, so it is left out here; see summary()
+        """
+        stats = dict(self.masker.masking_stats, pii_masked=0)
+        return self.masker.generate_ai_prompt(self.content_types, self.clues, stats, compact)
+
+    def summary(self) -> str:
+        """
+        Closing note with the masked element count, to follow the text
+        """
+        masked = sum(self._counts.values())
+        return f"\n\n[{masked} sensitive elements masked]\n" if masked else ""
+
+    def feed(self, text: str) -> str:
+        """
+        Add text; returns the masked text released so far, if any
+        """
+        self.chars_in += len(text)
+        self._buffer += text
+        self.peak_buffer = max(self.peak_buffer, len(self._buffer))
+        return self._take(self.holdback)
+
+    def drain(self) -> str:
+        """
+        Release what only the holdback is keeping: everything but the trailing
+        partial word and any match that may still grow. A match that has not
+        started matching yet (the first words of "api_key = ...") can be split
+        """
+        return self._take(0)
+
+    def flush(self) -> str:
+        """
+        Mask and release everything buffered, as if the text ended here
+        """
+        if not self._buffer:
+            return ""
+        start = time.perf_counter()
+        masked, found = self._apply(self._buffer)
+        self.mask_seconds += time.perf_counter() - start
+        self._buffer = ""
+        return self._commit(masked, found)
+
+    def finish(self) -> str:
+        """
+        Mask whatever is still buffered and record the metrics for the whole stream
+        """
+        out = self.flush()
+        route = current_route.get()
+        MASKING_LATENCY.observe(self.mask_seconds, route)
+        for masked_type, count in self._counts.items():
+            MASKED_ENTITIES.inc(route, masked_type, amount=count)
+        return out
+
+    def pending(self) -> int:
+        """Characters fed but not yet released"""
+        return len(self._buffer)
+
+    def masked_type_counts(self) -> Dict[str, int]:
+        return dict(self._counts)
+
+    def log_events(self, file_type: str):
+        """Write this stream's masking counts to the admin log database"""
+        log_masking_events([(masked_type, file_type, count) for masked_type, count in self._counts.items()])
+
+    def get_stats(self) -> Dict:
+        return {
+            "chars_in": self.chars_in,
+            "chars_out": self.chars_out,
+            "peak_buffer_chars": self.peak_buffer,
+            "forced_cuts": self.forced_cuts,
+            "masking_seconds": round(self.mask_seconds, 4),
+            "masked": self.masked_type_counts()
+        }
+
+    def _take(self, holdback: int) -> str:
+        start = time.perf_counter()
+        cut, masked, found = self._release(holdback)
+        self.mask_seconds += time.perf_counter() - start
+        if cut == 0:
+            return ""
+        self._buffer = self._buffer[cut:]
+        return self._commit(masked, found)
+
+    def _release(self, holdback: int) -> Tuple[int, str, List[str]]:
+        """
+        Pick how much of the buffer to release and mask it; returns (cut, masked head, masked types found)
+        """
+        buffer = self._buffer
+        size = len(buffer)
+        # Reversed, the trailing partial word is a plain prefix match
+        partial = _NON_SPACE_RE.match(buffer[-self.max_buffer:][::-1]).end()
+        cut = self._boundary(size - partial - holdback)
+
+        # Step back past a match that crosses the cut: it would be split, or
+        # if it runs to the end of the buffer it may still grow. Only matches
+        # starting within holdback characters of the cut are looked for, and
+        # only _MAX_RETRIES times, so the cost does not grow with the buffer.
+        # Patterns that match almost anywhere (names) can always cross the
+        # cut; the head is then released at the last cut tried.
+        for _ in range(_MAX_RETRIES):
+            if cut == 0:
+                break
+            crossing = self._crossing_match(self._boundary(cut - self.holdback), cut)
+            if crossing is None:
+                break
+            cut = self._boundary(crossing)
+
+        if cut == 0:
+            if size < self.max_buffer:
+                return 0, "", []
+            self.forced_cuts += 1
+            cut = self._boundary(size - self.holdback) or size - self.holdback
+        # Each released window is masked once
+        return (cut,) + self._apply(buffer[:cut])
+
+    def _crossing_match(self, start: int, cut: int) -> Optional[int]:
+        """Start of a match beginning before cut that ends after it"""
+        size = len(self._buffer)
+        for regex in self._regexes:
+            for match in regex.finditer(self._buffer, start, size):
+                if match.start() >= cut:
+                    break
+                if match.end() > cut:
+                    return match.start()
+        return None
+
+    def _boundary(self, position: int) -> int:
+        """
+        Where to cut at or before position: with align_lines the line start,
+        unless that is more than _LINE_LOOKBACK characters back, else the word start
+        """
+        if position <= 0:
+            return 0
+        if self.align_lines:
+            line_start = self._buffer.rfind("\n", 0, position) + 1
+            if line_start > 0 and position - line_start <= _LINE_LOOKBACK:
+                return line_start
+        return max(self._buffer.rfind(" ", 0, position), self._buffer.rfind("\n", 0, position)) + 1
+
+    def _apply(self, text: str) -> Tuple[str, List[str]]:
+        masker = SmartMasker(self.security_level)
+        masked = masker.mask_sensitive_patterns(text, self.categories)
+        if self.content_types["code"]:
+            masked = masker.mask_code_content(masked)
+        if self.content_types["business_document"]:
+            masked = masker.mask_business_content(masked)
+        return masked, masker.masking_stats["sensitive_patterns_found"]
+
+    def _commit(self, masked: str, found: List[str]) -> str:
+        # Only counts are kept, so a long stream does not grow a per-match list
+        for masked_type in found:
+            self._counts[masked_type] = self._counts.get(masked_type, 0) + 1
+        self.chars_out += len(masked)
+        return masked
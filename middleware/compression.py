@@ -0,0 +1,122 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from config import COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL, REQUEST_MAX_DECOMPRESSED_BYTES
+from services.compression import ENCODINGS, BodyTooLarge, Decoder, Encoder, negotiate
+from services.metrics import COMPRESSION_BYTES
+
+_COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript", "application/xml", "image/svg+xml"
+)
+
+
+def _compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return (media_type.startswith("text/") or media_type in _COMPRESSIBLE_TYPES
+            or media_type.endswith("+json") or media_type.endswith("+xml"))
+
+
+class CompressionMiddleware:
+    """
+    Raw ASGI middleware for compressed request and response bodies.
+
+    Request bodies sent with a supported Content-Encoding are decompressed
+    chunk by chunk as the app reads them. More than max_request_size
+    decompressed bytes fails the request with 413.
+
+    Responses of at least min_size bytes are compressed with the best
+    encoding the client accepts. Streaming responses (no Content-Length) are
+    compressed chunk by chunk with a sync flush, so each chunk still goes
+    out as soon as it is produced instead of waiting for the next one.
+    """
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE, level: int = COMPRESSION_LEVEL,
+                 max_request_size: int = REQUEST_MAX_DECOMPRESSED_BYTES):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.max_request_size = max_request_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "").strip().lower()
+        if content_encoding and content_encoding != "identity":
+            if content_encoding not in ENCODINGS:
+                response = JSONResponse(
+                    status_code=415,
+                    content={"error": "Unsupported content-encoding", "supported": list(ENCODINGS)}
+                )
+                await response(scope, receive, send)
+                return
+            # In place, so outer middleware still sees what the router adds to the scope
+            scope["headers"] = [
+                (name, value) for name, value in scope["headers"]
+                if name not in (b"content-encoding", b"content-length")
+            ]
+            receive = self._decompressing(receive, Decoder(content_encoding, self.max_request_size))
+
+        encoding = negotiate(headers.get("accept-encoding", "")) if scope["method"] != "HEAD" else None
+        if encoding is not None:
+            send = self._compressing(send, encoding)
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _decompressing(receive, decoder: Decoder):
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            body = message.get("body", b"")
+            try:
+                decoded = decoder.decompress(body)
+                if not message.get("more_body", False):
+                    decoded += decoder.finish()
+            except BodyTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Malformed compressed request body: {e}")
+            COMPRESSION_BYTES.inc("request", decoder.encoding, "encoded", amount=len(body))
+            COMPRESSION_BYTES.inc("request", decoder.encoding, "identity", amount=len(decoded))
+            return dict(message, body=decoded)
+
+        return receive_wrapper
+
+    def _compressing(self, send, encoding: str):
+        encoder = None
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal encoder, streaming
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=list(message["headers"]))
+                content_type = headers.get("content-type", "")
+                if _compressible(content_type):
+                    headers.add_vary_header("Accept-Encoding")
+                    length = headers.get("content-length")
+                    if (message["status"] >= 200 and message["status"] not in (204, 304)
+                            and "content-encoding" not in headers and "content-range" not in headers
+                            and (length is None or int(length) >= self.min_size)):
+                        encoder = Encoder(encoding, self.level)
+                        streaming = length is None
+                        headers["content-encoding"] = encoding
+                        if length is not None:
+                            del headers["content-length"]
+                message = dict(message, headers=headers.raw)
+
+            elif message["type"] == "http.response.body" and encoder is not None:
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                out = encoder.compress(body, flush=streaming) if more_body else encoder.finish(body)
+                COMPRESSION_BYTES.inc("response", encoding, "identity", amount=len(body))
+                COMPRESSION_BYTES.inc("response", encoding, "encoded", amount=len(out))
+                if not out and more_body:
+                    return
+                message = dict(message, body=out)
+
+            await send(message)
+
+        return send_wrapper
@@ -0,0 +1,44 @@
+import time
+from services.metrics import REQUESTS, RATE_LIMITED, SERVER_ERRORS, REQUEST_LATENCY
+
+
+class MetricsMiddleware:
+    """
+    Raw ASGI middleware recording per-route request counts and end-to-end latency.
+
+    The route label is the matched route template (e.g. /proxy/{path:path}),
+    not the raw path, so label cardinality stays bounded. Handlers report
+    the upstream they used through request.state.target_service.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        state = scope.setdefault("state", {})
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_label = getattr(route, "path", "unmatched")
+            target = state.get("target_service", "none")
+            status = status_holder[0]
+
+            REQUESTS.inc(route_label, target, scope["method"], str(status))
+            if status == 429:
+                RATE_LIMITED.inc(route_label, target)
+            elif status >= 500:
+                SERVER_ERRORS.inc(route_label, target)
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route_label, target)
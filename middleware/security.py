@@ -1,205 +1,336 @@
-from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
+from urllib.parse import parse_qsl
+import hmac
 import time
-import hashlib
 import json
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+from services.ip_rates import IPRateTracker
+from services.request_log import RequestLog, SECURITY_LOG
+from services.api_keys import APIKeyStore, API_KEY_STORE
+from services.ip_blocklist import IPPrefixTree
+from services.tracing import TRACER, IDS, current_request_id, span
+from config import SECURITY_MAX_REQUESTS_PER_MINUTE, SECURITY_TRACKED_IPS, API_KEY_STORE_ENABLED
+from config import SECURITY_BLOCK_TTL, SECURITY_BLOCKLIST_PATH, SECURITY_ALLOWLIST_PATH, ADMIN_API_KEYS
 
 logger = logging.getLogger(__name__)
 
+# API key checks are skipped for these paths
+PUBLIC_PATHS = frozenset(["/health", "/proxy/status", "/metrics", "/"])
+
+# Admin endpoints: only open to admin keys, and exempt from the probing check
+# on /admin paths. Any other /admin path is still treated as probing
+ADMIN_PATHS = frozenset(["/admin/security/requests", "/debug/prompts", "/debug/traces"])
+# ...and everything under these
+ADMIN_PATH_PREFIXES = ("/debug/traces/",)
+
 class SecurityMiddleware:
-    def __init__(self):
-        self.api_keys = {}  
-        self.blocked_ips = set()  
-        self.request_logs = [] 
-        
-    async def __call__(self, request: Request, call_next):
+    """
+    Raw ASGI middleware for IP blocking, API key checks and request logging.
+
+    Works on the scope and its raw header list instead of building a Request
+    per call, and adds X-Security-Proxy / X-Request-ID by wrapping send, so
+    streaming responses pass through untouched.
+    """
+
+    def __init__(self, app, max_requests_per_minute: int = SECURITY_MAX_REQUESTS_PER_MINUTE,
+                 tracked_ips: int = SECURITY_TRACKED_IPS, request_log: Optional[RequestLog] = None,
+                 key_store: Optional[APIKeyStore] = None, block_ttl: float = SECURITY_BLOCK_TTL,
+                 blocklist_path: str = SECURITY_BLOCKLIST_PATH, allowlist_path: str = SECURITY_ALLOWLIST_PATH,
+                 admin_keys: Optional[List[str]] = None):
+        self.app = app
+        # Without a key store any non-empty key is accepted
+        self.key_store = key_store if key_store is not None else (API_KEY_STORE if API_KEY_STORE_ENABLED else None)
+        # Keys added with add_api_key when there is no key store
+        self.api_keys = {}
+        self.key_rates = IPRateTracker(window=60, max_ips=tracked_ips)
+        self.admin_keys = [key.encode() for key in (admin_keys if admin_keys is not None else ADMIN_API_KEYS)]
+        # CIDR-aware; entries added on suspicious activity expire after block_ttl
+        self.blocklist = IPPrefixTree()
+        self.allowlist = IPPrefixTree()
+        self.block_ttl = block_ttl
+        for name, tree, path in (("blocklist", self.blocklist, blocklist_path),
+                                 ("allowlist", self.allowlist, allowlist_path)):
+            if path:
+                started = time.perf_counter()
+                count = tree.load_file(path, reason=name)
+                logger.info(f"Loaded {count} IP ranges into the {name} in {time.perf_counter() - started:.2f}s")
+        self.request_log = request_log if request_log is not None else SECURITY_LOG
+        self.max_requests_per_minute = max_requests_per_minute
+        self.ip_rates = IPRateTracker(window=60, max_ips=tracked_ips)
+
+    async def __call__(self, scope, receive, send):
         """
         Process the request through security checks
         """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Set for every request so logs and masking events can carry it; spans only when sampled
+        request_id = self._generate_request_id()
+        token = current_request_id.set(request_id)
+        try:
+            with TRACER.trace(request_id, "request", method=scope["method"], path=scope["path"]) as root:
+                root.set(status_code=await self._handle(scope, receive, send, request_id))
+        finally:
+            current_request_id.reset(token)
+
+    async def _handle(self, scope, receive, send, request_id: str) -> int:
+        """
+        Run the checks, then the app; returns the response status
+        """
         start_time = time.time()
-        
-       
-        client_ip = request.client.host if request.client else "unknown"
-        user_agent = request.headers.get("user-agent", "")
-        
-       
-        if client_ip in self.blocked_ips:
-            return JSONResponse(
-                status_code=403,
-                content={"error": "Access denied", "reason": "IP address blocked"}
-            )
-        
-      
-        api_key = self._extract_api_key(request)
-        if not self._validate_api_key(api_key):
-         
-            if request.url.path in ["/health", "/proxy/status", "/"]:
-                pass
-            else:
-                return JSONResponse(
-                    status_code=401,
-                    content={"error": "Invalid or missing API key"}
-                )
-        
-        if self._detect_suspicious_activity(request):
-            self.blocked_ips.add(client_ip)
-            return JSONResponse(
-                status_code=403,
-                content={"error": "Access denied", "reason": "Suspicious activity detected"}
-            )
-        
-      
-        self._log_request(request, client_ip, user_agent, api_key)
-        
-   
+
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        path = scope["path"]
+        authorization, x_api_key, user_agent = self._read_headers(scope["headers"])
+
+        with span("security.checks") as checks:
+            api_key = self._extract_api_key(authorization, x_api_key, scope.get("query_string", b""))
+            key_record = self._validate_api_key(api_key)
+            rejection = self._check(scope, client_ip, path, user_agent, api_key, key_record)
+            if rejection is not None:
+                checks.set(rejected=rejection[0])
+        if rejection is not None:
+            await self._reject(scope, receive, send, *rejection)
+            return rejection[0]
+
+
+        log_seq = self._log_request(scope, start_time, client_ip, user_agent, api_key)
+
+        scope.setdefault("state", {})["request_id"] = request_id
+        security_headers = [(b"x-security-proxy", b"enabled"), (b"x-request-id", request_id.encode("latin-1"))]
+        status_holder = [0]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                message["headers"] = list(message.get("headers", ())) + security_headers
+            await send(message)
+
         try:
-            response = await call_next(request)
-            
-            response.headers["X-Security-Proxy"] = "enabled"
-            response.headers["X-Request-ID"] = self._generate_request_id(request)
-            
-            process_time = time.time() - start_time
-            self._log_response(request, response, process_time)
-            
-            return response
-            
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
+            # Once the response has started there is nothing left to replace it with
+            if status_holder[0]:
+                raise
             logger.error(f"Request processing error: {str(e)}")
-            return JSONResponse(
-                status_code=500,
-                content={"error": "Internal server error"}
-            )
-    
-    def _extract_api_key(self, request: Request) -> Optional[str]:
+            status_holder[0] = 500
+            await self._reject(scope, receive, send, 500, {"error": "Internal server error"})
+
+        process_time = time.time() - start_time
+        self.request_log.complete(log_seq, status_holder[0], process_time)
+        self._log_response(client_ip, path, status_holder[0], process_time)
+        return status_holder[0]
+
+    def _check(self, scope, client_ip: str, path: str, user_agent: str, api_key: Optional[str],
+               key_record) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        The (status, body) to reject the request with, or None to let it through
+        """
+        if self.blocklist and self.blocklist.match(client_ip) and not self.allowlist.match(client_ip):
+            return 403, {"error": "Access denied", "reason": "IP address blocked"}
+
+
+        if not key_record:
+
+            if path not in PUBLIC_PATHS:
+                return 401, {"error": "Invalid or missing API key"}
+
+        admin_path = path in ADMIN_PATHS or path.startswith(ADMIN_PATH_PREFIXES)
+        if self._detect_suspicious_activity(client_ip, path, user_agent, check_path=not admin_path):
+            self.block_ip(client_ip, self.block_ttl, reason="suspicious activity")
+            return 403, {"error": "Access denied", "reason": "Suspicious activity detected"}
+
+        if admin_path and not self._is_admin(api_key, key_record):
+            return 403, {"error": "Admin API key required"}
+
+        if isinstance(key_record, dict):
+            if not self.key_store.allows(key_record, path):
+                return 403, {"error": "API key not permitted for this path"}
+            limit = key_record["rate_limit_per_minute"]
+            if limit and self.key_rates.hit(key_record["id"]) > limit:
+                return 429, {"error": "API key rate limit exceeded"}
+            scope.setdefault("state", {})["api_key"] = key_record
+
+        return None
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, content: Dict[str, Any]):
+        response = JSONResponse(status_code=status_code, content=content)
+        await response(scope, receive, send)
+
+    @staticmethod
+    def _read_headers(headers) -> Tuple[str, Optional[str], str]:
+        """
+        Authorization, X-API-Key and User-Agent from the raw header list, in one pass
+        """
+        authorization, x_api_key, user_agent = "", None, ""
+        for name, value in headers:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+            elif name == b"x-api-key":
+                x_api_key = value.decode("latin-1")
+            elif name == b"user-agent":
+                user_agent = value.decode("latin-1")
+        return authorization, x_api_key, user_agent
+
+    def _extract_api_key(self, authorization: str, x_api_key: Optional[str], query_string: bytes) -> Optional[str]:
         """
         Extract API key from request headers or query parameters
         """
-        auth_header = request.headers.get("authorization", "")
-        if auth_header.startswith("Bearer "):
-            return auth_header[7:]  # Remove "Bearer " prefix
-        
-        api_key = request.headers.get("x-api-key")
-        if api_key:
-            return api_key
-        
-        api_key = request.query_params.get("api_key")
-        if api_key:
-            return api_key
-        
+        if authorization.startswith("Bearer "):
+            return authorization[7:]  # Remove "Bearer " prefix
+
+        if x_api_key:
+            return x_api_key
+
+        # Only parse the query string when it can hold a key
+        if b"api_key=" in query_string:
+            for name, value in parse_qsl(query_string.decode("latin-1")):
+                if name == "api_key" and value:
+                    return value
+
         return None
-    
-    def _validate_api_key(self, api_key: Optional[str]) -> bool:
+
+    def _validate_api_key(self, api_key: Optional[str]):
         """
-        Validate the API key
+        Validate the API key: the key's record when a key store is in use, else whether one was given
         """
         if not api_key:
             return False
-        
+
+        if self.key_store is not None:
+            return self.key_store.validate(api_key)
+
         return len(api_key) > 0
-    
-    def _detect_suspicious_activity(self, request: Request) -> bool:
+
+    def _is_admin(self, api_key: Optional[str], key_record) -> bool:
+        """
+        Whether the key is in the admin list, or is a stored key with the "admin" permission
+        """
+        if isinstance(key_record, dict) and key_record["permissions"].get("admin"):
+            return True
+        if not api_key:
+            return False
+        candidate = api_key.encode()
+        # Every entry is compared, in constant time, so timing does not tell how close a guess was
+        matched = False
+        for admin_key in self.admin_keys:
+            matched |= hmac.compare_digest(candidate, admin_key)
+        return matched
+
+    def _detect_suspicious_activity(self, client_ip: str, path: str, user_agent: str,
+                                    check_path: bool = True) -> bool:
         """
         Detect suspicious patterns in requests
         """
-        client_ip = request.client.host if request.client else "unknown"
-        recent_requests = [log for log in self.request_logs 
-                          if log["ip"] == client_ip and 
-                          time.time() - log["timestamp"] < 60]
-        
-        if len(recent_requests) > 100:  # More than 100 requests per minute
+        if self.ip_rates.hit(client_ip) > self.max_requests_per_minute:
             return True
-        
-        user_agent = request.headers.get("user-agent", "").lower()
+
+        user_agent = user_agent.lower()
         suspicious_agents = ["bot", "crawler", "spider", "scraper"]
         if any(agent in user_agent for agent in suspicious_agents):
             return True
-        
+
         suspicious_paths = ["/admin", "/config", "/.env", "/wp-admin"]
-        if any(path in request.url.path for path in suspicious_paths):
+        if check_path and any(suspicious in path for suspicious in suspicious_paths):
             return True
-        
+
         return False
-    
-    def _log_request(self, request: Request, client_ip: str, user_agent: str, api_key: Optional[str]):
+
+    def _log_request(self, scope, timestamp: float, client_ip: str, user_agent: str, api_key: Optional[str]) -> int:
         """
-        Log request details for security analysis
+        Log request details for security analysis; returns the record number
         """
-        log_entry = {
-            "timestamp": time.time(),
-            "ip": client_ip,
-            "method": request.method,
-            "path": request.url.path,
-            "user_agent": user_agent,
-            "has_api_key": bool(api_key),
-            "query_params": dict(request.query_params)
-        }
-        
-        self.request_logs.append(log_entry)
-        
-        if len(self.request_logs) > 1000:
-            self.request_logs = self.request_logs[-1000:]
-    
-    def _log_response(self, request: Request, response, process_time: float):
+        # Kept raw; parsing it into a dict for every request is not worth it
+        query_string = scope.get("query_string", b"")
+        return self.request_log.append(timestamp, client_ip, scope["method"], scope["path"], user_agent,
+                                       query_string.decode("latin-1") if query_string else "", bool(api_key))
+
+    def _log_response(self, client_ip: str, path: str, status_code: int, process_time: float):
         """
         Log response details
         """
+        if not logger.isEnabledFor(logging.INFO):
+            return
         log_entry = {
             "timestamp": time.time(),
-            "ip": request.client.host if request.client else "unknown",
-            "path": request.url.path,
-            "status_code": response.status_code,
+            "ip": client_ip,
+            "path": path,
+            "status_code": status_code,
             "process_time": process_time
         }
 
-        logger.info(f"Response logged: {log_entry}")
-    
-    def _generate_request_id(self, request: Request) -> str:
+        logger.info("Response logged", extra={"event": "security_response", "fields": log_entry})
+
+    def _generate_request_id(self) -> str:
         """
-        Generate a unique request ID
+        Generate a unique request ID (also the trace ID)
         """
-        client_ip = request.client.host if request.client else "unknown"
-        timestamp = str(time.time())
-        user_agent = request.headers.get("user-agent", "")
-        
-        request_string = f"{client_ip}:{timestamp}:{user_agent}"
-        return hashlib.md5(request_string.encode()).hexdigest()[:16]
-    
-    def add_api_key(self, key: str, permissions: Dict[str, Any] = None):
+        return IDS.trace_id()
+
+    def add_api_key(self, name: str, permissions: Dict[str, Any] = None,
+                    rate_limit_per_minute: Optional[int] = None) -> str:
         """
-        Add a valid API key
+        Create an API key in the key store and return it. Without a key store,
+        name is the key itself and is kept in memory as before
         """
-        self.api_keys[key] = {
-            "permissions": permissions or {},
-            "created_at": time.time()
-        }
-    
-    def remove_api_key(self, key: str):
+        if self.key_store is None:
+            self.api_keys[name] = {
+                "permissions": permissions or {},
+                "created_at": time.time()
+            }
+            return name
+        return self.key_store.create(name, permissions, rate_limit_per_minute)
+
+    def remove_api_key(self, key_id: str):
         """
-        Remove an API key
+        Revoke an API key by its id (without a key store, the key itself)
         """
-        self.api_keys.pop(key, None)
-    
-    def block_ip(self, ip: str):
+        if self.key_store is None:
+            self.api_keys.pop(key_id, None)
+            return
+        self.key_store.revoke(key_id)
+        self.key_rates.forget(key_id)
+
+    def block_ip(self, ip: str, ttl: Optional[float] = None, reason: str = "manual") -> bool:
         """
-        Block an IP address
+        Block an IP address or CIDR range, for ttl seconds if given
         """
-        self.blocked_ips.add(ip)
-    
+        try:
+            self.blocklist.add(ip, ttl, reason)
+        except ValueError:
+            # e.g. a unix socket peer, which has no address to block
+            logger.warning(f"Cannot block {ip!r}: not an IP address or range")
+            return False
+        return True
+
     def unblock_ip(self, ip: str):
         """
         Unblock an IP address
         """
-        self.blocked_ips.discard(ip)
-    
+        self.blocklist.remove(ip)
+        # Otherwise the requests that got it blocked would block it again
+        self.ip_rates.forget(ip)
+
     def get_security_stats(self) -> Dict[str, Any]:
         """
         Get security statistics
         """
         return {
-            "total_api_keys": len(self.api_keys),
-            "blocked_ips": len(self.blocked_ips),
-            "recent_requests": len(self.request_logs),
-            "blocked_ips_list": list(self.blocked_ips)
+            "total_api_keys": len(self.key_store.list()) if self.key_store is not None else len(self.api_keys),
+            "api_key_cache": self.key_store.get_stats() if self.key_store is not None else None,
+            "blocked_ips": len(self.blocklist),
+            "recent_requests": len(self.request_log),
+            "blocked_ips_list": self.blocklist.entries(limit=100),
+            "allowlisted_ranges": len(self.allowlist),
+            "blocklist": self.blocklist.get_stats(),
+            # Busiest clients by requests in the last minute
+            "requests_per_minute": dict(self.ip_rates.top()),
+            "rate_tracking": self.ip_rates.get_stats(),
+            "request_log": self.request_log.get_stats()
         }
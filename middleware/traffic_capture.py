@@ -0,0 +1,66 @@
+import re
+import time
+from urllib.parse import parse_qsl, urlencode
+from services.traffic_capture import TRAFFIC_RECORDER
+
+# Query parameters that carry credentials (SecurityMiddleware accepts ?api_key=); never recorded
+CREDENTIAL_PARAMS = frozenset(["api_key", "apikey", "key", "access_token", "token", "password", "secret"])
+_CREDENTIAL_RE = re.compile(rb"(?:^|&)(?:" + b"|".join(name.encode() for name in CREDENTIAL_PARAMS) + rb")=", re.IGNORECASE)
+
+
+def scrub_query(query_string: bytes) -> str:
+    """
+    The query string without credential parameters
+    """
+    query = query_string.decode("latin-1")
+    if not _CREDENTIAL_RE.search(query_string):
+        return query
+    kept = [(name, value) for name, value in parse_qsl(query, keep_blank_values=True)
+            if name.lower() not in CREDENTIAL_PARAMS]
+    return urlencode(kept)
+
+
+class TrafficCaptureMiddleware:
+    """
+    Raw ASGI middleware that records each sampled request's timing for replay.
+
+    Handlers add the post-masking request shape through
+    request.state.capture_shape when request.state.capture is set; the
+    raw request body is never read here, and credentials are dropped from
+    the query string.
+    """
+
+    def __init__(self, app, recorder=TRAFFIC_RECORDER):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.recorder.should_capture():
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        start = time.perf_counter()
+        state = scope.setdefault("state", {})
+        state["capture"] = True
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.recorder.record({
+                "ts": round(started_at, 6),
+                "route": getattr(scope.get("route"), "path", "unmatched"),
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scrub_query(scope.get("query_string", b"")),
+                "status": status_holder[0],
+                "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                "target": state.get("target_service"),
+                "shape": state.get("capture_shape")
+            })
@@ -1,8 +1,20 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional
-from services.forwarder import forward_to_ai
-from config import USE_SECURE_FILTER
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, Optional
+from services.forwarder import prepare_prompt, send_prompt, send_prompt_stream, CHAT_MODEL
+from services.upload import StreamingUpload, masked_prompt
+from services.job_queue import JobQueue, JOB_SUCCEEDED, JOB_FAILED
+from services.traffic_capture import TRAFFIC_RECORDER
+from services.response_masking import RESPONSE_MASKING
+from config import (
+    USE_SECURE_FILTER, JOB_DB_PATH, JOB_WORKERS, JOB_RESULT_TTL, JOB_MAX_ATTEMPTS, JOB_MAX_AGE,
+    JOB_UPSTREAM_TIMEOUT, UPLOAD_UPSTREAM_TIMEOUT
+)
+from services.metrics import current_route
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -11,9 +23,16 @@ class ProxyRequest(BaseModel):
     filename: str = "user_code.py"
     use_secure_filter: Optional[bool] = None 
     security_level: Optional[str] = "high"  
+    mask_response: Optional[bool] = None
+
+class JobRequest(BaseModel):
+    kind: str = "chat"
+    payload: Dict[str, Any]
+
+job_queue = JobQueue(JOB_DB_PATH, JOB_WORKERS, JOB_RESULT_TTL, JOB_MAX_ATTEMPTS, JOB_MAX_AGE)
 
 @router.post("/chat")
-async def secure_proxy(data: ProxyRequest):
+async def secure_proxy(data: ProxyRequest, request: Request):
     """
     Secure AI Proxy endpoint with comprehensive filtering
     
@@ -21,15 +40,24 @@ async def secure_proxy(data: ProxyRequest):
     - Maintains context and accuracy while protecting sensitive information
     - Supports personal chatbot mode when secure filtering is disabled
     """
+    current_route.set("/chat")
     try:
         user_code = data.message
         file_name = data.filename
         use_secure_filter = data.use_secure_filter if data.use_secure_filter is not None else USE_SECURE_FILTER
         
        
-        print(f"Processing request with secure filtering: {use_secure_filter}")
+        logger.debug("Processing /chat request", extra={"event": "chat", "fields": {"secure_filtering": use_secure_filter}})
         
-        response = forward_to_ai(user_code, file_name, use_secure_filter)
+        masked_text, final_prompt, tokens = prepare_prompt(user_code, file_name, use_secure_filter)
+        if getattr(request.state, "capture", False):
+            request.state.capture_shape = TRAFFIC_RECORDER.text_shape(
+                masked_text, filename=file_name, use_secure_filter=use_secure_filter
+            )
+        response = send_prompt(final_prompt, user_code, masked_text, use_secure_filter, tokens=tokens)
+        mask_response = RESPONSE_MASKING.requested(
+            data.mask_response if data.mask_response is not None else request.headers.get("x-mask-response")
+        )
       
         if isinstance(response, dict) and "error" in response:
             return {
@@ -41,6 +69,8 @@ async def secure_proxy(data: ProxyRequest):
                     "message": f"Error: {response['error']}"
                 }
             }
+        if mask_response:
+            response["security_metadata"]["response_masked"] = RESPONSE_MASKING.mask_completion(response)
         return {
             "proxy_response": response,
             "security_info": {
@@ -60,6 +90,45 @@ async def secure_proxy(data: ProxyRequest):
             }
         }
 
+@router.post("/chat/upload")
+async def secure_proxy_upload(request: Request, filename: Optional[str] = None,
+                              use_secure_filter: Optional[bool] = None, security_level: Optional[str] = "high",
+                              mask_response: Optional[bool] = None):
+    """
+    /chat for a file streamed as the request body (raw, or multipart/form-data)
+
+    The file is decoded, masked and forwarded upstream piece by piece while it
+    is still being uploaded, so memory use does not grow with its size. The
+    options that /chat takes in its JSON body are query parameters here, and
+    the response has the same shape plus an "upload" summary.
+    """
+    current_route.set("/chat/upload")
+    use_secure_filter = use_secure_filter if use_secure_filter is not None else USE_SECURE_FILTER
+    upload = StreamingUpload(request)
+    report: Dict[str, Any] = {}
+
+    response = await send_prompt_stream(
+        masked_prompt(upload, filename, use_secure_filter, CHAT_MODEL, report),
+        use_secure_filter, report, timeout=UPLOAD_UPSTREAM_TIMEOUT
+    )
+    logger.debug("Processed /chat/upload request", extra={"event": "chat", "fields": {
+        "secure_filtering": use_secure_filter,
+        "bytes": upload.bytes_received
+    }})
+
+    security_info = {
+        "secure_filtering_enabled": use_secure_filter,
+        "security_level": security_level
+    }
+    if isinstance(response, dict) and "error" in response:
+        security_info["message"] = f"Error: {response['error']}"
+        return {"proxy_response": None, "error": response["error"], "security_info": security_info, "upload": report}
+    if RESPONSE_MASKING.requested(mask_response if mask_response is not None else request.headers.get("x-mask-response")):
+        response["security_metadata"]["response_masked"] = RESPONSE_MASKING.mask_completion(response)
+    security_info["message"] = ("Content processed with enhanced security filtering" if use_secure_filter
+                                else "Content processed in personal mode")
+    return {"proxy_response": response, "security_info": security_info, "upload": report}
+
 @router.get("/status")
 async def get_status():
     """Get the current security configuration status"""
@@ -74,3 +143,92 @@ async def get_status():
             "Personal Chatbot Mode Toggle"
         ]
     }
+
+async def run_chat_job(payload: Dict[str, Any], progress) -> Dict[str, Any]:
+    """Job version of /chat: masking and the upstream call run in worker threads"""
+    current_route.set("/jobs")
+    data = ProxyRequest(**payload)
+    use_secure_filter = data.use_secure_filter if data.use_secure_filter is not None else USE_SECURE_FILTER
+
+    masked_text, final_prompt, tokens = await asyncio.to_thread(
+        prepare_prompt, data.message, data.filename, use_secure_filter
+    )
+    await progress(0.5)
+    response = await asyncio.to_thread(
+        send_prompt, final_prompt, data.message, masked_text, use_secure_filter, JOB_UPSTREAM_TIMEOUT, tokens
+    )
+    if isinstance(response, dict) and "error" in response:
+        raise RuntimeError(response["error"])
+    if RESPONSE_MASKING.requested(data.mask_response):
+        response["security_metadata"]["response_masked"] = RESPONSE_MASKING.mask_completion(response)
+    return {
+        "proxy_response": response,
+        "security_info": {
+            "secure_filtering_enabled": use_secure_filter,
+            "security_level": data.security_level
+        }
+    }
+
+async def run_mask_job(payload: Dict[str, Any], progress) -> Dict[str, Any]:
+    """Mask a document without sending it anywhere"""
+    current_route.set("/jobs")
+    data = ProxyRequest(**payload)
+    use_secure_filter = data.use_secure_filter if data.use_secure_filter is not None else USE_SECURE_FILTER
+
+    masked_text, final_prompt, tokens = await asyncio.to_thread(
+        prepare_prompt, data.message, data.filename, use_secure_filter
+    )
+    return {
+        "masked_text": masked_text,
+        "prompt": final_prompt,
+        "tokens": tokens,
+        "secure_filtering_enabled": use_secure_filter
+    }
+
+job_queue.register("chat", run_chat_job)
+job_queue.register("mask", run_mask_job)
+
+@router.post("/jobs", status_code=202)
+async def submit_job(data: JobRequest):
+    """
+    Queue a long-running chat or masking job and return its id for polling
+
+    The payload has the same fields as a /chat request.
+    """
+    if data.kind not in job_queue.handlers:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {data.kind}")
+    try:
+        ProxyRequest(**data.payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+    job_id = await job_queue.submit(data.kind, data.payload)
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status and progress"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    job.pop("result")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Result of a finished job; 409 while it is still queued or running"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    if job["status"] == JOB_FAILED:
+        raise HTTPException(status_code=502, detail=job["error"])
+    if job["status"] != JOB_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return job["result"]
+
+@router.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a queued job or discard a finished one"""
+    if not await job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job not found or currently running")
+    return {"deleted": True}
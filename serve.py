@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Pre-forked multi-worker server for the gateway (Unix only)
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The master imports the app once, which compiles the masking patterns,
+runs init_db and builds the middleware stack. It then freezes the GC so
+that state stays shared copy-on-write, binds the socket and forks the
+workers, which all accept on it. With --no-preload each worker imports
+the app itself instead, as a plain uvicorn command would.
+
+Signals to the master:
+
+    SIGHUP          restart the workers one at a time; each replacement is
+                    serving before the worker it replaces is stopped
+    SIGTERM/SIGINT  stop the workers gracefully and exit
+    SIGUSR1         log per-worker memory and CPU
+
+With --stats-port the same stats are served as JSON at
+http://127.0.0.1:<stats-port>/workers. Workers keep their own metrics, so
+/metrics and /proxy/status describe whichever worker answered. Rolling
+restarts recycle workers but, with preloading, keep the master's copy of
+the code; restart the master to deploy new code.
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+
+from config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_GRACEFUL_TIMEOUT, SERVER_STATS_PORT,
+    JOB_DB_PATH, JOB_MAX_ATTEMPTS,
+    LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_MAX_FIELD_CHARS
+)
+from services.structured_logging import setup_logging, stop_logging
+
+logger = logging.getLogger("serve")
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_MEMORY_FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean", "Shared_Dirty")
+
+
+def process_stats(pid: int) -> Dict[str, Any]:
+    """
+    CPU time and memory of one process from /proc; empty where /proc is unavailable.
+
+    PSS charges each shared page to the processes mapping it in equal
+    parts, so summed over the workers it is their real footprint, while
+    summed RSS counts copy-on-write pages once per worker.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        stats = {"cpu_seconds": round((int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, 2)}
+    except (OSError, IndexError, ValueError):
+        return {}
+
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in _MEMORY_FIELDS:
+                    memory[key] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                memory["Rss"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except (OSError, ValueError):
+            pass
+
+    if "Rss" in memory:
+        stats["rss_mb"] = round(memory["Rss"], 1)
+    if "Pss" in memory:
+        stats["pss_mb"] = round(memory["Pss"], 1)
+        stats["private_mb"] = round(memory["Private_Clean"] + memory["Private_Dirty"], 1)
+        stats["shared_mb"] = round(memory["Shared_Clean"] + memory["Shared_Dirty"], 1)
+    return stats
+
+
+def load_app(spec: str):
+    """
+    Import the ASGI app ("module:attribute") and warm what is worth sharing between workers
+    """
+    module_name, _, attribute = spec.partition(":")
+    app = getattr(importlib.import_module(module_name), attribute or "app")
+
+    from masking.smart_masking import warmup
+    warmup()
+    # Starlette builds the middleware stack on the first request; do it once here instead
+    if getattr(app, "middleware_stack", False) is None:
+        app.middleware_stack = app.build_middleware_stack()
+    return app
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def requeue_jobs(owner: Optional[int] = None) -> int:
+    """
+    Requeue durable jobs left running, by one worker process or by anyone
+    """
+    from services.job_queue import JobStore
+    store = JobStore(JOB_DB_PATH)
+    try:
+        return store.recover(JOB_MAX_ATTEMPTS, owner)
+    finally:
+        store.close()
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    uvicorn server that tells the master over a pipe once it is accepting connections
+    """
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+
+class Worker:
+    def __init__(self, pid: int, slot: int, ready_fd: int):
+        self.pid = pid
+        self.slot = slot
+        self.ready_fd: Optional[int] = ready_fd
+        self.ready = False
+        self.stopping = False
+        self.started_at = time.time()
+        self.cpu_sample: Optional[tuple] = None
+
+    def close_ready_fd(self):
+        if self.ready_fd is not None:
+            os.close(self.ready_fd)
+            self.ready_fd = None
+
+
+class Master:
+    """
+    Forks and supervises the workers
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.app = None
+        self.sock: Optional[socket.socket] = None
+        self.workers: Dict[int, Worker] = {}
+        self.restarts = 0
+        self.respawns = 0
+        self.stopping = False
+        self._pending_signals: List[int] = []
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        self._stats_server: Optional[ThreadingHTTPServer] = None
+
+    def run(self):
+        started = time.perf_counter()
+        if self.args.preload:
+            self.app = load_app(self.args.app)
+        recovered = requeue_jobs()
+        if recovered:
+            logger.info(f"Requeued {recovered} interrupted job(s)")
+        self.sock = bind_socket(self.args.host, self.args.port, self.args.backlog)
+        preloaded = time.perf_counter() - started
+
+        # Almost everything alive now lives as long as the workers do; keeping the
+        # GC away from it stops the workers touching, and so copying, its pages
+        gc.collect()
+        gc.freeze()
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        workers = [self.spawn(slot) for slot in range(self.args.workers)]
+        ready = self.wait_ready(workers, self.args.startup_timeout)
+        logger.info(
+            f"{ready}/{len(workers)} workers ready on {self.args.host}:{self.args.port} in "
+            f"{time.perf_counter() - started:.2f} s ({'preloaded' if self.args.preload else 'not preloaded'}, "
+            f"master setup {preloaded:.2f} s)"
+        )
+        if not ready:
+            self.stop_all()
+            raise SystemExit("No worker started")
+
+        if self.args.stats_port:
+            self._start_stats_server()
+
+        while not self.stopping:
+            select.select([self._wakeup_r], [], [], 1.0)
+            self._drain_wakeup()
+            self.reap()
+            for signum in self._take_signals():
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stopping = True
+                elif signum == signal.SIGHUP:
+                    self.rolling_restart()
+                elif signum == signal.SIGUSR1:
+                    self.log_stats()
+        self.stop_all()
+
+    # Signals are only queued here; the main loop acts on them
+    def _on_signal(self, signum, frame):
+        self._pending_signals.append(signum)
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _take_signals(self) -> List[int]:
+        signals, self._pending_signals = self._pending_signals, []
+        return [signum for signum in signals if signum != signal.SIGCHLD]
+
+    def _drain_wakeup(self):
+        while select.select([self._wakeup_r], [], [], 0)[0]:
+            os.read(self._wakeup_r, 4096)
+
+    def spawn(self, slot: int) -> Worker:
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            started = False
+            try:
+                started = self._run_worker(ready_w)
+            except BaseException:
+                logger.exception("Worker failed")
+            finally:
+                # os._exit skips atexit, so flush the log queue first
+                stop_logging()
+                os._exit(0 if started else 1)
+        os.close(ready_w)
+        worker = Worker(pid, slot, ready_r)
+        self.workers[pid] = worker
+        return worker
+
+    def _run_worker(self, ready_fd: int) -> bool:
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        for worker in self.workers.values():
+            worker.close_ready_fd()
+        if self._stats_server is not None:
+            self._stats_server.socket.close()
+
+        app = self.app if self.app is not None else load_app(self.args.app)
+        # The master requeues jobs, both at startup and for each worker that exits
+        from routes import job_queue
+        job_queue.recover_on_start = False
+
+        config = uvicorn.Config(
+            app, log_level=self.args.log_level, log_config=None, access_log=self.args.access_log,
+            timeout_graceful_shutdown=self.args.graceful_timeout, lifespan="on"
+        )
+        server = WorkerServer(config, ready_fd)
+        server.run(sockets=[self.sock])
+        return server.started
+
+    def wait_ready(self, workers: List[Worker], timeout: float) -> int:
+        """
+        Wait until each worker has reported ready or exited; returns how many are ready
+        """
+        deadline = time.monotonic() + timeout
+        waiting = {worker.ready_fd: worker for worker in workers if worker.ready_fd is not None}
+        while waiting and time.monotonic() < deadline:
+            readable, _, _ = select.select(list(waiting), [], [], max(0.0, deadline - time.monotonic()))
+            for fd in readable:
+                worker = waiting.pop(fd)
+                worker.ready = os.read(fd, 1) == b"1"
+                worker.close_ready_fd()
+        for worker in waiting.values():
+            worker.close_ready_fd()
+        return sum(1 for worker in workers if worker.ready)
+
+    def stop_worker(self, worker: Worker):
+        """
+        Ask a worker to finish in-flight requests and exit; kill it after the graceful timeout
+        """
+        worker.stopping = True
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+            except ChildProcessError:
+                pid = worker.pid
+            if pid:
+                self._forget(worker)
+                return
+            time.sleep(0.05)
+        logger.warning(f"Worker {worker.pid} did not stop in time; killing it")
+        os.kill(worker.pid, signal.SIGKILL)
+        os.waitpid(worker.pid, 0)
+        self._forget(worker)
+
+    def _forget(self, worker: Worker):
+        self.workers.pop(worker.pid, None)
+        worker.close_ready_fd()
+        requeued = requeue_jobs(worker.pid)
+        if requeued:
+            logger.info(f"Requeued {requeued} job(s) from worker {worker.pid}")
+
+    def reap(self):
+        """
+        Collect exited workers and replace the ones that were not asked to stop
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self.workers.get(pid)
+            if worker is None:
+                continue
+            self._forget(worker)
+            if worker.stopping or self.stopping:
+                continue
+            logger.warning(f"Worker {pid} exited unexpectedly (status {status}); starting a replacement")
+            if not worker.ready:
+                # Died during startup; don't spin if every start fails the same way
+                time.sleep(1.0)
+            self.respawns += 1
+            self.wait_ready([self.spawn(worker.slot)], self.args.startup_timeout)
+
+    def rolling_restart(self):
+        """
+        Replace the workers one at a time, starting each replacement before stopping the old worker
+        """
+        started = time.perf_counter()
+        for old in sorted(self.workers.values(), key=lambda worker: worker.slot):
+            if old.pid not in self.workers or old.stopping:
+                continue
+            new = self.spawn(old.slot)
+            if not self.wait_ready([new], self.args.startup_timeout):
+                logger.error(f"Replacement for worker {old.pid} did not start; abandoning the restart")
+                self.stop_worker(new)
+                return
+            self.stop_worker(old)
+        self.restarts += 1
+        logger.info(f"Rolling restart of {len(self.workers)} worker(s) done in {time.perf_counter() - started:.2f} s")
+
+    def stop_all(self):
+        if self._stats_server is not None:
+            self._stats_server.shutdown()
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.stopping = True
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for worker in workers:
+            self.stop_worker(worker)
+        logger.info("All workers stopped")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Memory and CPU of the master and each worker
+        """
+        now = time.monotonic()
+        workers = []
+        for worker in sorted(list(self.workers.values()), key=lambda worker: worker.slot):
+            stats = process_stats(worker.pid)
+            cpu = stats.get("cpu_seconds")
+            if cpu is not None:
+                if worker.cpu_sample is not None and now > worker.cpu_sample[0]:
+                    stats["cpu_percent"] = round((cpu - worker.cpu_sample[1]) / (now - worker.cpu_sample[0]) * 100, 1)
+                worker.cpu_sample = (now, cpu)
+            workers.append(dict(
+                stats, slot=worker.slot, pid=worker.pid, ready=worker.ready,
+                uptime_s=round(time.time() - worker.started_at, 1)
+            ))
+        totals = {
+            key: round(sum(worker.get(key, 0) for worker in workers), 1)
+            for key in ("rss_mb", "pss_mb", "private_mb")
+        }
+        return {
+            "master": dict(process_stats(os.getpid()), pid=os.getpid()),
+            "workers": workers,
+            "totals": totals,
+            "rolling_restarts": self.restarts,
+            "respawns": self.respawns
+        }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        for worker in stats["workers"]:
+            logger.info(
+                f"Worker {worker['slot']} pid {worker['pid']}: RSS {worker.get('rss_mb')} MB, "
+                f"PSS {worker.get('pss_mb')} MB, CPU {worker.get('cpu_percent', 0.0)}%"
+            )
+        logger.info(f"Workers total: {stats['totals']}")
+
+    def _start_stats_server(self):
+        master = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/workers":
+                    self.send_error(404)
+                    return
+                body = json.dumps(master.get_stats()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._stats_server = ThreadingHTTPServer(("127.0.0.1", self.args.stats_port), StatsHandler)
+        threading.Thread(target=self._stats_server.serve_forever, name="worker-stats", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forked multi-worker gateway server")
+    parser.add_argument("--app", default="main:app", help="ASGI app as module:attribute")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=float, default=SERVER_GRACEFUL_TIMEOUT,
+                        help="Seconds a stopping worker gets to finish in-flight requests")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--stats-port", type=int, default=SERVER_STATS_PORT,
+                        help="Serve per-worker stats on 127.0.0.1:<port>/workers (0 = off)")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Import the app in each worker instead of once in the master")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--log-level", default=LOG_LEVEL.lower())
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    setup_logging(LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_MAX_FIELD_CHARS)
+    Master(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from services.metrics import QUEUE_WAIT, current_route
+import logging
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+PRIORITY_NAMES = {
+    "interactive": PRIORITY_INTERACTIVE,
+    "bulk": PRIORITY_BULK,
+}
+
+# Set once per request so the upstream calls it fans out to (including
+# single-flight and hedge tasks, which copy the context) queue at the right priority.
+current_priority: contextvars.ContextVar[int] = contextvars.ContextVar("current_priority", default=PRIORITY_INTERACTIVE)
+
+
+def parse_priority(value: Optional[str]) -> int:
+    """
+    Map a client-supplied priority name onto a queue priority
+    """
+    if not value:
+        return PRIORITY_INTERACTIVE
+    return PRIORITY_NAMES.get(str(value).strip().lower(), PRIORITY_INTERACTIVE)
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an upstream's wait queue is full or the maximum wait time passed
+    """
+
+    def __init__(self, upstream: str, reason: str, retry_after: int):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class UpstreamLimiter:
+    """
+    Concurrency limit for one upstream with a bounded, prioritised wait queue.
+
+    A released slot is handed straight to the best waiter (lowest priority
+    value, then FIFO). When the queue is full an interactive request evicts
+    the newest queued bulk request instead of being rejected itself.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.queued = 0
+        self._waiters: List[list] = []
+        self._seq = itertools.count()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.preempted = 0
+        self.total_wait = 0.0
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """
+        Take a slot, queueing if needed; returns the time spent waiting
+        """
+        if self.in_flight < self.max_concurrency and self.queued == 0:
+            self.in_flight += 1
+            self.admitted += 1
+            return 0.0
+
+        if self.queued >= self.max_queue and not self._preempt(priority):
+            self.rejected += 1
+            raise AdmissionRejected(self.name, "queue full", self.retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), future])
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise AdmissionRejected(self.name, "queue wait timed out", self.retry_after)
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before we were cancelled
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            raise
+        finally:
+            self.queued -= 1
+
+        waited = time.monotonic() - start
+        self.admitted += 1
+        self.total_wait += waited
+        return waited
+
+    def _preempt(self, priority: int) -> bool:
+        """
+        Reject the newest queued waiter of lower priority to make room
+        """
+        victim = None
+        for entry in self._waiters:
+            if entry[2].done() or entry[0] <= priority:
+                continue
+            if victim is None or (entry[0], entry[1]) > (victim[0], victim[1]):
+                victim = entry
+        if victim is None:
+            return False
+
+        victim[2].set_exception(AdmissionRejected(self.name, "preempted by higher priority traffic", self.retry_after))
+        self.preempted += 1
+        return True
+
+    def release(self):
+        """
+        Give the slot to the next waiter, or free it
+        """
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "preempted": self.preempted,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0.0
+        }
+
+
+class SlotHeldStream:
+    """
+    Async iterator over an upstream stream that releases its admission slot when finished or closed
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes], release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self._stream.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class AdmissionController:
+    """
+    One UpstreamLimiter per upstream service
+    """
+
+    def __init__(self, services: List[str], max_concurrency: int = 32, max_queue: int = 64,
+                 max_wait: float = 10.0, overrides: Optional[Dict[str, int]] = None):
+        overrides = overrides or {}
+        self.limiters = {
+            name: UpstreamLimiter(name, overrides.get(name, max_concurrency), max_queue, max_wait)
+            for name in services
+        }
+
+    async def acquire(self, upstream: str) -> float:
+        waited = await self.limiters[upstream].acquire(current_priority.get())
+        QUEUE_WAIT.observe(waited, current_route.get(), upstream)
+        return waited
+
+    def release(self, upstream: str):
+        self.limiters[upstream].release()
+
+    @asynccontextmanager
+    async def slot(self, upstream: str):
+        """
+        Hold an upstream slot for the duration of the block
+        """
+        await self.acquire(upstream)
+        try:
+            yield
+        finally:
+            self.release(upstream)
+
+    def in_flight(self) -> int:
+        return sum(limiter.in_flight for limiter in self.limiters.values())
+
+    def queued(self) -> int:
+        return sum(limiter.queued for limiter in self.limiters.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get admission statistics per upstream
+        """
+        return {
+            "in_flight": self.in_flight(),
+            "queued": self.queued(),
+            "upstreams": {name: limiter.get_stats() for name, limiter in self.limiters.items()}
+        }
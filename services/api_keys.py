@@ -0,0 +1,268 @@
+import hashlib
+import hmac
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+from config import API_KEY_DB_PATH, API_KEY_CACHE_TTL, API_KEY_NEGATIVE_TTL, API_KEY_CACHE_SIZE
+from config import API_KEY_RELOAD_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "aip_"
+
+# Hashed in place of a missing key id, so unknown and wrong keys take the same time
+_DUMMY_SALT = secrets.token_bytes(16)
+_DUMMY_HASH = hashlib.sha256(b"").digest()
+
+
+def hash_secret(salt: bytes, secret: str) -> bytes:
+    """
+    Salted hash of a key's secret part.
+
+    Generated secrets are 32 random bytes, so a deliberately slow password
+    hash would add nothing but per-request latency on cache misses.
+    """
+    return hmac.new(salt, secret.encode("utf-8"), hashlib.sha256).digest()
+
+
+def split_key(api_key: str) -> Optional[Tuple[str, str]]:
+    """
+    ("<id>", "<secret>") from "aip_<id>.<secret>", or None if it is not in that form
+    """
+    if not api_key.startswith(KEY_PREFIX):
+        return None
+    key_id, dot, secret = api_key[len(KEY_PREFIX):].partition(".")
+    if not dot or not key_id or not secret:
+        return None
+    return key_id, secret
+
+
+_METADATA_COLUMNS = 'id, name, permissions, rate_limit_per_minute, created_at, revoked_at'
+
+
+def _metadata(row) -> Dict[str, Any]:
+    return {"id": row[0], "name": row[1], "permissions": json.loads(row[2]), "rate_limit_per_minute": row[3],
+            "created_at": row[4], "revoked_at": row[5]}
+
+
+class APIKeyStore:
+    """
+    API keys stored as salted hashes in a sqlite table, with an in-memory lookup cache.
+
+    A key looks like "aip_<id>.<secret>": the id finds the row, the secret is
+    hashed with that row's salt and compared in constant time. Only the id,
+    salt and hash are stored, so the raw key is shown once, when created.
+
+    Lookups, valid or not, are cached for cache_ttl / negative_ttl seconds
+    under a digest of the key, so a request costs a dict lookup and
+    repeated bad keys never reach the database. Every reload_interval
+    seconds the store asks sqlite whether another connection (another worker,
+    or tools/api_keys.py) has changed the table and drops the cache if so;
+    its own changes drop the cache straight away.
+
+    Each key carries a name, a permissions dict ("allowed_paths": path
+    prefixes the key may call) and an optional requests-per-minute limit.
+    """
+
+    def __init__(self, path: str = API_KEY_DB_PATH, cache_ttl: float = API_KEY_CACHE_TTL,
+                 negative_ttl: float = API_KEY_NEGATIVE_TTL, cache_size: int = API_KEY_CACHE_SIZE,
+                 reload_interval: float = API_KEY_RELOAD_INTERVAL):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.cache_size = max(1, cache_size)
+        self.reload_interval = reload_interval
+
+        self._cache: "OrderedDict[bytes, Tuple[float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._next_reload_check = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.reloads = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the table on first use, so nothing is created unless keys are used
+        """
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS api_keys (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    salt BLOB NOT NULL,
+                    key_hash BLOB NOT NULL,
+                    permissions TEXT NOT NULL DEFAULT '{}',
+                    rate_limit_per_minute INTEGER,
+                    created_at REAL NOT NULL,
+                    revoked_at REAL
+                )
+            ''')
+            self._data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def validate(self, api_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        The key's record (id, name, permissions, rate_limit_per_minute) if it is valid, else None
+        """
+        if not api_key:
+            return None
+        now = time.monotonic()
+        if now >= self._next_reload_check:
+            self._check_reload(now)
+
+        digest = hashlib.sha256(api_key.encode("utf-8")).digest()
+        entry = self._cache.get(digest)
+        if entry is not None and entry[0] > now:
+            self._cache.move_to_end(digest)
+            self.hits += 1
+            if entry[1] is None:
+                self.rejected += 1
+            return entry[1]
+
+        self.misses += 1
+        record = self._lookup(api_key)
+        self._cache[digest] = (now + (self.cache_ttl if record is not None else self.negative_ttl), record)
+        self._cache.move_to_end(digest)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        if record is None:
+            self.rejected += 1
+        return record
+
+    def _lookup(self, api_key: str) -> Optional[Dict[str, Any]]:
+        parts = split_key(api_key)
+        row = None
+        if parts is not None:
+            with self._lock:
+                row = self._connect().execute(
+                    'SELECT id, name, salt, key_hash, permissions, rate_limit_per_minute FROM api_keys '
+                    'WHERE id = ? AND revoked_at IS NULL',
+                    (parts[0],)
+                ).fetchone()
+        if row is None:
+            hmac.compare_digest(hash_secret(_DUMMY_SALT, api_key), _DUMMY_HASH)
+            return None
+        if not hmac.compare_digest(hash_secret(row[2], parts[1]), row[3]):
+            return None
+        try:
+            permissions = json.loads(row[4])
+        except ValueError:
+            logger.warning(f"API key {row[0]} has unreadable permissions; treating it as unrestricted")
+            permissions = {}
+        return {"id": row[0], "name": row[1], "permissions": permissions, "rate_limit_per_minute": row[5]}
+
+    def _check_reload(self, now: float):
+        """
+        Drop the cache if another connection has changed the table since the last check
+        """
+        self._next_reload_check = now + self.reload_interval
+        with self._lock:
+            version = self._connect().execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self.invalidate()
+            self.reloads += 1
+            logger.info("API keys changed; lookup cache cleared")
+
+    def invalidate(self):
+        self._cache.clear()
+
+    @staticmethod
+    def allows(record: Dict[str, Any], path: str) -> bool:
+        """
+        Whether a key may call path, per its "allowed_paths" permission (absent means any path)
+        """
+        allowed = record["permissions"].get("allowed_paths")
+        if allowed is None:
+            return True
+        return any(path.startswith(prefix) for prefix in allowed)
+
+    def create(self, name: str, permissions: Optional[Dict[str, Any]] = None,
+               rate_limit_per_minute: Optional[int] = None) -> str:
+        """
+        Add a key and return it; only its hash is kept, so this is the one chance to read it
+        """
+        key_id = secrets.token_hex(8)
+        secret = secrets.token_urlsafe(32)
+        salt = secrets.token_bytes(16)
+        with self._lock:
+            self._connect().execute(
+                'INSERT INTO api_keys (id, name, salt, key_hash, permissions, rate_limit_per_minute, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key_id, name, salt, hash_secret(salt, secret), json.dumps(permissions or {}),
+                 rate_limit_per_minute, time.time())
+            )
+        # Keys tried before they existed may be negatively cached
+        self.invalidate()
+        return f"{KEY_PREFIX}{key_id}.{secret}"
+
+    def update(self, key_id: str, permissions: Optional[Dict[str, Any]] = None,
+               rate_limit_per_minute: Optional[int] = None, clear_rate_limit: bool = False) -> bool:
+        """
+        Change a key's permissions and/or rate limit; False if there is no such key
+        """
+        assignments, params = [], []
+        if permissions is not None:
+            assignments.append('permissions = ?')
+            params.append(json.dumps(permissions))
+        if rate_limit_per_minute is not None or clear_rate_limit:
+            assignments.append('rate_limit_per_minute = ?')
+            params.append(rate_limit_per_minute)
+        if not assignments:
+            return self.get(key_id) is not None
+        with self._lock:
+            cursor = self._connect().execute(
+                f'UPDATE api_keys SET {", ".join(assignments)} WHERE id = ?', params + [key_id]
+            )
+        self.invalidate()
+        return cursor.rowcount > 0
+
+    def revoke(self, key_id: str) -> bool:
+        with self._lock:
+            cursor = self._connect().execute(
+                'UPDATE api_keys SET revoked_at = ? WHERE id = ? AND revoked_at IS NULL', (time.time(), key_id)
+            )
+        self.invalidate()
+        return cursor.rowcount > 0
+
+    def get(self, key_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute(f'SELECT {_METADATA_COLUMNS} FROM api_keys WHERE id = ?', (key_id,)).fetchone()
+        return _metadata(row) if row is not None else None
+
+    def list(self, include_revoked: bool = False) -> List[Dict[str, Any]]:
+        """
+        Key metadata, oldest first (never the hashes)
+        """
+        where = '' if include_revoked else 'WHERE revoked_at IS NULL '
+        with self._lock:
+            rows = self._connect().execute(
+                f'SELECT {_METADATA_COLUMNS} FROM api_keys {where}ORDER BY created_at'
+            ).fetchall()
+        return [_metadata(row) for row in rows]
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "rejected": self.rejected,
+            "reloads": self.reloads
+        }
+
+
+API_KEY_STORE = APIKeyStore()
@@ -0,0 +1,147 @@
+import zlib
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# In order of preference when a client accepts several equally
+ENCODINGS = ("br", "gzip", "deflate") if brotli is not None else ("gzip", "deflate")
+
+# Brotli's higher qualities cost far more CPU than they save on chat-sized JSON
+BROTLI_QUALITY = 5
+
+
+class BodyTooLarge(Exception):
+    """
+    A compressed body expanded past the allowed size
+    """
+
+
+class Decoder:
+    """
+    Incremental decompressor for one content-encoding that stops once the
+    output would exceed max_size bytes, so a small compressed body cannot
+    expand into gigabytes in memory. Malformed input raises ValueError.
+    """
+
+    def __init__(self, encoding: str, max_size: int):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported content-encoding: {encoding}")
+        self.encoding = encoding
+        self.max_size = max_size
+        self.remaining = max_size
+        self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == "gzip" else None
+        self._brotli = brotli.Decompressor() if encoding == "br" else None
+
+    def decompress(self, data: bytes) -> bytes:
+        if not data:
+            return b""
+        try:
+            if self._brotli is not None:
+                return self._consume(self._brotli.process(data))
+            if self._zlib is None:
+                # "deflate" is meant to be zlib-wrapped, but some clients send raw deflate
+                wrapped = len(data) >= 2 and data[0] & 0x0F == 8 and ((data[0] << 8) | data[1]) % 31 == 0
+                self._zlib = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+            chunks = []
+            while data:
+                chunks.append(self._consume(self._zlib.decompress(data, self.remaining + 1)))
+                data = self._zlib.unconsumed_tail
+            return b"".join(chunks)
+        except (zlib.error, getattr(brotli, "error", zlib.error)) as e:
+            raise ValueError(f"Malformed {self.encoding} data: {e}")
+
+    def finish(self) -> bytes:
+        """
+        Check that the compressed stream ended properly; returns any remaining output
+        """
+        if self._brotli is not None:
+            if not self._brotli.is_finished():
+                raise ValueError("Truncated br data")
+            return b""
+        if self._zlib is None:
+            return b""
+        out = self._consume(self._zlib.flush())
+        if not self._zlib.eof:
+            raise ValueError(f"Truncated {self.encoding} data")
+        return out
+
+    def _consume(self, out: bytes) -> bytes:
+        self.remaining -= len(out)
+        if self.remaining < 0:
+            raise BodyTooLarge(f"Decompressed body exceeds {self.max_size} bytes")
+        return out
+
+
+class Encoder:
+    """
+    Incremental compressor for one content-encoding
+    """
+
+    def __init__(self, encoding: str, level: int = 6):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            window_bits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+            self._zlib = zlib.compressobj(level, zlib.DEFLATED, window_bits)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        """
+        Compress a chunk; with flush, everything so far is emitted so the receiver can decode it now
+        """
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + self._brotli.flush() if flush else out
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+def _weights(accept_encoding: str) -> Dict[str, float]:
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            weights[name.strip()] = quality
+    return weights
+
+
+def accepts(accept_encoding: Optional[str], encoding: str) -> bool:
+    """
+    Whether a client sending this Accept-Encoding header can take a body in the given encoding
+    """
+    if not accept_encoding:
+        return False
+    weights = _weights(accept_encoding)
+    return weights.get(encoding.lower(), weights.get("*", 0.0)) > 0
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the response encoding from an Accept-Encoding header, or None for identity
+    """
+    if not accept_encoding:
+        return None
+    weights = _weights(accept_encoding)
+    wildcard = weights.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = weights.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
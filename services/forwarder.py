@@ -1,7 +1,20 @@
 import os
+import json
+import time
+import httpx
 import requests
+from typing import Any, AsyncIterator, Dict
 from masking.smart_masking import smart_mask
-from config import USE_SECURE_FILTER, OPENROUTER_API_KEY
+from config import USE_SECURE_FILTER, OPENROUTER_API_KEY, OPENROUTER_BASE_URL, COMPACT_PREAMBLE
+from services.metrics import current_route, UPSTREAM_TTFB, UPSTREAM_LATENCY, UPSTREAM_ERRORS
+from services.structured_logging import PROMPT_CAPTURE
+from services.tracing import span
+from services.token_budget import TOKEN_BUDGET, estimate_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHAT_MODEL = "anthropic/claude-3-haiku"
 
 def forward_to_ai(user_input: str, file_name: str = "user_code.py", use_secure_filter: bool = None):
     """
@@ -15,23 +28,41 @@ def forward_to_ai(user_input: str, file_name: str = "user_code.py", use_secure_f
     if use_secure_filter is None:
         use_secure_filter = USE_SECURE_FILTER
     
-    masked_text, ai_pre_prompt = smart_mask(user_input, file_name, use_secure_filter)
+    masked_text, final_prompt, tokens = prepare_prompt(user_input, file_name, use_secure_filter)
+    return send_prompt(final_prompt, user_input, masked_text, use_secure_filter, tokens=tokens)
 
-    final_prompt = ai_pre_prompt + masked_text
 
-    if not OPENROUTER_API_KEY:
-        return {"error": "OpenRouter API key not configured"}
-    
-    headers = {
+def prepare_prompt(user_input: str, file_name: str, use_secure_filter: bool):
+    """
+    Mask the input, fit it into the model's token budget and build the final prompt
+
+    Returns:
+        Tuple of (masked_text, final_prompt, token report)
+    """
+    masked_text, ai_pre_prompt = smart_mask(user_input, file_name, use_secure_filter, compact=COMPACT_PREAMBLE)
+
+    preamble_tokens = estimate_tokens(ai_pre_prompt)
+    masked_text, tokens = TOKEN_BUDGET.compact_prompt(masked_text, CHAT_MODEL, reserved=preamble_tokens)
+    tokens["before"] += preamble_tokens
+    tokens["after"] += preamble_tokens
+    tokens["preamble"] = "compact" if COMPACT_PREAMBLE else "full"
+    tokens["preamble_tokens"] = preamble_tokens
+
+    return masked_text, ai_pre_prompt + masked_text, tokens
+
+
+def _openrouter_headers() -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "HTTP-Referer": "http://localhost:8000",
         "X-Title": "Secure AI Proxy",
         "Content-Type": "application/json"
     }
-    url = "https://openrouter.ai/api/v1/chat/completions"
 
-    body = {
-        "model": "anthropic/claude-3-haiku",
+
+def _chat_body(final_prompt: str) -> Dict[str, Any]:
+    return {
+        "model": CHAT_MODEL,
         "messages": [
             {"role": "user", "content": final_prompt}
         ],
@@ -40,24 +71,40 @@ def forward_to_ai(user_input: str, file_name: str = "user_code.py", use_secure_f
         "stream": False
     }
 
-    # Debug: Print request details (remove sensitive info)
-    print(f"Debug: Sending request to {url}")
-    print(f"Debug: Model: {body['model']}")
-    print(f"Debug: Content length: {len(final_prompt)}")
-    print(f"Debug: Headers: {list(headers.keys())}")
+
+def send_prompt(final_prompt: str, user_input: str, masked_text: str, use_secure_filter: bool,
+                timeout: float = None, tokens: dict = None):
+    """
+    Send an already masked prompt to OpenRouter
+    """
+    if not OPENROUTER_API_KEY:
+        return {"error": "OpenRouter API key not configured"}
     
-    print(f"\nPROMPT SENT TO AI:")
-    print("=" * 50)
-    print(final_prompt)
-    print("=" * 50)
-    print()
+    headers = _openrouter_headers()
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    body = _chat_body(final_prompt)
+
+    logger.debug("Forwarding to AI", extra={"event": "forward", "fields": {
+        "url": url,
+        "model": body["model"],
+        "content_length": len(final_prompt),
+        "headers": list(headers.keys())
+    }})
+    PROMPT_CAPTURE.capture(final_prompt, route="/chat", model=body["model"])
 
+    route = current_route.get()
     try:
-        response = requests.post(url, headers=headers, json=body)
-        print(f"Debug: Response status: {response.status_code}")
-        
+        start = time.perf_counter()
+        with span("upstream", provider="openrouter") as upstream_span:
+            response = requests.post(url, headers=headers, json=body, timeout=timeout)
+            upstream_span.set(status_code=response.status_code)
+        UPSTREAM_TTFB.observe(response.elapsed.total_seconds(), route, "openrouter")
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, route, "openrouter")
         if response.status_code != 200:
-            print(f"Debug: Response text: {response.text[:200]}...")
+            logger.warning("Upstream error response", extra={"event": "forward_error", "fields": {
+                "status_code": response.status_code,
+                "body": response.text[:200]
+            }})
         
         response.raise_for_status()
 
@@ -68,7 +115,72 @@ def forward_to_ai(user_input: str, file_name: str = "user_code.py", use_secure_f
             "masked_length": len(masked_text),
             "context_preserved": True
         }
+        if tokens is not None:
+            result["security_metadata"]["tokens"] = tokens
         
         return result
     except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.inc(route, "openrouter", type(e).__name__)
+        return {"error": str(e)}
+
+
+async def send_prompt_stream(prompt: AsyncIterator[str], use_secure_filter: bool, report: Dict[str, Any],
+                             timeout: float = None) -> Dict[str, Any]:
+    """
+    Send a prompt that is still being produced to OpenRouter.
+
+    The JSON request body is written around the prompt pieces as they come,
+    with chunked transfer encoding, so the prompt is never held in full.
+    report is filled in by the producer and read once the upload is done.
+    """
+    if not OPENROUTER_API_KEY:
+        return {"error": "OpenRouter API key not configured"}
+
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    body = _chat_body("")
+    opening, closing = json.dumps(body).split('""', 1)
+
+    async def content():
+        yield opening.encode() + b'"'
+        async for piece in prompt:
+            # A JSON string without its quotes
+            yield json.dumps(piece)[1:-1].encode()
+        yield b'"' + closing.encode()
+
+    logger.debug("Forwarding streamed prompt to AI", extra={"event": "forward", "fields": {
+        "url": url,
+        "model": body["model"]
+    }})
+
+    route = current_route.get()
+    try:
+        start = time.perf_counter()
+        # Includes the upload: the prompt is produced while the request body is sent
+        async with httpx.AsyncClient(timeout=timeout) as client, \
+                span("upstream", provider="openrouter", streamed_prompt=True) as upstream_span:
+            response = await client.post(url, headers=_openrouter_headers(), content=content())
+            upstream_span.set(status_code=response.status_code)
+        UPSTREAM_TTFB.observe(response.elapsed.total_seconds(), route, "openrouter")
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, route, "openrouter")
+        if response.status_code != 200:
+            logger.warning("Upstream error response", extra={"event": "forward_error", "fields": {
+                "status_code": response.status_code,
+                "body": response.text[:200]
+            }})
+
+        response.raise_for_status()
+
+        result = response.json()
+        result["security_metadata"] = {
+            "secure_filtering_applied": use_secure_filter,
+            "original_length": report.get("original_length"),
+            "masked_length": report.get("masked_length"),
+            "context_preserved": True
+        }
+        if report.get("tokens"):
+            result["security_metadata"]["tokens"] = report["tokens"]
+
+        return result
+    except httpx.HTTPError as e:
+        UPSTREAM_ERRORS.inc(route, "openrouter", type(e).__name__)
         return {"error": str(e)}
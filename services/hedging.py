@@ -0,0 +1,144 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent latencies with percentile lookup
+    """
+
+    def __init__(self, window: int = 256):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class HedgePolicy:
+    """
+    Decides when a duplicate (hedged) upstream request may be sent.
+
+    A hedge fires once a request has been outstanding longer than the given
+    percentile of recent latency for the same provider and model. Hedges are
+    paid for from a token bucket that earns max_ratio tokens per request, so
+    hedging can never add more than that share of extra upstream load.
+    """
+
+    def __init__(self, enabled: bool = False, percentile: float = 95.0, max_ratio: float = 0.1,
+                 min_delay: float = 0.05, min_samples: int = 20, window: int = 256, burst: float = 10.0):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.burst = burst
+        self.trackers: Dict[Hashable, LatencyTracker] = {}
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def record_latency(self, key: Hashable, latency: float):
+        tracker = self.trackers.get(key)
+        if tracker is None:
+            tracker = self.trackers[key] = LatencyTracker(self.window)
+        tracker.record(latency)
+
+    def hedge_delay(self, key: Hashable) -> Optional[float]:
+        """
+        Seconds to wait before hedging, or None when there is not enough data
+        """
+        tracker = self.trackers.get(key)
+        if not self.enabled or tracker is None or len(tracker.samples) < self.min_samples:
+            return None
+        return max(self.min_delay, tracker.percentile(self.percentile))
+
+    def _earn(self):
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.max_ratio)
+
+    def _spend(self) -> bool:
+        if self.tokens < 1.0:
+            self.budget_denied += 1
+            return False
+        self.tokens -= 1.0
+        self.hedges += 1
+        return True
+
+    async def run(self, key: Hashable, primary: Callable[[], Awaitable[Any]], hedge: Callable[[], Awaitable[Any]],
+                  discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Any:
+        """
+        Run primary, racing it against hedge if it is still pending after the hedge delay.
+
+        The first successful result wins and the other attempt is cancelled;
+        discard is awaited on a losing result that completed anyway.
+        """
+        self._earn()
+        primary_task = asyncio.ensure_future(primary())
+        delay = self.hedge_delay(key)
+        if delay is None:
+            return await primary_task
+
+        tasks = [primary_task]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self._spend():
+                winner = primary_task
+                return await primary_task
+
+            logger.info(f"Hedging request for {key} after {delay * 1000:.0f} ms")
+            tasks.append(asyncio.ensure_future(hedge()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        winner = task
+                        if task is not primary_task:
+                            self.hedge_wins += 1
+                        return task.result()
+
+            # Both attempts failed; surface the primary's error
+            return primary_task.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get hedging statistics
+        """
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "max_ratio": self.max_ratio,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "hedge_ratio": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            "delays_ms": {
+                f"{key[0]}:{key[1]}" if isinstance(key, tuple) else str(key):
+                    round(tracker.percentile(self.percentile) * 1000, 1)
+                for key, tracker in self.trackers.items() if tracker.samples
+            }
+        }
@@ -0,0 +1,272 @@
+import math
+import socket
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_network(text: str) -> Tuple[int, int, int]:
+    """
+    (address bits, network as an int, prefix length) from "10.0.0.0/8", "2001:db8::/32" or a bare address.
+
+    Host bits are cleared; IPv4-mapped IPv6 networks are treated as IPv4.
+    Raises ValueError for anything else.
+    """
+    address, _, length = text.strip().partition("/")
+    family, bits = (socket.AF_INET6, 128) if ":" in address else (socket.AF_INET, 32)
+    try:
+        value = int.from_bytes(socket.inet_pton(family, address), "big")
+    except OSError:
+        raise ValueError(f"Invalid IP address: {address!r}")
+    prefix_length = int(length) if length else bits
+    if not 0 <= prefix_length <= bits:
+        raise ValueError(f"Invalid prefix length in {text!r}")
+    if bits == 128 and value >> 32 == 0xFFFF and prefix_length >= 96:
+        bits, value, prefix_length = 32, value & 0xFFFFFFFF, prefix_length - 96
+    return bits, value >> (bits - prefix_length), prefix_length
+
+
+def parse_address(text: str) -> Optional[Tuple[int, int]]:
+    """
+    (address bits, address as an int), or None if text is not an IP address
+    """
+    try:
+        bits, value, _ = parse_network(text)
+    except ValueError:
+        return None
+    return bits, value
+
+
+def format_network(bits: int, prefix: int, length: int) -> str:
+    value = prefix << (bits - length) if length else 0
+    family = socket.AF_INET if bits == 32 else socket.AF_INET6
+    return f"{socket.inet_ntop(family, value.to_bytes(bits // 8, 'big'))}/{length}"
+
+
+class _Node:
+    """
+    A tree node: the first `length` bits of the addresses below it, as an int.
+
+    A node with expires set is an entry (math.inf if it never expires);
+    nodes without one only join their two children.
+    """
+
+    __slots__ = ("prefix", "length", "zero", "one", "expires", "reason")
+
+    def __init__(self, prefix: int, length: int):
+        self.prefix = prefix
+        self.length = length
+        self.zero = None
+        self.one = None
+        self.expires = None
+        self.reason = ""
+
+
+class IPPrefixTree:
+    """
+    Set of IPv4/IPv6 networks with optional per-entry expiry, as path-compressed binary radix trees.
+
+    There is one tree per address family. Nodes only exist where two stored
+    networks diverge, so N networks take at most 2N nodes, and a lookup
+    descends at most once per address bit (32 or 128 steps, however many
+    networks are stored), usually far fewer. An address matches if any
+    stored network containing it has not expired; expired entries are
+    dropped when a lookup or listing comes across them.
+    """
+
+    def __init__(self):
+        self._roots = {32: _Node(0, 0), 128: _Node(0, 0)}
+        self._count = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        """Entries stored, including expired ones not yet noticed"""
+        return self._count
+
+    def add(self, network: str, ttl: Optional[float] = None, reason: str = "", now: Optional[float] = None):
+        """
+        Add (or refresh) a network or single address; raises ValueError if it does not parse
+        """
+        bits, prefix, length = parse_network(network)
+        expires = math.inf if not ttl else (time.time() if now is None else now) + ttl
+        self._insert(bits, prefix, length, expires, reason)
+
+    def _insert(self, bits: int, prefix: int, length: int, expires: float, reason: str,
+                node: Optional[_Node] = None) -> _Node:
+        """
+        Store an entry below node (default: the root), which must contain it; returns its node
+        """
+        if node is None:
+            node = self._roots[bits]
+        while True:
+            if node.length == length:
+                # Only reached when node.prefix == prefix
+                if node.expires is None:
+                    self._count += 1
+                node.expires, node.reason = expires, reason
+                return node
+            bit = (prefix >> (length - node.length - 1)) & 1
+            child = node.one if bit else node.zero
+            if child is None:
+                child = _Node(prefix, length)
+                child.expires, child.reason = expires, reason
+                self._count += 1
+                self._set_child(node, bit, child)
+                return child
+
+            common = min(child.length, length)
+            child_head = child.prefix >> (child.length - common)
+            new_head = prefix >> (length - common)
+            if child_head == new_head:
+                if child.length <= length:
+                    node = child
+                    continue
+                # The new network contains child: it goes between node and child
+                parent = _Node(prefix, length)
+                self._set_child(parent, (child.prefix >> (child.length - length - 1)) & 1, child)
+                self._set_child(node, bit, parent)
+                node = parent
+                continue
+
+            # They diverge below node: join them under a node for their common prefix
+            split_length = common - (child_head ^ new_head).bit_length()
+            split = _Node(new_head >> (common - split_length), split_length)
+            self._set_child(split, (child.prefix >> (child.length - split_length - 1)) & 1, child)
+            self._set_child(node, bit, split)
+            node = split
+
+    @staticmethod
+    def _set_child(node: _Node, bit: int, child: _Node):
+        if bit:
+            node.one = child
+        else:
+            node.zero = child
+
+    def _find(self, bits: int, prefix: int, length: int) -> Optional[_Node]:
+        node = self._roots[bits]
+        while node is not None and node.length < length:
+            if prefix >> (length - node.length) != node.prefix:
+                return None
+            node = node.one if (prefix >> (length - node.length - 1)) & 1 else node.zero
+        if node is None or node.length != length or node.prefix != prefix:
+            return None
+        return node
+
+    def remove(self, network: str) -> bool:
+        """
+        Remove exactly this network (not the ones inside it); False if it was not stored
+        """
+        try:
+            node = self._find(*parse_network(network))
+        except ValueError:
+            return False
+        if node is None or node.expires is None:
+            return False
+        node.expires, node.reason = None, ""
+        self._count -= 1
+        return True
+
+    def match(self, address: str, now: Optional[float] = None) -> Optional[Tuple[str, str]]:
+        """
+        (network, reason) of a live entry containing address, or None
+        """
+        parsed = parse_address(address)
+        if parsed is None:
+            return None
+        bits, value = parsed
+        node = self._roots[bits]
+        current = None
+        while node is not None:
+            length = node.length
+            # Join nodes are passed by their bit alone; only entries need the full prefix check
+            if node.expires is not None:
+                if value >> (bits - length) != node.prefix:
+                    return None
+                if current is None:
+                    current = time.time() if now is None else now
+                if node.expires > current:
+                    return format_network(bits, node.prefix, length), node.reason
+                node.expires, node.reason = None, ""
+                self._count -= 1
+                self.expired += 1
+            if length == bits:
+                return None
+            node = node.one if (value >> (bits - length - 1)) & 1 else node.zero
+        return None
+
+    def __contains__(self, address: str) -> bool:
+        return self.match(address) is not None
+
+    def load(self, networks: Iterable[str], ttl: Optional[float] = None, reason: str = "") -> int:
+        """
+        Bulk-add networks, one per item; blank items, "#" comments and unparsable ones are skipped.
+
+        Returns the number added.
+        """
+        expires = math.inf if not ttl else time.time() + ttl
+        parsed = []
+        skipped = 0
+        for line in networks:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                bits, prefix, length = parse_network(line)
+            except ValueError:
+                skipped += 1
+                continue
+            parsed.append((bits, prefix << (bits - length), length, prefix))
+        if skipped:
+            logger.warning(f"Skipped {skipped} unparsable IP ranges")
+
+        # In address order each network lands just off the tree's rightmost path,
+        # so keeping that path on a stack saves walking down from the root each time
+        parsed.sort()
+        path = []
+        path_bits = None
+        for bits, _, length, prefix in parsed:
+            if bits != path_bits:
+                path, path_bits = [self._roots[bits]], bits
+            while len(path) > 1 and not (path[-1].length <= length
+                                         and prefix >> (length - path[-1].length) == path[-1].prefix):
+                path.pop()
+            top = path[-1]
+            node = self._insert(bits, prefix, length, expires, reason, top)
+            # Re-walk the one or two nodes just added to extend the stacked path
+            while node is not top:
+                top = top.one if (prefix >> (length - top.length - 1)) & 1 else top.zero
+                path.append(top)
+        return len(parsed)
+
+    def load_file(self, path: str, ttl: Optional[float] = None, reason: str = "") -> int:
+        with open(path, encoding="utf-8") as f:
+            return self.load(f, ttl, reason)
+
+    def entries(self, limit: Optional[int] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Live entries in address order (up to limit), dropping expired ones along the way
+        """
+        now = time.time() if now is None else now
+        found = []
+        for bits, root in self._roots.items():
+            stack = [root]
+            while stack and (limit is None or len(found) < limit):
+                node = stack.pop()
+                if node.expires is not None:
+                    if node.expires > now:
+                        found.append({
+                            "network": format_network(bits, node.prefix, node.length),
+                            "reason": node.reason,
+                            "expires_in": None if node.expires == math.inf else round(node.expires - now, 1)
+                        })
+                    else:
+                        node.expires, node.reason = None, ""
+                        self._count -= 1
+                        self.expired += 1
+                stack.extend(child for child in (node.one, node.zero) if child is not None)
+        return found
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"entries": self._count, "expired": self.expired}
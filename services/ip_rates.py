@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class _Window:
+    """
+    One client's request counts for the last `size` seconds, as a ring of
+    one-second buckets with a running total
+    """
+
+    __slots__ = ("counts", "last", "total")
+
+    def __init__(self, size: int, second: int):
+        self.counts = [0] * size
+        self.last = second
+        self.total = 0
+
+    def advance(self, second: int):
+        """
+        Move the window forward to second, expiring the buckets that fall out of it
+        """
+        elapsed = second - self.last
+        if elapsed <= 0:
+            return
+        size = len(self.counts)
+        if elapsed >= size:
+            self.counts = [0] * size
+            self.total = 0
+        else:
+            # Each bucket is expired at most once per lap, so this is O(1) amortized
+            counts = self.counts
+            for expired in range(self.last + 1, second + 1):
+                index = expired % size
+                self.total -= counts[index]
+                counts[index] = 0
+        self.last = second
+
+
+class IPRateTracker:
+    """
+    Sliding-window request counts per client IP.
+
+    Each IP gets a ring of one-second buckets covering the last `window`
+    seconds, so recording a request and reading the count are O(1)
+    amortized and exact to the second, however busy the other clients are.
+    At most max_ips clients are tracked; the one seen least recently is
+    evicted first, so idle addresses go before active ones.
+    """
+
+    def __init__(self, window: int = 60, max_ips: int = 10000):
+        self.window = max(1, int(window))
+        self.max_ips = max(1, max_ips)
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+        self.evictions = 0
+
+    def hit(self, ip: str, now: Optional[float] = None) -> int:
+        """
+        Record a request from ip; returns its requests in the window, this one included
+        """
+        second = int(time.monotonic() if now is None else now)
+        window = self._windows.get(ip)
+        if window is None:
+            window = self._windows[ip] = _Window(self.window, second)
+            if len(self._windows) > self.max_ips:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._windows.move_to_end(ip)
+            window.advance(second)
+        window.counts[second % self.window] += 1
+        window.total += 1
+        return window.total
+
+    def count(self, ip: str, now: Optional[float] = None) -> int:
+        """
+        Requests from ip in the window, without recording one
+        """
+        window = self._windows.get(ip)
+        if window is None:
+            return 0
+        window.advance(int(time.monotonic() if now is None else now))
+        return window.total
+
+    def forget(self, ip: str):
+        self._windows.pop(ip, None)
+
+    def top(self, limit: int = 20, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        """
+        The busiest IPs by requests in the window, busiest first
+        """
+        second = int(time.monotonic() if now is None else now)
+        counts = []
+        for ip, window in self._windows.items():
+            window.advance(second)
+            if window.total:
+                counts.append((ip, window.total))
+        counts.sort(key=lambda item: item[1], reverse=True)
+        return counts[:limit]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window,
+            "tracked_ips": len(self._windows),
+            "max_ips": self.max_ips,
+            "evictions": self.evictions
+        }
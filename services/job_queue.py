@@ -0,0 +1,334 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+ProgressCallback = Callable[[float], Awaitable[None]]
+JobHandler = Callable[[Dict[str, Any], ProgressCallback], Awaitable[Any]]
+
+
+# Stored in place of a job's payload once it has run. The payload is the raw,
+# unmasked request, so it is only kept while the job may still need it.
+_CLEARED_PAYLOAD = '{}'
+
+
+class JobStore:
+    """
+    sqlite-backed job table. All methods are blocking; JobQueue runs them in a thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                expires_at REAL,
+                owner INTEGER
+            )
+        ''')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+        if "owner" not in columns:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs (expires_at)')
+
+    def insert(self, kind: str, payload: Dict[str, Any], max_age: int) -> str:
+        """
+        Queue a job that expires, run or not, max_age seconds from now unless it finishes first
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, kind, status, payload, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, JOB_QUEUED, json.dumps(payload), now, now + max_age)
+            )
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        Move the oldest queued job to running and return it
+        """
+        with self._lock:
+            c = self._conn
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                row = c.execute(
+                    'SELECT id, kind, payload, attempts FROM jobs '
+                    'WHERE status = ? AND (expires_at IS NULL OR expires_at > ?) ORDER BY created_at LIMIT 1',
+                    (JOB_QUEUED, time.time())
+                ).fetchone()
+                if row is not None:
+                    c.execute(
+                        'UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1, owner = ? WHERE id = ?',
+                        (JOB_RUNNING, time.time(), os.getpid(), row[0])
+                    )
+                c.execute('COMMIT')
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def set_progress(self, job_id: str, progress: float):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET progress = ? WHERE id = ?', (progress, job_id))
+
+    def finish(self, job_id: str, status: str, result: Any, error: Optional[str], ttl: int):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, payload = ?, result = ?, error = ?, progress = COALESCE(?, progress), '
+                'finished_at = ?, expires_at = ? '
+                'WHERE id = ?',
+                (status, _CLEARED_PAYLOAD, json.dumps(result) if result is not None else None, error,
+                 1.0 if status == JOB_SUCCEEDED else None, now, now + ttl, job_id)
+            )
+
+    def recover(self, max_attempts: int, owner: Optional[int] = None) -> int:
+        """
+        Requeue jobs left running by a previous worker (only those claimed by
+        process owner, if given); give up on those out of attempts
+        """
+        now = time.time()
+        where, params = 'status = ?', [JOB_RUNNING]
+        if owner is not None:
+            where, params = where + ' AND owner = ?', params + [owner]
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE jobs SET status = ?, payload = ?, error = ?, finished_at = ?, expires_at = ? '
+                f'WHERE {where} AND attempts >= ?',
+                [JOB_FAILED, _CLEARED_PAYLOAD, "Worker stopped while running the job too many times", now, now]
+                + params + [max_attempts]
+            )
+            cursor = self._conn.execute(
+                f'UPDATE jobs SET status = ?, progress = 0, owner = NULL WHERE {where}', [JOB_QUEUED] + params
+            )
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, kind, status, progress, attempts, error, created_at, started_at, finished_at, '
+                'expires_at, result FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (job_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "progress": row[3],
+            "attempts": row[4],
+            "error": row[5],
+            "created_at": row[6],
+            "started_at": row[7],
+            "finished_at": row[8],
+            "expires_at": row[9],
+            "result": json.loads(row[10]) if row[10] is not None else None
+        }
+
+    def delete(self, job_id: str, statuses: List[str]) -> bool:
+        marks = ",".join("?" * len(statuses))
+        with self._lock:
+            cursor = self._conn.execute(
+                f'DELETE FROM jobs WHERE id = ? AND status IN ({marks})', (job_id, *statuses)
+            )
+            return cursor.rowcount > 0
+
+    def purge_expired(self, max_age: int) -> int:
+        """
+        Delete expired jobs other than running ones, whose workers still hold them
+        """
+        with self._lock:
+            # Jobs queued before unfinished jobs had an expiry would otherwise stay forever
+            self._conn.execute('UPDATE jobs SET expires_at = created_at + ? WHERE expires_at IS NULL', (max_age,))
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE expires_at <= ? AND status != ?', (time.time(), JOB_RUNNING)
+            )
+            return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobQueue:
+    """
+    Durable submit-and-poll queue for long-running work.
+
+    Jobs are rows in a sqlite table, so queued and interrupted jobs are
+    picked up again when the workers restart. A pool of asyncio workers
+    claims jobs and runs the handler registered for the job's kind;
+    handlers push blocking work (masking, sync HTTP) to threads so many
+    jobs can be in flight at once. Finished results are kept for
+    result_ttl seconds; jobs still unfinished max_age seconds after
+    submission expire. A job's payload (the unmasked request) is cleared
+    as soon as it finishes.
+    """
+
+    def __init__(self, path: str, workers: int = 4, result_ttl: int = 3600, max_attempts: int = 3,
+                 max_age: int = 86400, poll_interval: float = 1.0, purge_interval: float = 60.0):
+        self.path = path
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self.handlers: Dict[str, JobHandler] = {}
+        self._store: Optional[JobStore] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+        # serve.py recovers once before forking workers, and then per worker as each one exits
+        self.recover_on_start = True
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            self._store = JobStore(self.path)
+        return self._store
+
+    def register(self, kind: str, handler: JobHandler):
+        self.handlers[kind] = handler
+
+    async def start(self):
+        """
+        Requeue interrupted jobs and start the worker pool
+        """
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        if self.recover_on_start:
+            self.recovered += await asyncio.to_thread(self.store.recover, self.max_attempts)
+            if self.recovered:
+                logger.info(f"Requeued {self.recovered} interrupted job(s)")
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+
+    async def stop(self):
+        """
+        Stop the workers; jobs they were running stay marked running and are
+        requeued on the next start (or by serve.py once this worker exits)
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = await asyncio.to_thread(self.store.insert, kind, payload, self.max_age)
+        self.submitted += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Remove a job that has not started yet, or a finished job's result
+        """
+        return await asyncio.to_thread(self.store.delete, job_id, [JOB_QUEUED, JOB_SUCCEEDED, JOB_FAILED])
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                await self._maybe_purge()
+                job = await asyncio.to_thread(self.store.claim)
+            except Exception as e:
+                logger.error(f"Job worker {index} could not claim a job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+
+        async def progress(fraction: float):
+            await asyncio.to_thread(self.store.set_progress, job_id, max(0.0, min(1.0, fraction)))
+
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            result = await handler(job["payload"], progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Job {job_id} failed: {str(e)}")
+            self.failed += 1
+            await asyncio.to_thread(self.store.finish, job_id, JOB_FAILED, None, str(e), self.result_ttl)
+            return
+
+        self.completed += 1
+        await asyncio.to_thread(self.store.finish, job_id, JOB_SUCCEEDED, result, None, self.result_ttl)
+
+    async def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        await asyncio.to_thread(self.store.purge_expired, self.max_age)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """
+        Get job queue statistics
+        """
+        return {
+            "workers": len(self._tasks),
+            "kinds": sorted(self.handlers),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "jobs": await asyncio.to_thread(self.store.counts)
+        }
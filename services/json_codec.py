@@ -0,0 +1,44 @@
+import json
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+
+
+def loads(data: Any) -> Any:
+    """
+    Parse JSON from bytes or str, using orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Serialize to compact UTF-8 JSON bytes, using orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def splice_field(body: bytes, key: str, value: Any) -> Optional[bytes]:
+    """
+    Add a top-level field to a serialized JSON object without parsing it.
+
+    Only the final closing brace is touched, so the cost is one copy of the
+    body plus the encoding of value. Returns None when body does not look
+    like a JSON object, letting callers fall back to passing it through.
+    """
+    end = len(body.rstrip())
+    start = len(body) - len(body.lstrip())
+    if end - start < 2 or body[start:start + 1] != b"{" or body[end - 1:end] != b"}":
+        return None
+
+    field = dumps(key) + b":" + dumps(value)
+    if body[start + 1:end - 1].strip():
+        field = b"," + field
+    return body[:end - 1] + field + body[end - 1:]
@@ -0,0 +1,182 @@
+import contextvars
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Route template of the request being served, set by the endpoint so that
+# masking and upstream metrics recorded deeper in the stack carry it.
+current_route: contextvars.ContextVar[str] = contextvars.ContextVar("current_route", default="unknown")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonic counter; updates are a single dict write so they are safe to leave on under load
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Gauge whose values are read from a callback at scrape time
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        if self.callback is None:
+            return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self.callback().items()
+        ]
+
+
+class MetricsRegistry:
+    """
+    Holds every metric and renders them in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter(
+    "gateway_requests_total", "HTTP requests handled by the gateway", ("route", "target", "method", "status"))
+RATE_LIMITED = REGISTRY.counter(
+    "gateway_rate_limited_total", "Responses with status 429", ("route", "target"))
+SERVER_ERRORS = REGISTRY.counter(
+    "gateway_server_errors_total", "Responses with a 5xx status", ("route", "target"))
+REQUEST_LATENCY = REGISTRY.histogram(
+    "gateway_request_duration_seconds", "End-to-end request latency through the gateway", ("route", "target"))
+
+MASKING_LATENCY = REGISTRY.histogram(
+    "gateway_masking_duration_seconds", "Time spent in smart_mask per call", ("route",))
+MASKED_ENTITIES = REGISTRY.counter(
+    "gateway_masked_entities_total", "Sensitive entities masked, by category", ("route", "category"))
+
+RESPONSE_MASK_DELAY = REGISTRY.histogram(
+    "gateway_response_mask_delay_seconds", "Time to first token added by masking a streamed response", ("route",))
+RESPONSE_MASKED_ENTITIES = REGISTRY.counter(
+    "gateway_response_masked_entities_total", "Sensitive entities masked in AI responses, by category",
+    ("route", "category"))
+
+UPSTREAM_TTFB = REGISTRY.histogram(
+    "gateway_upstream_ttfb_seconds", "Time from sending an upstream request to its response headers",
+    ("route", "target"))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "gateway_upstream_duration_seconds", "Total upstream call time including the body", ("route", "target"))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "gateway_upstream_errors_total", "Failed upstream calls", ("route", "target", "kind"))
+QUEUE_WAIT = REGISTRY.histogram(
+    "gateway_queue_wait_seconds", "Time spent waiting for an upstream admission slot", ("route", "target"))
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "gateway_cache_lookups_total", "Response cache lookups by result", ("route", "target", "result"))
+
+COMPRESSION_BYTES = REGISTRY.counter(
+    "gateway_compression_bytes_total", "Body bytes on either side of a content-encoding, by direction",
+    ("direction", "encoding", "form"))
@@ -0,0 +1,235 @@
+import random
+import time
+from typing import Dict, Any, Optional, List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    closed -> open after failure_threshold consecutive failures; open -> half_open
+    once reset_timeout has passed, letting a limited number of probes through;
+    a successful probe closes the breaker again, a failed one re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_probes: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+
+    def available(self) -> bool:
+        """
+        Whether a request could be sent now (does not reserve a probe slot)
+        """
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
+        if self.state == self.HALF_OPEN:
+            return self.probes_in_flight < self.half_open_probes
+        return self.state == self.CLOSED
+
+    def acquire(self) -> bool:
+        """
+        Reserve the right to send a request, taking a probe slot when half open
+        """
+        if not self.available():
+            return False
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight += 1
+        return True
+
+    def release(self):
+        """
+        Hand back a probe slot whose request ended without telling us anything about the provider
+        """
+        if self.state == self.HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.probes_in_flight = 0
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit opened after {self.consecutive_failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probes_in_flight = 0
+
+
+class ProviderHealth:
+    """
+    EWMA latency and error rate for one (provider, model) pair
+    """
+
+    def __init__(self, alpha: float, breaker: CircuitBreaker):
+        self.alpha = alpha
+        self.breaker = breaker
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.client_errors = 0
+
+    def record(self, latency: float, ok: bool):
+        self.requests += 1
+        if ok:
+            self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+        self.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+
+    def score(self) -> float:
+        """
+        Expected cost of sending a request here; lower is better
+        """
+        if self.latency is None:
+            # Untried pairs score 0 so they get explored once before being ranked;
+            # ones that have only ever failed go last
+            return float("inf") if self.failures else 0.0
+        return self.latency * (1.0 + 4.0 * self.error_rate)
+
+
+class ProviderRouter:
+    """
+    Pick the fastest healthy provider for a model out of ProxyService.services
+    """
+
+    def __init__(self, services: Dict[str, Dict[str, Any]], alpha: float = 0.2, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, half_open_probes: int = 1, explore_ratio: float = 0.05):
+        self.services = services
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.explore_ratio = explore_ratio
+        self.health: Dict[Tuple[str, str], ProviderHealth] = {}
+        self.failovers = 0
+
+    def _health(self, provider: str, model: str) -> ProviderHealth:
+        key = (provider, model)
+        health = self.health.get(key)
+        if health is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout, self.half_open_probes)
+            health = ProviderHealth(self.alpha, breaker)
+            self.health[key] = health
+        return health
+
+    def resolve_model(self, provider: str, model: Optional[str]) -> Optional[str]:
+        """
+        Map a requested model name onto the name a provider knows it by
+        """
+        models = self.services[provider]["models"]
+        if not model:
+            return models[0]
+        if model in models:
+            return model
+
+        # "openai/gpt-4" <-> "gpt-4", "anthropic/claude-3-haiku" <-> "claude-3-haiku-20240307"
+        wanted = model.split("/")[-1]
+        for candidate in models:
+            name = candidate.split("/")[-1]
+            if name == wanted or name.startswith(wanted + "-") or wanted.startswith(name + "-"):
+                return candidate
+        return None
+
+    def candidates(self, model: Optional[str], pinned: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Ordered (provider, upstream_model) pairs to try for a request.
+
+        A pinned target is always returned as the only candidate; otherwise
+        configured providers that can serve the model are ranked by score,
+        skipping those whose breaker is open.
+        """
+        if pinned:
+            return [(pinned, self.resolve_model(pinned, model) or model or self.services[pinned]["models"][0])]
+
+        ranked = []
+        for provider, config in self.services.items():
+            if not config.get("api_key"):
+                continue
+            upstream_model = self.resolve_model(provider, model)
+            if upstream_model is None:
+                continue
+            health = self._health(provider, upstream_model)
+            if not health.breaker.available():
+                continue
+            ranked.append((health.score(), provider, upstream_model))
+
+        ranked.sort(key=lambda item: item[0])
+        ordered = [(provider, upstream_model) for _, provider, upstream_model in ranked]
+
+        # Occasionally lead with a non-best provider so its latency estimate
+        # keeps tracking reality instead of freezing at its last bad sample.
+        if len(ordered) > 1 and random.random() < self.explore_ratio:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
+
+    def acquire(self, provider: str, model: str) -> bool:
+        """
+        Claim a slot on the provider's breaker before sending
+        """
+        return self._health(provider, model).breaker.acquire()
+
+    def is_closed(self, provider: str, model: str) -> bool:
+        """
+        Whether the provider is fully healthy (breaker closed)
+        """
+        breaker = self._health(provider, model).breaker
+        return breaker.available() and breaker.state == CircuitBreaker.CLOSED
+
+    def record(self, provider: str, model: str, latency: float, ok: bool):
+        """
+        Record the outcome of an upstream call
+        """
+        self._health(provider, model).record(latency, ok)
+
+    def release(self, provider: str, model: str):
+        """
+        Record that an upstream call ended with no outcome (e.g. it was cancelled), freeing its probe slot
+        """
+        self._health(provider, model).breaker.release()
+
+    def record_client_error(self, provider: str, model: str):
+        """
+        Record a call the provider rejected as a bad request (4xx other than 401, 403 and 429).
+
+        The provider answered, so this is not counted against its health, and
+        the time it took to reject the request is not a latency sample.
+        """
+        health = self._health(provider, model)
+        health.client_errors += 1
+        health.breaker.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get per-provider routing statistics
+        """
+        stats = {}
+        for (provider, model), health in self.health.items():
+            health.breaker.available()
+            stats[f"{provider}:{model}"] = {
+                "ewma_latency_ms": round(health.latency * 1000, 1) if health.latency is not None else None,
+                "error_rate": round(health.error_rate, 4),
+                "requests": health.requests,
+                "failures": health.failures,
+                "client_errors": health.client_errors,
+                "circuit": health.breaker.state
+            }
+        return {"failovers": self.failovers, "providers": stats}
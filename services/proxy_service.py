@@ -1,44 +1,140 @@
 import httpx
 import json
 import asyncio
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Union
 from fastapi import Request, HTTPException
 from fastapi.responses import StreamingResponse, Response
 import time
 import hashlib
-from masking.smart_masking import smart_mask
-from config import USE_SECURE_FILTER, OPENROUTER_API_KEY
+from masking.smart_masking import smart_mask_batch
+from services.response_cache import ResponseCache, parse_cache_control, request_fingerprint
+from services.single_flight import SingleFlight
+from services.provider_router import ProviderRouter
+from services.hedging import HedgePolicy
+from services.metrics import (
+    REGISTRY, current_route, CACHE_LOOKUPS, UPSTREAM_TTFB, UPSTREAM_LATENCY, UPSTREAM_ERRORS
+)
+from services.structured_logging import PROMPT_CAPTURE
+from services import json_codec
+from services.token_budget import TOKEN_BUDGET
+from services.traffic_capture import TRAFFIC_RECORDER
+from services.compression import accepts
+from services.response_masking import RESPONSE_MASKING
+from services.tracing import span, start_span
+from services.admission import (
+    AdmissionController, AdmissionRejected, SlotHeldStream, current_priority, parse_priority, PRIORITY_BULK
+)
+from config import (
+    USE_SECURE_FILTER, OPENROUTER_API_KEY, OPENROUTER_BASE_URL,
+    OPENAI_BASE_URL, OPENAI_API_KEY, ANTHROPIC_BASE_URL, ANTHROPIC_API_KEY,
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_DISK_PATH, RESPONSE_CACHE_DISK_MAX_BYTES,
+    REQUEST_COALESCING_ENABLED,
+    ROUTER_EWMA_ALPHA, ROUTER_FAILURE_THRESHOLD, ROUTER_RESET_TIMEOUT, ROUTER_HALF_OPEN_PROBES,
+    ROUTER_EXPLORE_RATIO,
+    HEDGING_ENABLED, HEDGING_PERCENTILE, HEDGING_MAX_RATIO, HEDGING_MIN_DELAY_MS, HEDGING_MIN_SAMPLES,
+    UPSTREAM_MAX_CONCURRENCY, UPSTREAM_MAX_QUEUE, UPSTREAM_MAX_QUEUE_WAIT, UPSTREAM_CONCURRENCY_OVERRIDES,
+    SECURITY_METADATA_IN_BODY, BATCH_MAX_ITEMS, BATCH_MAX_PARALLELISM,
+    RATE_LIMIT_PER_MINUTE, RATE_LIMIT_PER_HOUR
+)
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Content-Length is included because the relayed body is re-measured
+_HOP_BY_HOP_HEADERS = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization", b"te", b"trailer",
+    b"transfer-encoding", b"upgrade", b"content-length"
+}
+
+
 class ProxyService:
     def __init__(self):
-        self.active_connections = 0
         self.request_count = 0
         self.services = {
             "openrouter": {
-                "base_url": "https://openrouter.ai/api/v1",
+                "base_url": OPENROUTER_BASE_URL,
                 "api_key": OPENROUTER_API_KEY,
                 "models": ["anthropic/claude-3-haiku", "openai/gpt-4", "meta-llama/llama-3.1-8b-instruct"]
             },
             "openai": {
-                "base_url": "https://api.openai.com/v1",
-                "api_key": None, 
+                "base_url": OPENAI_BASE_URL,
+                "api_key": OPENAI_API_KEY,
                 "models": ["gpt-4", "gpt-3.5-turbo"]
             },
             "anthropic": {
-                "base_url": "https://api.anthropic.com/v1",
-                "api_key": None, 
+                "base_url": ANTHROPIC_BASE_URL,
+                "api_key": ANTHROPIC_API_KEY,
                 "models": ["claude-3-haiku-20240307", "claude-3-sonnet-20240229"]
             }
         }
         self.rate_limits = {
-            "requests_per_minute": 60,
-            "requests_per_hour": 1000
+            "requests_per_minute": RATE_LIMIT_PER_MINUTE,
+            "requests_per_hour": RATE_LIMIT_PER_HOUR
         }
         self.request_history = []
+        self.response_cache = ResponseCache(
+            enabled=RESPONSE_CACHE_ENABLED,
+            ttl=RESPONSE_CACHE_TTL,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=RESPONSE_CACHE_MAX_BYTES,
+            disk_path=RESPONSE_CACHE_DISK_PATH,
+            disk_max_bytes=RESPONSE_CACHE_DISK_MAX_BYTES
+        )
+        self.single_flight = SingleFlight(enabled=REQUEST_COALESCING_ENABLED)
+        self.token_budget = TOKEN_BUDGET
+        self.response_masking = RESPONSE_MASKING
+        self.router = ProviderRouter(
+            self.services,
+            alpha=ROUTER_EWMA_ALPHA,
+            failure_threshold=ROUTER_FAILURE_THRESHOLD,
+            reset_timeout=ROUTER_RESET_TIMEOUT,
+            half_open_probes=ROUTER_HALF_OPEN_PROBES,
+            explore_ratio=ROUTER_EXPLORE_RATIO
+        )
+        self.hedging = HedgePolicy(
+            enabled=HEDGING_ENABLED,
+            percentile=HEDGING_PERCENTILE,
+            max_ratio=HEDGING_MAX_RATIO,
+            min_delay=HEDGING_MIN_DELAY_MS / 1000.0,
+            min_samples=HEDGING_MIN_SAMPLES
+        )
+        self.admission = AdmissionController(
+            list(self.services.keys()),
+            max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+            max_queue=UPSTREAM_MAX_QUEUE,
+            max_wait=UPSTREAM_MAX_QUEUE_WAIT,
+            overrides=UPSTREAM_CONCURRENCY_OVERRIDES
+        )
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """
+        Expose live ProxyService state as gauges read at scrape time
+        """
+        REGISTRY.gauge(
+            "gateway_upstream_in_flight", "Upstream calls currently in flight", ("target",),
+            lambda: {(name,): limiter.in_flight for name, limiter in self.admission.limiters.items()}
+        )
+        REGISTRY.gauge(
+            "gateway_upstream_queued", "Requests waiting for an upstream slot", ("target",),
+            lambda: {(name,): limiter.queued for name, limiter in self.admission.limiters.items()}
+        )
+        REGISTRY.gauge(
+            "gateway_cache_bytes_saved", "Upstream response bytes served from the response cache", (),
+            lambda: {(): self.response_cache.bytes_saved}
+        )
+        REGISTRY.gauge(
+            "gateway_forwarded_requests", "Requests forwarded upstream since start", (),
+            lambda: {(): self.request_count}
+        )
+
+    @property
+    def active_connections(self) -> int:
+        """
+        Upstream calls currently in flight (queued requests are not counted)
+        """
+        return self.admission.in_flight()
 
     async def forward_request(self, request: Request, path: str, target_service: str) -> Response:
         """
@@ -56,13 +152,23 @@ class ProxyService:
         if request.method in ["POST", "PUT", "PATCH"]:
             try:
                 body = await request.body()
+            except HTTPException:
+                # e.g. 413 from a compressed body that expands past the limit
+                raise
             except:
                 body = None
+
+        if getattr(request.state, "capture", False):
+            # Generic proxy bodies are not masked, so only their size is recorded
+            request.state.capture_shape = {"body_length": len(body) if body else 0}
         
         headers = dict(request.headers)
         headers_to_remove = ["host", "content-length", "transfer-encoding"]
         for header in headers_to_remove:
             headers.pop(header, None)
+        # The upstream body is relayed still encoded, so only ask for encodings
+        # the client takes (httpx would otherwise add its own default)
+        headers.setdefault("accept-encoding", "identity")
   
         if target_service == "openrouter":
             headers.update({
@@ -74,37 +180,58 @@ class ProxyService:
         target_url = f"{service_config['base_url']}/{path}"
  
         self._log_request(request, target_service, path)
+        current_priority.set(parse_priority(request.headers.get("x-request-priority")))
+        route = self._route_label(request)
+        current_route.set(route)
+        request.state.target_service = target_service
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.request(
+            async with self.admission.slot(target_service), httpx.AsyncClient(timeout=30.0) as client, \
+                    span("upstream", provider=target_service) as upstream_span:
+                start = time.perf_counter()
+                upstream_request = client.build_request(
                     method=request.method,
                     url=target_url,
                     headers=headers,
                     content=body,
                     params=dict(request.query_params)
                 )
+                response = await client.send(upstream_request, stream=True)
+                try:
+                    # Relay the bytes as received; decode only for a client that can't take the encoding
+                    encoding = response.headers.get("content-encoding", "identity")
+                    passthrough = encoding == "identity" or accepts(request.headers.get("accept-encoding"), encoding)
+                    chunks = response.aiter_raw() if passthrough else response.aiter_bytes()
+                    content = b"".join([chunk async for chunk in chunks])
+                finally:
+                    await response.aclose()
+                UPSTREAM_LATENCY.observe(time.perf_counter() - start, route, target_service)
+                upstream_span.set(status_code=response.status_code, bytes=len(content))
              
-                self._log_response(response, target_service)
+                self._log_response(response, target_service, len(content))
           
-                return Response(
-                    content=response.content,
-                    status_code=response.status_code,
-                    headers=dict(response.headers)
-                )
-                
+                return self._relay_response(response, content, keep_encoding=passthrough)
+
+        except AdmissionRejected as e:
+            raise self._overloaded(e)
         except Exception as e:
             logger.error(f"Proxy forwarding error: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Forwarding failed: {str(e)}")
 
-    async def forward_chat_request(self, request: Request, body: Dict[str, Any], target_service: str) -> Dict[str, Any]:
+    async def forward_chat_request(self, request: Request, body: Dict[str, Any],
+                                   target_service: Optional[str] = None) -> Union[Response, StreamingResponse]:
         """
         Forward a chat request with security filtering
+
+        When no target_service is pinned, the router picks the fastest healthy
+        provider that can serve the model and fails over on upstream errors.
         """
-        if target_service not in self.services:
+        if target_service is not None and target_service not in self.services:
             raise HTTPException(status_code=400, detail=f"Unknown service: {target_service}")
-        
-        service_config = self.services[target_service]
+
+        route = self._route_label(request)
+        current_route.set(route)
+        request.state.target_service = target_service or "auto"
     
         if not self._check_rate_limit():
             raise HTTPException(status_code=429, detail="Rate limit exceeded")
@@ -113,21 +240,213 @@ class ProxyService:
         if not messages:
             raise HTTPException(status_code=400, detail="No messages provided")
  
-        filtered_messages = []
-        for message in messages:
-            if message.get("role") == "user":
-                content = message.get("content", "")
-        
-                masked_content, _ = smart_mask(content, "chat_message.txt", USE_SECURE_FILTER)
-                filtered_messages.append({
-                    "role": message["role"],
-                    "content": masked_content
-                })
-            else:
-                filtered_messages.append(message)
-   
+        filtered_messages = self._filter_conversations([messages])[0]
+        filtered_messages, tokens = self.token_budget.compact_messages(filtered_messages, body.get("model"))
+        if getattr(request.state, "capture", False):
+            request.state.capture_shape = TRAFFIC_RECORDER.chat_shape(body, filtered_messages)
+
+        candidates = self.router.candidates(body.get("model"), target_service)
+        if not candidates:
+            raise HTTPException(status_code=503, detail="No healthy upstream provider available for this model")
+
+        request_body = self._build_chat_body(body, filtered_messages)
+        route_key = target_service or "auto"
+        self._log_request(request, route_key, "chat/completions")
+        current_priority.set(parse_priority(body.get("priority") or request.headers.get("x-request-priority")))
+
+        # Per-request override, either as a Cache-Control header or a "cache_control" body field
+        cache_directives = parse_cache_control(body.get("cache_control") or request.headers.get("cache-control"))
+        pinned = target_service is not None
+        mask_response = self.response_masking.requested(
+            body.get("mask_response", request.headers.get("x-mask-response"))
+        )
+
+        try:
+            if request_body["stream"]:
+                flight_key = request_fingerprint(route_key, request_body)
+                stream, shared, stream_info = self.single_flight.stream(
+                    flight_key, lambda info: self._stream_with_failover(candidates, request_body, pinned, info)
+                )
+                first_chunk = await stream.__anext__()
+                request.state.target_service = stream_info.get("provider", route_key)
+                chunks = self._replay_stream(first_chunk, stream)
+                return StreamingResponse(
+                    self.response_masking.mask_stream(chunks) if mask_response else chunks,
+                    media_type="text/event-stream",
+                    headers={
+                        "X-Proxy-Service": request.state.target_service,
+                        "X-Secure-Filtering-Applied": str(USE_SECURE_FILTER).lower(),
+                        "X-Response-Masking": str(mask_response).lower(),
+                        "X-Coalesced": str(shared).lower(),
+                        "X-Prompt-Tokens-Before": str(tokens["before"]),
+                        "X-Prompt-Tokens-After": str(tokens["after"]),
+                        "X-Prompt-Compacted": str(tokens["compacted"]).lower()
+                    }
+                )
+
+            provider, content, cache_status, shared = await self._complete_chat(
+                route, route_key, candidates, request_body, cache_directives, pinned
+            )
+            request.state.target_service = provider
+            metadata = self._security_metadata(messages, filtered_messages, provider, cache_status, tokens)
+            if cache_status != "hit":
+                metadata["coalesced"] = shared
+            if mask_response:
+                content, metadata["response_masked"] = self.response_masking.mask_completion_bytes(content)
+
+            return self._chat_response(content, metadata)
+
+        except Exception as e:
+            raise self._chat_error(e, route_key)
+
+    async def forward_chat_batch(self, request: Request, items: List[Dict[str, Any]],
+                                 target_service: Optional[str] = None,
+                                 parallelism: Optional[int] = None) -> StreamingResponse:
+        """
+        Forward many independent, non-streaming chat requests in one call
+
+        All user messages are masked together up front, then the items are sent
+        upstream concurrently (at most `parallelism` at a time) at bulk priority
+        unless told otherwise. Results are streamed back as NDJSON in completion
+        order; each line carries the item's index, and a failed item produces an
+        error line instead of failing the batch.
+        """
+        if target_service is not None and target_service not in self.services:
+            raise HTTPException(status_code=400, detail=f"Unknown service: {target_service}")
+        if not items:
+            raise HTTPException(status_code=400, detail="No requests provided")
+        if len(items) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Batch too large (max {BATCH_MAX_ITEMS} requests)")
+        if any(not isinstance(item, dict) for item in items):
+            raise HTTPException(status_code=400, detail="Each batch entry must be a chat request object")
+
+        route = self._route_label(request)
+        current_route.set(route)
+        request.state.target_service = target_service or "auto"
+
+        if not self._check_rate_limit():
+            raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+        conversations = [item.get("messages") or [] for item in items]
+        filtered, token_reports = [], []
+        for item, filtered_messages in zip(items, self._filter_conversations(conversations)):
+            filtered_messages, tokens = self.token_budget.compact_messages(filtered_messages, item.get("model"))
+            filtered.append(filtered_messages)
+            token_reports.append(tokens)
+        if getattr(request.state, "capture", False):
+            request.state.capture_shape = {
+                "parallelism": parallelism,
+                "target": target_service,
+                "requests": [TRAFFIC_RECORDER.chat_shape(item, messages) for item, messages in zip(items, filtered)]
+            }
+        route_key = target_service or "auto"
+        self._log_request(request, route_key, "chat/completions/batch")
+
+        limit = max(1, min(parallelism or BATCH_MAX_PARALLELISM, BATCH_MAX_PARALLELISM))
+        semaphore = asyncio.Semaphore(limit)
+        header_priority = request.headers.get("x-request-priority")
+        header_mask_response = request.headers.get("x-mask-response")
+
+        async def run_item(index: int) -> bytes:
+            item = items[index]
+            mask_response = self.response_masking.requested(item.get("mask_response", header_mask_response))
+            try:
+                if not conversations[index]:
+                    raise HTTPException(status_code=400, detail="No messages provided")
+                item_target = item.get("target", target_service)
+                if item_target is not None and item_target not in self.services:
+                    raise HTTPException(status_code=400, detail=f"Unknown service: {item_target}")
+                candidates = self.router.candidates(item.get("model"), item_target)
+                if not candidates:
+                    raise HTTPException(status_code=503, detail="No healthy upstream provider available for this model")
+
+                requested_priority = item.get("priority") or header_priority
+                current_priority.set(parse_priority(requested_priority) if requested_priority else PRIORITY_BULK)
+                request_body = self._build_chat_body(item, filtered[index])
+                request_body["stream"] = False
+                item_key = item_target or "auto"
+                async with semaphore:
+                    provider, content, cache_status, shared = await self._complete_chat(
+                        route, item_key, candidates, request_body,
+                        parse_cache_control(item.get("cache_control")), item_target is not None
+                    )
+            except Exception as e:
+                error = self._chat_error(e, route_key)
+                return json_codec.dumps({
+                    "index": index,
+                    "status": error.status_code,
+                    "error": error.detail
+                }) + b"\n"
+
+            metadata = self._security_metadata(
+                conversations[index], filtered[index], provider, cache_status, token_reports[index]
+            )
+            if cache_status != "hit":
+                metadata["coalesced"] = shared
+            if mask_response:
+                content, metadata["response_masked"] = self.response_masking.mask_completion_bytes(content)
+            if b"\n" in content:
+                # NDJSON needs one line per item; only pretty-printed bodies pay for a re-encode
+                content = json_codec.dumps(json_codec.loads(content))
+            if SECURITY_METADATA_IN_BODY:
+                content = json_codec.splice_field(content, "security_metadata", metadata) or content
+            return b'{"index":%d,"status":200,"response":%s}\n' % (index, content)
+
+        async def results():
+            tasks = [asyncio.ensure_future(run_item(index)) for index in range(len(items))]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(
+            results(),
+            media_type="application/x-ndjson",
+            headers={
+                "X-Secure-Filtering-Applied": str(USE_SECURE_FILTER).lower(),
+                "X-Batch-Size": str(len(items))
+            }
+        )
+
+    def _filter_conversations(self, conversations: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        """
+        Mask the user messages of one or more conversations in a single masking batch
+        """
+        user_contents = [
+            message.get("content", "")
+            for messages in conversations for message in messages if message.get("role") == "user"
+        ]
+        masked = iter(smart_mask_batch(user_contents, "chat_message.txt", USE_SECURE_FILTER))
+
+        filtered_conversations = []
+        for messages in conversations:
+            filtered_messages = []
+            for message in messages:
+                if message.get("role") == "user":
+                    masked_content, _ = next(masked)
+                    filtered_messages.append({
+                        "role": message["role"],
+                        "content": masked_content
+                    })
+                else:
+                    filtered_messages.append(message)
+            filtered_conversations.append(filtered_messages)
+
+            if PROMPT_CAPTURE.enabled:
+                PROMPT_CAPTURE.capture(json.dumps(filtered_messages), route=current_route.get())
+        return filtered_conversations
+
+    @staticmethod
+    def _build_chat_body(body: Dict[str, Any], filtered_messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Upstream request body for a chat call
+        """
+        # The model is resolved per provider at send time; keep the requested
+        # name here so cache and coalescing keys do not depend on the route.
         request_body = {
-            "model": body.get("model", service_config["models"][0]),
+            "model": body.get("model"),
             "messages": filtered_messages,
             "max_tokens": body.get("max_tokens", 1000),
             "temperature": body.get("temperature", 0.7),
@@ -138,50 +457,358 @@ class ProxyService:
         for param in optional_params:
             if param in body:
                 request_body[param] = body[param]
-     
+        return request_body
+
+    async def _complete_chat(self, route: str, route_key: str, candidates: List[Tuple[str, str]],
+                             request_body: Dict[str, Any], cache_directives: Dict[str, Any],
+                             pinned: bool) -> Tuple[str, bytes, str, bool]:
+        """
+        Non-streaming chat call through the response cache, single-flight and failover
+
+        Returns (provider, response bytes, cache status, coalesced)
+        """
+        cacheable = self.response_cache.is_cacheable(request_body, cache_directives)
+        cache_key = self.response_cache.make_key(route_key, request_body) if cacheable else None
+        cache_status = "bypass"
+
+        if cacheable and cache_directives.get("no-cache"):
+            cache_status = "refresh"
+        elif cacheable:
+            with span("cache.get") as cache_span:
+                cached = await self.response_cache.get(cache_key)
+                cache_span.set(hit=cached is not None)
+            CACHE_LOOKUPS.inc(route, route_key, "miss" if cached is None else "hit")
+            if cached is not None:
+                return route_key, cached, "hit", False
+            cache_status = "miss"
+
+        async def call_upstream() -> Tuple[str, httpx.Response]:
+            provider, response = await self._post_with_failover(candidates, request_body, pinned)
+            if cacheable:
+                with span("cache.put", bytes=len(response.content)):
+                    await self.response_cache.put(cache_key, response.content, cache_directives.get("max-age"))
+            self._log_response(response, provider)
+            return provider, response
+
+        flight_key = request_fingerprint(route_key, request_body)
+        (provider, response), shared = await self.single_flight.do(flight_key, call_upstream)
+        return provider, response.content, cache_status, shared
+
+    def _chat_error(self, error: Exception, route_key: str) -> HTTPException:
+        """
+        Map an exception from the chat pipeline onto the HTTP error returned to the client
+        """
+        if isinstance(error, HTTPException):
+            return error
+        if isinstance(error, AdmissionRejected):
+            return self._overloaded(error)
+        if isinstance(error, httpx.HTTPStatusError):
+            logger.error(f"HTTP error from {route_key}: {error.response.status_code}")
+            return HTTPException(status_code=error.response.status_code, detail=f"Service error: {error.response.text}")
+        if isinstance(error, httpx.TransportError):
+            logger.error(f"Upstream unreachable for {route_key}: {str(error)}")
+            return HTTPException(status_code=502, detail=f"Upstream unavailable: {str(error)}")
+        logger.error(f"Chat forwarding error: {str(error)}")
+        return HTTPException(status_code=500, detail=f"Chat forwarding failed: {str(error)}")
+
+    async def _post_with_failover(self, candidates: List[Tuple[str, str]], request_body: Dict[str, Any],
+                                  pinned: bool) -> Tuple[str, httpx.Response]:
+        """
+        Try each candidate provider in order until one returns a response
+        """
+        last_error: Optional[Exception] = None
+        for attempt, (provider, upstream_model) in enumerate(candidates):
+            if not self.router.acquire(provider, upstream_model) and not pinned:
+                continue
+            if attempt > 0:
+                self.router.failovers += 1
+
+            alternate = self._hedge_target(candidates, attempt)
+            try:
+                return await self.hedging.run(
+                    (provider, upstream_model),
+                    lambda: self._post_attempt(provider, upstream_model, request_body),
+                    lambda: self._post_attempt(alternate[0], alternate[1], request_body)
+                )
+            except Exception as e:
+                if not self._is_retryable(e):
+                    raise
+                logger.warning(f"Upstream {provider} failed ({type(e).__name__}), trying next provider")
+                last_error = e
+
+        if last_error is not None:
+            raise last_error
+        raise HTTPException(status_code=503, detail="No healthy upstream provider available for this model")
+
+    async def _stream_with_failover(self, candidates: List[Tuple[str, str]], request_body: Dict[str, Any],
+                                    pinned: bool, stream_info: Dict[str, Any]):
+        """
+        Streaming variant of _post_with_failover; fails over only until the first chunk arrives
+        """
+        last_error: Optional[Exception] = None
+        for attempt, (provider, upstream_model) in enumerate(candidates):
+            if not self.router.acquire(provider, upstream_model) and not pinned:
+                continue
+            if attempt > 0:
+                self.router.failovers += 1
+
+            alternate = self._hedge_target(candidates, attempt)
+            try:
+                served_by, stream, first_chunk = await self.hedging.run(
+                    (provider, upstream_model),
+                    lambda: self._open_stream(provider, upstream_model, request_body),
+                    lambda: self._open_stream(alternate[0], alternate[1], request_body),
+                    discard=lambda opened: opened[1].aclose()
+                )
+            except Exception as e:
+                if not self._is_retryable(e):
+                    raise
+                logger.warning(f"Upstream {provider} stream failed ({type(e).__name__}), trying next provider")
+                last_error = e
+                continue
+
+            stream_info["provider"] = served_by
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+            return
+
+        if last_error is not None:
+            raise last_error
+        raise HTTPException(status_code=503, detail="No healthy upstream provider available for this model")
+
+    def _hedge_target(self, candidates: List[Tuple[str, str]], index: int) -> Tuple[str, str]:
+        """
+        Where a hedge for candidates[index] goes: the next healthy candidate, else the same provider
+        """
+        for provider, upstream_model in candidates[index + 1:]:
+            if self.router.is_closed(provider, upstream_model):
+                return provider, upstream_model
+        return candidates[index]
+
+    async def _post_attempt(self, provider: str, upstream_model: str,
+                            request_body: Dict[str, Any]) -> Tuple[str, httpx.Response]:
+        """
+        One non-streaming upstream call, recording its outcome for routing and hedging
+        """
+        async with self.admission.slot(provider):
+            start = time.monotonic()
+            try:
+                response = await self._post_upstream(provider, dict(request_body, model=upstream_model))
+            except BaseException as e:
+                self._record_attempt_error(provider, upstream_model, time.monotonic() - start, e)
+                raise
+
+        elapsed = time.monotonic() - start
+        self.router.record(provider, upstream_model, elapsed, ok=True)
+        self.hedging.record_latency((provider, upstream_model), elapsed)
+        return provider, response
+
+    async def _open_stream(self, provider: str, upstream_model: str, request_body: Dict[str, Any]):
+        """
+        Open an upstream stream and wait for its first chunk; returns (provider, stream, first_chunk)
+        """
+        # The admission slot is held until the stream is exhausted or closed
+        await self.admission.acquire(provider)
+        start = time.monotonic()
+        stream = SlotHeldStream(
+            self._stream_upstream(provider, dict(request_body, model=upstream_model)),
+            lambda: self.admission.release(provider)
+        )
+        try:
+            first_chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            first_chunk = b""
+        except BaseException as e:
+            await stream.aclose()
+            self._record_attempt_error(provider, upstream_model, time.monotonic() - start, e)
+            raise
+
+        # For streams the recorded latency is time to first chunk
+        elapsed = time.monotonic() - start
+        self.router.record(provider, upstream_model, elapsed, ok=True)
+        self.hedging.record_latency((provider, upstream_model), elapsed)
+        return provider, stream, first_chunk
+
+    def _record_attempt_error(self, provider: str, upstream_model: str, elapsed: float, error: BaseException):
+        """
+        Record a failed upstream attempt for routing.
+
+        Retryable errors count against the provider. Other client errors (the
+        request itself was bad) are kept apart from its health. Cancellation (a losing hedge, or the client
+        going away) records nothing, but still frees a half-open probe slot
+        so the provider is not shut out for good.
+        """
+        if not isinstance(error, Exception):
+            self.router.release(provider, upstream_model)
+            return
+        self._record_upstream_error(provider, error)
+        if self._is_retryable(error):
+            self.router.record(provider, upstream_model, elapsed, ok=False)
+        else:
+            self.router.record_client_error(provider, upstream_model)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """
+        Transport failures, 5xx responses, full local queues and 401/403/429s
+        (the provider's key or quota, not the request) are worth retrying on another provider
+        """
+        if isinstance(error, AdmissionRejected):
+            return True
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status in (401, 403, 429) or status >= 500
+        return isinstance(error, httpx.TransportError)
+
+    @staticmethod
+    def _overloaded(error: AdmissionRejected) -> HTTPException:
+        """
+        Fast 503 for requests turned away by admission control
+        """
+        logger.warning(f"Admission rejected for {error.upstream}: {error.reason}")
+        return HTTPException(
+            status_code=503,
+            detail=f"Upstream {error.upstream} overloaded: {error.reason}",
+            headers={"Retry-After": str(error.retry_after)}
+        )
+
+    def _upstream_url(self, provider: str, path: str) -> str:
+        return f"{self.services[provider]['base_url']}/{path}"
+
+    def _upstream_headers(self, provider: str) -> Dict[str, str]:
+        """
+        Headers for an upstream chat call
+        """
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {service_config['api_key']}"
+            "Authorization": f"Bearer {self.services[provider]['api_key']}"
         }
-        
-        if target_service == "openrouter":
+        if provider == "openrouter":
             headers.update({
                 "HTTP-Referer": "http://localhost:8000",
                 "X-Title": "Secure AI Proxy"
             })
-      
-        target_url = f"{service_config['base_url']}/chat/completions"
-     
-        self._log_request(request, target_service, "chat/completions")
-        
+        return headers
+
+    async def _post_upstream(self, provider: str, request_body: Dict[str, Any]) -> httpx.Response:
+        """
+        Send a non-streaming chat completion upstream
+        """
+        route = current_route.get()
+        async with httpx.AsyncClient(timeout=30.0) as client, span("upstream", provider=provider) as upstream_span:
+            start = time.perf_counter()
+            upstream_request = client.build_request(
+                "POST",
+                self._upstream_url(provider, "chat/completions"),
+                headers=self._upstream_headers(provider),
+                content=json_codec.dumps(request_body)
+            )
+            response = await client.send(upstream_request, stream=True)
+            UPSTREAM_TTFB.observe(time.perf_counter() - start, route, provider)
+            upstream_span.set(status_code=response.status_code, ttfb_ms=round((time.perf_counter() - start) * 1000, 3))
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, route, provider)
+
+            response.raise_for_status()
+            return response
+
+    async def _stream_upstream(self, provider: str, request_body: Dict[str, Any]):
+        """
+        Send a streaming chat completion upstream and yield the raw SSE bytes
+        """
+        route = current_route.get()
+        # Not a with-span: the body is consumed a chunk at a time, across yields
+        upstream_span = start_span("upstream.stream", provider=provider)
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    url=target_url,
-                    headers=headers,
-                    json=request_body
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-             
-                result["security_metadata"] = {
-                    "secure_filtering_applied": USE_SECURE_FILTER,
-                    "original_message_count": len(messages),
-                    "filtered_message_count": len(filtered_messages),
-                    "proxy_service": target_service
-                }
-          
-                self._log_response(response, target_service)
-                
-                return result
-                
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error from {target_service}: {e.response.status_code}")
-            raise HTTPException(status_code=e.response.status_code, detail=f"Service error: {e.response.text}")
-        except Exception as e:
-            logger.error(f"Chat forwarding error: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Chat forwarding failed: {str(e)}")
+                start = time.perf_counter()
+                async with client.stream(
+                    "POST",
+                    self._upstream_url(provider, "chat/completions"),
+                    headers=self._upstream_headers(provider),
+                    content=json_codec.dumps(request_body)
+                ) as response:
+                    UPSTREAM_TTFB.observe(time.perf_counter() - start, route, provider)
+                    upstream_span.set(status_code=response.status_code,
+                                      ttfb_ms=round((time.perf_counter() - start) * 1000, 3))
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        yield chunk
+                UPSTREAM_LATENCY.observe(time.perf_counter() - start, route, provider)
+        finally:
+            upstream_span.finish()
+
+    @staticmethod
+    def _record_upstream_error(provider: str, error: Exception):
+        if isinstance(error, httpx.HTTPStatusError):
+            kind = f"http_{error.response.status_code}"
+        else:
+            kind = type(error).__name__
+        UPSTREAM_ERRORS.inc(current_route.get(), provider, kind)
+
+    @staticmethod
+    def _route_label(request: Request) -> str:
+        """
+        Route template for metric labels, falling back to the raw path
+        """
+        return getattr(request.scope.get("route"), "path", request.url.path)
+
+    @staticmethod
+    async def _replay_stream(first_chunk: bytes, stream):
+        """
+        Re-attach the chunk consumed to surface upstream errors before the response started
+        """
+        yield first_chunk
+        async for chunk in stream:
+            yield chunk
+
+    @staticmethod
+    def _chat_response(content: bytes, metadata: Dict[str, Any]) -> Response:
+        """
+        Return upstream JSON bytes as-is, with the security metadata in headers
+        and (unless disabled) spliced into the body without re-encoding it
+        """
+        headers = {
+            "X-Proxy-Service": metadata["proxy_service"],
+            "X-Secure-Filtering-Applied": str(metadata["secure_filtering_applied"]).lower(),
+            "X-Cache": metadata["cache"]
+        }
+        if "coalesced" in metadata:
+            headers["X-Coalesced"] = str(metadata["coalesced"]).lower()
+        if "response_masked" in metadata:
+            headers["X-Response-Masking"] = "true"
+        if "tokens" in metadata:
+            # Tells the client when the token budget removed part of its prompt
+            headers["X-Prompt-Compacted"] = str(metadata["tokens"]["compacted"]).lower()
+
+        if SECURITY_METADATA_IN_BODY:
+            spliced = json_codec.splice_field(content, "security_metadata", metadata)
+            if spliced is not None:
+                content = spliced
+        return Response(content=content, media_type="application/json", headers=headers)
+
+    def _security_metadata(self, messages: List[Dict[str, Any]], filtered_messages: List[Dict[str, Any]],
+                           target_service: str, cache_status: str,
+                           tokens: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Build the security metadata attached to chat responses
+        """
+        metadata = {
+            "secure_filtering_applied": USE_SECURE_FILTER,
+            "original_message_count": len(messages),
+            "filtered_message_count": len(filtered_messages),
+            "proxy_service": target_service,
+            "cache": cache_status
+        }
+        if tokens is not None:
+            metadata["tokens"] = tokens
+        return metadata
 
     def _check_rate_limit(self) -> bool:
         """
@@ -218,21 +845,38 @@ class ProxyService:
             "status": "forwarded"
         }
         
-        logger.info(f"Request logged: {log_entry}")
+        logger.info("Request logged", extra={"event": "request", "fields": log_entry})
         self.request_count += 1
 
-    def _log_response(self, response: httpx.Response, target_service: str):
+    @staticmethod
+    def _relay_response(response: httpx.Response, content: bytes, keep_encoding: bool) -> Response:
+        """
+        Build the client response from an upstream one. Hop-by-hop headers are
+        dropped and Content-Length is recomputed for the bytes actually sent;
+        Content-Encoding is kept only when the body is still encoded.
+        """
+        skip = _HOP_BY_HOP_HEADERS if keep_encoding else _HOP_BY_HOP_HEADERS | {b"content-encoding"}
+        relayed = Response(content=content, status_code=response.status_code)
+        # raw_headers rather than a dict, so repeated headers such as Set-Cookie survive
+        relayed.raw_headers.extend(
+            (name.lower(), value) for name, value in response.headers.raw if name.lower() not in skip
+        )
+        return relayed
+
+    def _log_response(self, response: httpx.Response, target_service: str, size: Optional[int] = None):
         """
         Log the response from the target service
         """
+        if size is None:
+            size = len(response.content) if response.content else 0
         log_entry = {
             "target_service": target_service,
             "status_code": response.status_code,
             "timestamp": time.time(),
-            "response_size": len(response.content) if response.content else 0
+            "response_size": size
         }
         
-        logger.info(f"Response logged: {log_entry}")
+        logger.info("Response logged", extra={"event": "response", "fields": log_entry})
 
     def _get_user_hash(self, request: Request) -> str:
         """
@@ -264,5 +908,11 @@ class ProxyService:
             "total_requests": self.request_count,
             "active_connections": self.active_connections,
             "rate_limits": self.rate_limits,
-            "recent_requests": len(self.request_history)
+            "recent_requests": len(self.request_history),
+            "response_cache": self.response_cache.get_stats(),
+            "coalescing": self.single_flight.get_stats(),
+            "routing": self.router.get_stats(),
+            "hedging": self.hedging.get_stats(),
+            "token_budget": self.token_budget.get_stats(),
+            "admission": self.admission.get_stats()
         } 
@@ -0,0 +1,191 @@
+import bisect
+import re
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+from config import SECURITY_LOG_CAPACITY
+
+# Keys must never end up in the history, even when sent as a query parameter
+_API_KEY_PARAM_RE = re.compile(r"(api_key=)[^&]*", re.IGNORECASE)
+MAX_QUERY_CHARS = 256
+
+
+class _Interner:
+    """
+    Hands out one shared str object per distinct value, for up to max_size values
+    """
+
+    __slots__ = ("pool", "max_size")
+
+    def __init__(self, max_size: int):
+        self.pool: Dict[str, str] = {}
+        self.max_size = max_size
+
+    def __call__(self, value: str) -> str:
+        pooled = self.pool.get(value)
+        if pooled is not None:
+            return pooled
+        if len(self.pool) < self.max_size:
+            self.pool[value] = value
+        return value
+
+
+class RequestLog:
+    """
+    Fixed-capacity ring buffer of recent requests for security analysis.
+
+    Records are stored column by column: numbers in typed arrays and strings
+    as references into per-column intern pools, so a retained request costs
+    a few dozen bytes however many times its IP, path or user agent repeats,
+    and nothing is copied when old records are overwritten.
+
+    Record n (counting from 0 since start) lives in slot n % capacity and is
+    identified by n, which is also the paging cursor. Each record links to the
+    previous record from the same IP, so per-IP queries only visit that IP's
+    records. Time-range queries binary search the timestamps, which assumes
+    the wall clock does not step backwards much.
+    """
+
+    def __init__(self, capacity: int = SECURITY_LOG_CAPACITY, intern_size: int = 4096):
+        self.capacity = max(1, capacity)
+        self.total = 0
+        self._time = array("d", bytes(8 * self.capacity))
+        self._status = array("H", bytes(2 * self.capacity))
+        self._duration_ms = array("f", bytes(4 * self.capacity))
+        self._has_api_key = bytearray(self.capacity)
+        self._prev_same_ip = array("q", [-1]) * self.capacity
+        self._ip: List[Optional[str]] = [None] * self.capacity
+        self._method: List[Optional[str]] = [None] * self.capacity
+        self._path: List[Optional[str]] = [None] * self.capacity
+        self._user_agent: List[Optional[str]] = [None] * self.capacity
+        self._query: List[Optional[str]] = [None] * self.capacity
+        self._latest_by_ip: Dict[str, int] = {}
+
+        self._ips = _Interner(intern_size)
+        self._methods = _Interner(64)
+        self._paths = _Interner(intern_size)
+        self._user_agents = _Interner(intern_size)
+        self._queries = _Interner(intern_size)
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    @property
+    def oldest(self) -> int:
+        """Number of the oldest record still retained"""
+        return max(0, self.total - self.capacity)
+
+    def append(self, timestamp: float, ip: str, method: str, path: str, user_agent: str,
+               query: str = "", has_api_key: bool = False) -> int:
+        """
+        Record a request; returns its record number, for complete()
+        """
+        seq = self.total
+        slot = seq % self.capacity
+        if seq >= self.capacity:
+            evicted_ip = self._ip[slot]
+            if self._latest_by_ip.get(evicted_ip) == seq - self.capacity:
+                del self._latest_by_ip[evicted_ip]
+
+        ip = self._ips(ip)
+        if query:
+            query = self._queries(_API_KEY_PARAM_RE.sub(r"\1<redacted>", query[:MAX_QUERY_CHARS]))
+        self._time[slot] = timestamp
+        self._status[slot] = 0
+        self._duration_ms[slot] = 0.0
+        self._has_api_key[slot] = 1 if has_api_key else 0
+        self._prev_same_ip[slot] = self._latest_by_ip.get(ip, -1)
+        self._latest_by_ip[ip] = seq
+        self._ip[slot] = ip
+        self._method[slot] = self._methods(method)
+        self._path[slot] = self._paths(path)
+        self._user_agent[slot] = self._user_agents(user_agent)
+        self._query[slot] = query
+        self.total = seq + 1
+        return seq
+
+    def complete(self, seq: int, status: int, duration: float):
+        """
+        Add the response status and duration (seconds) to a record, if it is still retained
+        """
+        if self.oldest <= seq < self.total:
+            slot = seq % self.capacity
+            self._status[slot] = status
+            self._duration_ms[slot] = duration * 1000.0
+
+    def get(self, seq: int) -> Optional[Dict[str, Any]]:
+        if not self.oldest <= seq < self.total:
+            return None
+        slot = seq % self.capacity
+        return {
+            "id": seq,
+            "timestamp": self._time[slot],
+            "ip": self._ip[slot],
+            "method": self._method[slot],
+            "path": self._path[slot],
+            "query_string": self._query[slot],
+            "user_agent": self._user_agent[slot],
+            "has_api_key": bool(self._has_api_key[slot]),
+            "status_code": self._status[slot] or None,
+            "duration_ms": round(self._duration_ms[slot], 3) if self._status[slot] else None
+        }
+
+    def query(self, start: Optional[float] = None, end: Optional[float] = None, ip: Optional[str] = None,
+              before: Optional[int] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Records newest first, optionally from one IP and within [start, end].
+
+        Pass the returned cursor as before to get the next page; it is None
+        on the last page.
+        """
+        lower = self.oldest
+        upper = self.total if before is None else max(lower, min(before, self.total))
+        times, capacity = self._time, self.capacity
+        if end is not None:
+            upper = bisect.bisect_right(range(lower, upper), end, key=lambda seq: times[seq % capacity]) + lower
+        if start is not None:
+            lower = bisect.bisect_left(range(lower, upper), start, key=lambda seq: times[seq % capacity]) + lower
+
+        if ip is None:
+            seqs = range(upper - 1, lower - 1, -1)[:limit + 1]
+        else:
+            seqs = []
+            seq = self._latest_by_ip.get(ip, -1)
+            # Skip the IP's records at or after the cursor, then walk back to the range start
+            while seq >= upper:
+                seq = self._prev_same_ip[seq % capacity]
+            while seq >= lower and len(seqs) <= limit:
+                seqs.append(seq)
+                seq = self._prev_same_ip[seq % capacity]
+
+        records = [self.get(seq) for seq in seqs[:limit]]
+        next_cursor = records[-1]["id"] if len(seqs) > limit else None
+        return records, next_cursor
+
+    def memory_bytes(self) -> int:
+        """
+        Approximate memory held by the log: the columns plus the pooled strings
+        """
+        columns = (self._time, self._status, self._duration_ms, self._has_api_key, self._prev_same_ip,
+                   self._ip, self._method, self._path, self._user_agent, self._query)
+        size = sum(sys.getsizeof(column) for column in columns)
+        for interner in (self._ips, self._methods, self._paths, self._user_agents, self._queries):
+            size += sys.getsizeof(interner.pool) + sum(sys.getsizeof(value) for value in interner.pool)
+        size += sys.getsizeof(self._latest_by_ip)
+        return size
+
+    def get_stats(self) -> Dict[str, Any]:
+        retained = len(self)
+        memory = self.memory_bytes()
+        return {
+            "capacity": self.capacity,
+            "retained": retained,
+            "total": self.total,
+            "oldest_timestamp": self._time[self.oldest % self.capacity] if retained else None,
+            "memory_bytes": memory,
+            # Columns are allocated up front, so this is the cost once the log is full
+            "bytes_per_slot": round(memory / self.capacity, 1)
+        }
+
+
+SECURITY_LOG = RequestLog()
@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Any]:
+    """
+    Parse a Cache-Control style string ("no-cache, max-age=60") into a dict
+    """
+    directives = {}
+    if not value:
+        return directives
+
+    for part in str(value).split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if "=" in part:
+            name, _, arg = part.partition("=")
+            try:
+                directives[name.strip()] = int(arg.strip().strip('"'))
+            except ValueError:
+                continue
+        else:
+            directives[part] = True
+
+    return directives
+
+
+def request_fingerprint(target_service: str, request_body: Dict[str, Any]) -> str:
+    """
+    SHA-256 over the canonical JSON of a masked upstream request body
+    """
+    canonical = json.dumps(
+        {"target": target_service, "body": request_body},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU + optional sqlite) cache for upstream chat responses.
+
+    Values are the raw upstream response bytes. Keys are a SHA-256 over the
+    canonical JSON of the already-masked request body, so the cache never
+    sees unmasked user content.
+    """
+
+    def __init__(self, enabled: bool = False, ttl: int = 3600, max_entries: int = 1024,
+                 max_bytes: int = 64 * 1024 * 1024, disk_path: str = "",
+                 disk_max_bytes: int = 512 * 1024 * 1024):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.memory_bytes = 0
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+        self._disk_conn = None
+        self._disk_lock = threading.Lock()
+        if self.enabled and self.disk_path:
+            self._init_disk()
+
+    def _init_disk(self):
+        """
+        Open the on-disk tier
+        """
+        self._disk_conn = sqlite3.connect(self.disk_path, check_same_thread=False)
+        self._disk_conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL,
+                content BLOB NOT NULL
+            )
+        ''')
+        self._disk_conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)'
+        )
+        self._disk_conn.commit()
+
+    @staticmethod
+    def make_key(target_service: str, request_body: Dict[str, Any]) -> str:
+        """
+        Build a cache key from the masked request body (model, messages, sampling params)
+        """
+        return request_fingerprint(target_service, request_body)
+
+    def is_cacheable(self, request_body: Dict[str, Any], directives: Dict[str, Any]) -> bool:
+        """
+        Only deterministic, non-streaming completions are cached
+        """
+        if not self.enabled or directives.get("no-store"):
+            return False
+        if request_body.get("stream"):
+            return False
+        try:
+            return float(request_body.get("temperature", 1)) == 0.0
+        except (TypeError, ValueError):
+            return False
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up a cached response, checking memory first and then disk
+        """
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, content = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._record_hit(content)
+                self.memory_hits += 1
+                return content
+            self._evict_memory(key)
+
+        if self._disk_conn is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                expires_at, content = row
+                self._store_memory(key, content, expires_at)
+                self._record_hit(content)
+                self.disk_hits += 1
+                return content
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, content: bytes, ttl: Optional[int] = None):
+        """
+        Store a response in both tiers
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or len(content) > self.max_bytes:
+            return
+
+        expires_at = time.time() + ttl
+        self._store_memory(key, content, expires_at)
+        self.stores += 1
+
+        if self._disk_conn is not None:
+            await asyncio.to_thread(self._disk_put, key, content, expires_at)
+
+    def _record_hit(self, content: bytes):
+        self.hits += 1
+        self.bytes_saved += len(content)
+
+    def _store_memory(self, key: str, content: bytes, expires_at: float):
+        """
+        Insert into the LRU tier, evicting least recently used entries over the limits
+        """
+        if key in self._memory:
+            self._evict_memory(key)
+        self._memory[key] = (expires_at, content)
+        self.memory_bytes += len(content)
+
+        while self._memory and (len(self._memory) > self.max_entries or self.memory_bytes > self.max_bytes):
+            oldest_key = next(iter(self._memory))
+            self._evict_memory(oldest_key)
+            self.evictions += 1
+
+    def _evict_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= len(entry[1])
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[float, bytes]]:
+        with self._disk_lock:
+            row = self._disk_conn.execute(
+                'SELECT expires_at, content FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] <= now:
+                self._disk_conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                self._disk_conn.commit()
+                return None
+            self._disk_conn.execute('UPDATE response_cache SET last_access = ? WHERE key = ?', (now, key))
+            self._disk_conn.commit()
+            return row[0], bytes(row[1])
+
+    def _disk_put(self, key: str, content: bytes, expires_at: float):
+        now = time.time()
+        with self._disk_lock:
+            c = self._disk_conn
+            c.execute('''
+                INSERT OR REPLACE INTO response_cache (key, expires_at, last_access, size, content)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, expires_at, now, len(content), content))
+            c.execute('DELETE FROM response_cache WHERE expires_at <= ?', (now,))
+
+            total = c.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache').fetchone()[0]
+            while total > self.disk_max_bytes:
+                row = c.execute(
+                    'SELECT key, size FROM response_cache ORDER BY last_access ASC LIMIT 1'
+                ).fetchone()
+                if row is None:
+                    break
+                c.execute('DELETE FROM response_cache WHERE key = ?', (row[0],))
+                total -= row[1]
+                self.evictions += 1
+            c.commit()
+
+    def clear(self):
+        """
+        Drop every cached response
+        """
+        self._memory.clear()
+        self.memory_bytes = 0
+        if self._disk_conn is not None:
+            with self._disk_lock:
+                self._disk_conn.execute('DELETE FROM response_cache')
+                self._disk_conn.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "disk_tier": self._disk_conn is not None,
+            "entries": len(self._memory),
+            "memory_bytes": self.memory_bytes,
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved
+        }
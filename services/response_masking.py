@@ -0,0 +1,334 @@
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+from masking.smart_masking import SmartMasker
+from masking.stream_masking import StreamMasker
+from services import json_codec
+from services.metrics import current_route, RESPONSE_MASK_DELAY, RESPONSE_MASKED_ENTITIES
+from services.tracing import span, start_span
+from config import (
+    SECURITY_LEVEL, RESPONSE_MASKING_ENABLED, RESPONSE_MASK_CATEGORIES, RESPONSE_MASK_HOLDBACK,
+    RESPONSE_MASK_MAX_HOLD_MS
+)
+
+# SSE events end with a blank line; the spec allows any of the three line endings
+_EVENT_END_RE = re.compile(rb"\r\n\r\n|\n\n|\r\r")
+_LINE_RE = re.compile(rb"\r\n|\n|\r")
+
+
+class ResponseMasking:
+    """
+    Masks sensitive patterns in AI responses before they reach the client.
+
+    Complete responses are masked in one pass. Streamed (SSE) responses are
+    masked delta by delta with a StreamMasker per choice, which holds back the
+    trailing partial word and holdback characters before it so a match split
+    across deltas is still caught. That delay is what masking adds to time to
+    first token; it is recorded, and once text has been held for max_hold
+    seconds while the upstream is quiet, the holdback is released early
+    (forced_flushes counts how often). A trailing partial word or a match
+    that may still grow is kept even then.
+    """
+
+    def __init__(self, enabled: bool, categories: List[str], holdback: int, max_hold: float,
+                 security_level: str = SECURITY_LEVEL):
+        self.enabled = enabled
+        self.categories = categories
+        self.holdback = holdback
+        self.max_hold = max_hold
+        self.security_level = security_level
+
+        self.responses = 0
+        self.streams = 0
+        self.forced_flushes = 0
+        self.masked: Dict[str, int] = {}
+        self.delays = 0
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+        self.mask_seconds = 0.0
+
+    def requested(self, value: Any) -> bool:
+        """
+        Whether to mask a response, from a per-request flag (bool or header string) or the default
+        """
+        if value is None:
+            return self.enabled
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return bool(value)
+
+    def mask_text(self, text: str) -> Tuple[str, List[str]]:
+        """
+        Mask one complete text; returns (masked text, masked types found)
+        """
+        masker = SmartMasker(self.security_level)
+        masked = masker.mask_sensitive_patterns(text, self.categories)
+        return masked, masker.masking_stats["sensitive_patterns_found"]
+
+    def mask_completion(self, result: Dict[str, Any]) -> int:
+        """
+        Mask the message content of a chat completion in place; returns the number of matches masked
+        """
+        start = time.perf_counter()
+        found: List[str] = []
+        with span("response_mask") as mask_span:
+            for choice in result.get("choices") or []:
+                message = choice.get("message") if isinstance(choice, dict) else None
+                if isinstance(message, dict) and isinstance(message.get("content"), str):
+                    message["content"], choice_found = self.mask_text(message["content"])
+                    found += choice_found
+            mask_span.set(entities=len(found))
+        self.mask_seconds += time.perf_counter() - start
+        self.responses += 1
+        self._record(found)
+        return len(found)
+
+    def mask_completion_bytes(self, content: bytes) -> Tuple[bytes, int]:
+        """
+        mask_completion for an upstream JSON body; bodies that are not a completion are returned as is
+        """
+        try:
+            result = json_codec.loads(content)
+        except ValueError:
+            return content, 0
+        if not isinstance(result, dict):
+            return content, 0
+        masked = self.mask_completion(result)
+        return (json_codec.dumps(result) if masked else content), masked
+
+    async def mask_stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Mask the content deltas of an SSE chat completion stream as it is relayed
+        """
+        stream = _SSEMasker(self)
+        iterator = chunks.__aiter__()
+        next_chunk: Optional[asyncio.Future] = None
+        self.streams += 1
+        mask_span = start_span("response_mask.stream")
+        try:
+            while True:
+                wait = stream.flush_in()
+                if next_chunk is None and wait is None:
+                    # Nothing held back, so there is nothing to time out
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    if next_chunk is None:
+                        next_chunk = asyncio.ensure_future(iterator.__anext__())
+                    done, _ = await asyncio.wait({next_chunk}, timeout=wait)
+                    if not done:
+                        out = stream.drain()
+                        if out:
+                            self.forced_flushes += 1
+                            yield out
+                        continue
+                    task, next_chunk = next_chunk, None
+                    try:
+                        chunk = task.result()
+                    except StopAsyncIteration:
+                        break
+                out = stream.feed(chunk)
+                if out:
+                    yield out
+            out = stream.close()
+            if out:
+                yield out
+        finally:
+            if next_chunk is not None:
+                next_chunk.cancel()
+                await asyncio.wait({next_chunk})
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            self._finish_stream(stream)
+            if stream.delay is not None:
+                mask_span.set(first_token_delay_ms=round(stream.delay * 1000, 3))
+            mask_span.finish()
+
+    def _finish_stream(self, stream: "_SSEMasker"):
+        found: List[str] = []
+        for masker in stream.maskers.values():
+            self.mask_seconds += masker.mask_seconds
+            for masked_type, count in masker.masked_type_counts().items():
+                found += [masked_type] * count
+        self._record(found)
+        if stream.delay is not None:
+            self.delays += 1
+            self.delay_total += stream.delay
+            self.delay_max = max(self.delay_max, stream.delay)
+            RESPONSE_MASK_DELAY.observe(stream.delay, current_route.get())
+
+    def _record(self, found: List[str]):
+        route = current_route.get()
+        for masked_type in found:
+            self.masked[masked_type] = self.masked.get(masked_type, 0) + 1
+            RESPONSE_MASKED_ENTITIES.inc(route, masked_type)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "categories": self.categories,
+            "holdback": self.holdback,
+            "max_hold_ms": self.max_hold * 1000,
+            "responses": self.responses,
+            "streams": self.streams,
+            "forced_flushes": self.forced_flushes,
+            "masked": dict(self.masked),
+            "masking_seconds": round(self.mask_seconds, 4),
+            "first_token_delay_ms": {
+                "mean": round(self.delay_total / self.delays * 1000, 3) if self.delays else 0.0,
+                "max": round(self.delay_max * 1000, 3)
+            }
+        }
+
+
+class _SSEMasker:
+    """
+    Rewrites the events of one SSE chat stream, replacing each delta's
+    content with the masked text that can be released so far
+    """
+
+    def __init__(self, owner: ResponseMasking):
+        self.owner = owner
+        self.maskers: Dict[int, StreamMasker] = {}
+        # Per choice: characters fed so far, and (fed count, arrival time) of pieces still held
+        self._fed: Dict[int, int] = {}
+        self._arrivals: Dict[int, Deque[Tuple[int, float]]] = {}
+        self._pending = b""
+        self._template: Dict[str, Any] = {}
+        # Set when the holdback was released early, until more content arrives
+        self._drained = False
+        self._first_content: Optional[float] = None
+        self.delay: Optional[float] = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._pending += chunk
+        out = []
+        position = 0
+        for end in _EVENT_END_RE.finditer(self._pending):
+            out.append(self._event(self._pending[position:end.start()]))
+            position = end.end()
+        self._pending = self._pending[position:]
+        return b"".join(out)
+
+    def flush_in(self) -> Optional[float]:
+        """
+        Seconds until held text must be flushed, or None if nothing is held (or there is no limit)
+        """
+        if self.owner.max_hold <= 0 or self._drained:
+            return None
+        oldest = min((arrivals[0][1] for arrivals in self._arrivals.values() if arrivals), default=None)
+        if oldest is None:
+            return None
+        return max(0.0, oldest + self.owner.max_hold - time.monotonic())
+
+    def drain(self) -> bytes:
+        """
+        Release what is only held back by the holdback, as extra events
+        """
+        self._drained = True
+        return b"".join(self._content_event(index, self._release(index, drain=True)) for index in list(self.maskers))
+
+    def flush(self) -> bytes:
+        """
+        Release all held text as extra events
+        """
+        return b"".join(self._content_event(index, self._release(index, flush=True)) for index in list(self.maskers))
+
+    def close(self) -> bytes:
+        """
+        End of the upstream stream: held text, then any unterminated event as received
+        """
+        out = self.flush()
+        if self._pending:
+            out += self._pending
+            self._pending = b""
+        return out
+
+    def _event(self, raw: bytes) -> bytes:
+        lines = _LINE_RE.split(raw)
+        data = [line[6:] if line[5:6] == b" " else line[5:] for line in lines if line.startswith(b"data:")]
+        if not data:
+            return raw + b"\n\n"
+        payload = b"\n".join(data)
+        if payload.strip() == b"[DONE]":
+            return self.flush() + raw + b"\n\n"
+        try:
+            event = json_codec.loads(payload)
+        except ValueError:
+            return raw + b"\n\n"
+        choices = event.get("choices") if isinstance(event, dict) else None
+        if not isinstance(choices, list):
+            return raw + b"\n\n"
+
+        rewritten = False
+        held_only = True
+        for choice in choices:
+            delta = choice.get("delta") if isinstance(choice, dict) else None
+            if not isinstance(delta, dict):
+                held_only = False
+                continue
+            index = choice.get("index", 0)
+            finished = bool(choice.get("finish_reason"))
+            content = delta.get("content")
+            if isinstance(content, str):
+                delta["content"] = self._release(index, content, flush=finished)
+                rewritten = True
+            elif finished and index in self.maskers:
+                delta["content"] = self._release(index, flush=True)
+                rewritten = True
+            if delta.get("content") or finished or set(delta) - {"content"}:
+                held_only = False
+        if not rewritten:
+            return raw + b"\n\n"
+        self._template = {key: value for key, value in event.items() if key not in ("choices", "usage")}
+        if held_only and not event.get("usage"):
+            # Everything in this event is still held back
+            return b""
+        others = [line for line in lines if line and not line.startswith(b"data:")]
+        return b"\n".join(others + [b"data: " + json_codec.dumps(event)]) + b"\n\n"
+
+    def _release(self, index: int, content: str = "", flush: bool = False, drain: bool = False) -> str:
+        masker = self.maskers.get(index)
+        if masker is None:
+            masker = self.maskers[index] = StreamMasker(
+                holdback=self.owner.holdback, align_lines=False,
+                security_level=self.owner.security_level, categories=self.owner.categories
+            )
+            self._fed[index] = 0
+            self._arrivals[index] = deque()
+        now = time.monotonic()
+        if content:
+            self._drained = False
+            if self._first_content is None:
+                self._first_content = now
+            self._fed[index] += len(content)
+            self._arrivals[index].append((self._fed[index], now))
+        out = masker.feed(content) if content else ""
+        if flush:
+            out += masker.flush()
+        elif drain:
+            out += masker.drain()
+
+        released = self._fed[index] - masker.pending()
+        arrivals = self._arrivals[index]
+        while arrivals and arrivals[0][0] <= released:
+            arrivals.popleft()
+        if out and self.delay is None and self._first_content is not None:
+            self.delay = now - self._first_content
+        return out
+
+    def _content_event(self, index: int, content: str) -> bytes:
+        if not content:
+            return b""
+        event = dict(self._template, choices=[{"index": index, "delta": {"content": content}, "finish_reason": None}])
+        return b"data: " + json_codec.dumps(event) + b"\n\n"
+
+
+RESPONSE_MASKING = ResponseMasking(
+    RESPONSE_MASKING_ENABLED, RESPONSE_MASK_CATEGORIES, RESPONSE_MASK_HOLDBACK, RESPONSE_MASK_MAX_HOLD_MS / 1000.0
+)
@@ -0,0 +1,135 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBroadcast:
+    """
+    Fan a single upstream byte stream out to any number of subscribers.
+
+    Chunks are buffered for the lifetime of the flight so late subscribers
+    replay the stream from the start and see the same bytes as the first one.
+    """
+
+    def __init__(self, source_factory: Callable[[Dict[str, Any]], AsyncIterator[bytes]]):
+        self.chunks: List[bytes] = []
+        # Filled in by the source (e.g. which upstream served the stream)
+        self.metadata: Dict[str, Any] = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Condition()
+        self._task = asyncio.ensure_future(self._pump(source_factory(self.metadata)))
+
+    async def _pump(self, source: AsyncIterator[bytes]):
+        try:
+            async for chunk in source:
+                async with self._changed:
+                    self.chunks.append(chunk)
+                    self._changed.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        """
+        Yield every chunk of the stream, starting from the first one
+        """
+        self.subscribers += 1
+        index = 0
+        while True:
+            async with self._changed:
+                while index >= len(self.chunks) and not self.done:
+                    await self._changed.wait()
+                pending = self.chunks[index:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                break
+
+        if self.error is not None:
+            raise self.error
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical upstream calls into one in-flight call.
+
+    The upstream call runs in its own task, so a caller that disconnects
+    does not cancel the call for the callers still waiting on it.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run fn once per key; returns (result, shared) where shared is True for followers
+        """
+        if not self.enabled:
+            return await fn(), False
+
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(self._calls, key, t))
+
+        return await asyncio.shield(task), shared
+
+    def stream(self, key: str, source_factory: Callable[[Dict[str, Any]], AsyncIterator[bytes]]
+               ) -> Tuple[AsyncIterator[bytes], bool, Dict[str, Any]]:
+        """
+        Subscribe to the in-flight stream for key, starting it if needed.
+
+        source_factory receives a metadata dict shared with every subscriber.
+        """
+        if not self.enabled:
+            metadata = {}
+            return source_factory(metadata), False, metadata
+
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None
+        if shared:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            broadcast = StreamBroadcast(source_factory)
+            self._streams[key] = broadcast
+            broadcast._task.add_done_callback(lambda t: self._forget(self._streams, key, broadcast))
+
+        return broadcast.subscribe(), shared, broadcast.metadata
+
+    @staticmethod
+    def _forget(registry: Dict[str, Any], key: str, entry: Any):
+        if registry.get(key) is entry:
+            del registry[key]
+        if isinstance(entry, asyncio.Future) and not entry.cancelled():
+            # Mark the exception as retrieved when every waiter has gone away
+            entry.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get coalescing statistics
+        """
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.followers
+        }
@@ -0,0 +1,251 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from config import PROMPT_CAPTURE_ENABLED, PROMPT_CAPTURE_SIZE, PROMPT_CAPTURE_MAX_CHARS
+from services.tracing import current_request_id
+
+# Attributes every LogRecord has; anything else came in through `extra`
+# (uvicorn's color_message just repeats the message with terminal colours)
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "color_message"}
+
+
+def _cap(value: Any, limit: int) -> Any:
+    """
+    Truncate long strings (and strings inside dicts/lists) to limit characters
+    """
+    if isinstance(value, str):
+        if len(value) > limit:
+            return f"{value[:limit]}...(+{len(value) - limit} chars)"
+        return value
+    if isinstance(value, dict):
+        return {key: _cap(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_cap(item, limit) for item in value[:50]]
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a share of records per event type; warnings and errors always pass
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", ""), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamp records with the ID of the request they were logged for, if any
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = current_request_id.get()
+        if request_id is not None:
+            record.request_id = request_id
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks or formats on the request path.
+
+    Records are handed to the listener as-is (formatting happens on the
+    listener thread) and dropped, with a counter, when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks hold frames; render them now so the record is self-contained
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Renders records as one JSON object per line, or as "message key=value" text
+    """
+
+    def __init__(self, fmt: str = "text", max_field_chars: int = 512):
+        super().__init__()
+        self.fmt = fmt
+        self.max_field_chars = max_field_chars
+
+    def _fields(self, record: logging.LogRecord) -> Dict[str, Any]:
+        fields = {}
+        for key, value in vars(record).items():
+            if key in _RESERVED:
+                continue
+            if key == "fields" and isinstance(value, dict):
+                fields.update(value)
+            else:
+                fields[key] = value
+        return _cap(fields, self.max_field_chars)
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = _cap(record.getMessage(), self.max_field_chars)
+        fields = self._fields(record)
+
+        if self.fmt == "json":
+            payload = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": message,
+            }
+            payload.update(fields)
+            if record.exc_text:
+                payload["exc"] = record.exc_text
+            return json.dumps(payload, default=str)
+
+        parts = [f"{record.levelname}:{record.name}:{message}"]
+        parts.extend(f"{key}={value}" for key, value in fields.items())
+        line = " ".join(parts)
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+class PromptRingBuffer:
+    """
+    Bounded in-memory capture of masked prompts for on-demand debugging
+    """
+
+    def __init__(self, enabled: bool = False, size: int = 50, max_chars: int = 65536):
+        self.enabled = enabled
+        self.max_chars = max_chars
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.captured = 0
+        self._lock = threading.Lock()
+
+    def capture(self, prompt: str, **context: Any):
+        if not self.enabled:
+            return
+        entry = {
+            "timestamp": time.time(),
+            "length": len(prompt),
+            "prompt": prompt[:self.max_chars],
+            "truncated": len(prompt) > self.max_chars,
+        }
+        entry.update(context)
+        with self._lock:
+            self.entries.append(entry)
+            self.captured += 1
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.entries)[-limit:][::-1]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+PROMPT_CAPTURE = PromptRingBuffer(PROMPT_CAPTURE_ENABLED, PROMPT_CAPTURE_SIZE, PROMPT_CAPTURE_MAX_CHARS)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+
+def setup_logging(fmt: str = "text", level: str = "INFO", queue_size: int = 10000,
+                  sample_rates: Optional[Dict[str, float]] = None, max_field_chars: int = 512):
+    """
+    Route the root logger through a bounded queue to a background listener thread
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _queue_handler
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(SamplingFilter(sample_rates or {}))
+    # The request context is gone by the time the listener thread formats a record, so stamp it before queueing
+    _queue_handler.addFilter(RequestIdFilter())
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(StructuredFormatter(fmt, max_field_chars))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _queue_handler
+
+
+def stop_logging():
+    """
+    Write out queued records and stop the listener thread
+    """
+    global _listener
+    if _listener is not None:
+        atexit.unregister(_listener.stop)
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_after_fork():
+    """
+    The listener thread does not survive fork(), so a forked server worker gets its own queue and listener
+    """
+    global _listener
+    if _listener is None:
+        return
+    atexit.unregister(_listener.stop)
+    log_queue: queue.Queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """
+    Get queue logging statistics
+    """
+    if _queue_handler is None:
+        return {"queued": False}
+    return {
+        "queued": True,
+        "pending": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "prompt_capture": {
+            "enabled": PROMPT_CAPTURE.enabled,
+            "retained": len(PROMPT_CAPTURE.entries),
+            "captured": PROMPT_CAPTURE.captured
+        }
+    }
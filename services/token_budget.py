@@ -0,0 +1,291 @@
+import math
+import re
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from config import TOKEN_BUDGET_ENABLED, TOKEN_BUDGET_DEFAULT, TOKEN_BUDGETS
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+# Rough per-message cost of role markers and separators in chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Context windows of the models the proxy routes to, by upstream name. A
+# model's budget defaults to its window less RESPONSE_RESERVE_TOKENS, so only
+# prompts the model could not have taken anyway are compacted.
+MODEL_CONTEXT_WINDOWS = {
+    "anthropic/claude-3-haiku": 200000,
+    "claude-3-haiku-20240307": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "openai/gpt-4": 8192,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "meta-llama/llama-3.1-8b-instruct": 131072
+}
+
+# Room left in the window for the completion (chat calls default to max_tokens=1000)
+RESPONSE_RESERVE_TOKENS = 1024
+
+
+def estimate_tokens(text: Any) -> int:
+    """
+    Cheap local token estimate.
+
+    BPE tokenizers average about four characters per token on English text
+    and code, but never fewer tokens than words and punctuation marks, so
+    take the larger of the two counts. Good enough for budgeting; not exact.
+    """
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    return max(len(_WORD_RE.findall(text)), math.ceil(len(text) / 4))
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(message.get("content")) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Keep the start and end of text within roughly max_tokens, marking what was cut
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Scale by this text's own characters-per-token and leave room for the marker
+    keep_chars = max(0, int(len(text) * (max_tokens - 12) / tokens))
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    removed = len(text) - head - tail
+    return f"{text[:head]}\n...[{removed} characters truncated]...\n{text[len(text) - tail:] if tail else ''}"
+
+
+class StreamTruncator:
+    """
+    Streaming form of truncate_to_tokens for text too large to hold.
+
+    Text passes straight through until two thirds of max_tokens are used;
+    after that only the latest pieces making up the last third are kept, and
+    finish() returns them behind the same truncation marker. Memory stays
+    around max_tokens worth of text however long the stream is.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        keep = max(0, max_tokens - 12)
+        self.head_tokens = keep * 2 // 3
+        self.tail_tokens = keep - self.head_tokens
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.removed_chars = 0
+        self._head_used = 0
+        self._tail = deque()
+        self._tail_used = 0
+
+    def feed(self, text: str) -> str:
+        """
+        Add text; returns the part of it that belongs to the head
+        """
+        tokens = estimate_tokens(text)
+        self.tokens_in += tokens
+        head = ""
+        if self._head_used < self.head_tokens:
+            room = self.head_tokens - self._head_used
+            if tokens <= room:
+                self._head_used += tokens
+                self.tokens_out += tokens
+                return text
+            split = int(len(text) * room / tokens)
+            head, text = text[:split], text[split:]
+            self._head_used = self.head_tokens
+            self.tokens_out += room
+            tokens = estimate_tokens(text)
+
+        self._tail.append((text, tokens))
+        self._tail_used += tokens
+        # Drop whole pieces while the rest still fills the tail
+        while len(self._tail) > 1 and self._tail_used - self._tail[0][1] >= self.tail_tokens:
+            piece, piece_tokens = self._tail.popleft()
+            self._tail_used -= piece_tokens
+            self.removed_chars += len(piece)
+        return head
+
+    def finish(self) -> str:
+        """
+        The kept tail, behind a truncation marker if anything was cut
+        """
+        pieces = [piece for piece, _ in self._tail]
+        self._tail.clear()
+        if pieces and self._tail_used > self.tail_tokens:
+            first = pieces[0]
+            excess = int(len(first) * (self._tail_used - self.tail_tokens) / max(1, estimate_tokens(first)))
+            pieces[0] = first[min(len(first), excess):]
+            self.removed_chars += len(first) - len(pieces[0])
+        tail = "".join(pieces)
+        if self.removed_chars:
+            tail = f"\n...[{self.removed_chars} characters truncated]...\n{tail}"
+        self.tokens_out += estimate_tokens(tail)
+        return tail
+
+    @property
+    def truncated(self) -> bool:
+        return self.removed_chars > 0
+
+
+def _same_message(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    return a.get("role") == b.get("role") and a.get("content") == b.get("content")
+
+
+class TokenBudget:
+    """
+    Per-model prompt token budgets and the compaction that enforces them.
+
+    Compaction runs on already-masked messages that are over budget, in
+    order of increasing damage: a message repeated back to back is kept
+    once, then the oldest non-system turns are dropped a user turn and its
+    replies at a time (so the history never opens with a reply), and finally
+    the longest remaining message is truncated in the middle. Prompts within
+    budget are left as they are. System messages and the latest message are
+    never dropped. Every token report says whether anything was removed
+    ("compacted"), so callers can tell the client.
+
+    A model's budget is its configured override, else its context window
+    less a reserve for the response, else default_budget.
+    """
+
+    def __init__(self, enabled: bool = False, default_budget: int = 16000,
+                 model_budgets: Optional[Dict[str, int]] = None):
+        self.enabled = enabled
+        self.default_budget = default_budget
+        self.model_budgets = model_budgets or {}
+
+        self.requests = 0
+        self.compacted = 0
+        self.tokens_saved = 0
+
+    def budget_for(self, model: Optional[str]) -> int:
+        # Allow budgets keyed by the bare model name, e.g. "gpt-4" for "openai/gpt-4"
+        names = [model, model.split("/", 1)[1]] if model and "/" in model else [model]
+        for name in names:
+            if name in self.model_budgets:
+                return self.model_budgets[name]
+        for name in names:
+            if name in MODEL_CONTEXT_WINDOWS:
+                return MODEL_CONTEXT_WINDOWS[name] - RESPONSE_RESERVE_TOKENS
+        return self.default_budget
+
+    def compact_messages(self, messages: List[Dict[str, Any]],
+                         model: Optional[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Fit messages into the model's budget; returns (messages, token report)
+        """
+        before = estimate_message_tokens(messages)
+        budget = self.budget_for(model)
+        report = {"before": before, "after": before, "budget": budget, "compacted": False,
+                  "deduplicated": 0, "dropped_messages": 0, "truncated": False}
+        if not self.enabled:
+            return messages, report
+
+        self.requests += 1
+        if before <= budget:
+            return messages, report
+        compacted = self._dedupe(messages)
+        report["deduplicated"] = len(messages) - len(compacted)
+
+        total = estimate_message_tokens(compacted)
+        while total > budget:
+            index = next(
+                (i for i, message in enumerate(compacted[:-1]) if message.get("role") != "system"), None
+            )
+            if index is None:
+                break
+            # The oldest turn goes with the replies that follow it
+            while True:
+                dropped = compacted.pop(index)
+                total -= estimate_tokens(dropped.get("content")) + MESSAGE_OVERHEAD_TOKENS
+                report["dropped_messages"] += 1
+                if index >= len(compacted) - 1 or compacted[index].get("role") in ("system", "user"):
+                    break
+
+        if total > budget and compacted:
+            longest = max(range(len(compacted)), key=lambda i: estimate_tokens(compacted[i].get("content")))
+            content = compacted[longest].get("content")
+            if isinstance(content, str):
+                allowed = max(1, estimate_tokens(content) - (total - budget))
+                compacted[longest] = dict(compacted[longest], content=truncate_to_tokens(content, allowed))
+                report["truncated"] = True
+
+        after = estimate_message_tokens(compacted)
+        report["after"] = after
+        report["compacted"] = bool(report["deduplicated"] or report["dropped_messages"] or report["truncated"])
+        if after < before:
+            self.compacted += 1
+            self.tokens_saved += before - after
+        return compacted, report
+
+    def compact_prompt(self, text: str, model: Optional[str], reserved: int = 0) -> Tuple[str, Dict[str, Any]]:
+        """
+        Truncate a single prompt to the model's budget minus reserved tokens (e.g. the preamble)
+        """
+        before = estimate_tokens(text)
+        budget = self.budget_for(model)
+        report = {"before": before, "after": before, "budget": budget, "compacted": False, "truncated": False}
+        if not self.enabled:
+            return text, report
+
+        self.requests += 1
+        allowed = max(1, budget - reserved)
+        if before > allowed:
+            text = truncate_to_tokens(text, allowed)
+            report["compacted"] = report["truncated"] = True
+            report["after"] = estimate_tokens(text)
+            self.compacted += 1
+            self.tokens_saved += before - report["after"]
+        return text, report
+
+    def stream_truncator(self, model: Optional[str], reserved: int = 0) -> Optional[StreamTruncator]:
+        """
+        Budget for a single prompt that is streamed instead of held in memory; None when disabled
+        """
+        if not self.enabled:
+            return None
+        self.requests += 1
+        return StreamTruncator(max(1, self.budget_for(model) - reserved))
+
+    def finish_stream(self, truncator: StreamTruncator) -> Dict[str, Any]:
+        """
+        Token report for a finished stream_truncator, like compact_prompt's
+        """
+        report = {"before": truncator.tokens_in, "after": truncator.tokens_out,
+                  "budget": truncator.max_tokens, "compacted": truncator.truncated, "truncated": truncator.truncated}
+        if truncator.truncated:
+            self.compacted += 1
+            self.tokens_saved += max(0, truncator.tokens_in - truncator.tokens_out)
+        return report
+
+    @staticmethod
+    def _dedupe(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Drop messages that repeat the one before them exactly (same role and content)
+        """
+        kept = []
+        for message in messages:
+            if kept and _same_message(kept[-1], message):
+                continue
+            kept.append(message)
+        return kept
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get compaction statistics
+        """
+        return {
+            "enabled": self.enabled,
+            "default_budget": self.default_budget,
+            "requests": self.requests,
+            "compacted": self.compacted,
+            "tokens_saved": self.tokens_saved
+        }
+
+
+TOKEN_BUDGET = TokenBudget(TOKEN_BUDGET_ENABLED, TOKEN_BUDGET_DEFAULT, TOKEN_BUDGETS)
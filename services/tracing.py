@@ -0,0 +1,348 @@
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+from config import (
+    TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_EXPORT, TRACE_FILE_PATH, TRACE_FILE_MAX_BYTES, TRACE_RING_SIZE
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ID of the request being served, set by SecurityMiddleware for every request
+# (sampled or not) so logs and masking events written deeper in the stack carry it.
+current_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_request_id", default=None)
+
+# Innermost open span of a sampled request; None means spans are no-ops
+current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class IdGenerator:
+    """
+    Request (trace) and span IDs: a random per-process prefix plus a counter.
+
+    IDs cannot repeat within a process, and processes (including forked
+    server workers, which draw a new prefix) collide only if two random
+    64-bit prefixes do. Making one is a counter step and a format call, with
+    no hashing or entropy read per request.
+    """
+
+    def __init__(self):
+        self._reseed()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reseed)
+
+    def _reseed(self):
+        self._prefix = f"{random.SystemRandom().getrandbits(64):016x}"
+        self._counter = itertools.count(1)
+
+    def trace_id(self) -> str:
+        """32 hex characters"""
+        return f"{self._prefix}{next(self._counter):016x}"
+
+    def span_id(self) -> str:
+        """16 hex characters, unique within the process"""
+        return f"{next(self._counter):016x}"
+
+
+IDS = IdGenerator()
+
+
+class _Trace:
+    __slots__ = ("trace_id", "started_at", "spans", "finished")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.started_at = time.time()
+        self.spans: List["Span"] = []
+        self.finished = False
+
+
+class Span:
+    """
+    One timed stage of a request. Use span() or start_span() rather than creating these directly.
+    """
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "end", "attributes")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = IDS.span_id()
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end = None
+        self.attributes = attributes
+        # Spans still running when the request ends (e.g. a losing hedge) are left out
+        if not trace.finished:
+            trace.spans.append(self)
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+
+class _SpanScope:
+    """
+    Makes a span the current one for a with block, so spans opened inside it become its children
+    """
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.span.attributes["error"] = exc_type.__name__
+        self.span.finish()
+        current_span.reset(self._token)
+        return False
+
+    # So a span can share an async with statement with an async resource
+    async def __aenter__(self) -> Span:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class _NoopSpan:
+    """
+    Stands in for both a span and its scope when the request is not sampled
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes: Any):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes: Any):
+    """
+    Time a with block as a child of the current span:
+
+        with span("cache.get") as s:
+            ...
+            s.set(hit=True)
+
+    Works with async with too. Costs one context variable read when the
+    request is not being traced. Do not hold one open across a yield in a
+    generator; use start_span there.
+    """
+    parent = current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return _SpanScope(Span(parent.trace, name, parent.span_id, attributes))
+
+
+def start_span(name: str, **attributes: Any):
+    """
+    Start a child of the current span without making it current; call finish() on the result.
+
+    For stages that do not fit a with block, such as a streamed upstream
+    body that is consumed a chunk at a time.
+    """
+    parent = current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+class _TraceScope(_SpanScope):
+    """
+    The root span's scope; exports the trace when the block ends
+    """
+
+    __slots__ = ("_tracer",)
+
+    def __init__(self, tracer: "Tracer", root: Span):
+        super().__init__(root)
+        self._tracer = tracer
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        self._tracer.export(self.span.trace)
+        return False
+
+
+class Tracer:
+    """
+    Opt-in, sampled request tracing with in-process export.
+
+    SecurityMiddleware opens a root span per request; stages below it
+    (security checks, masking, cache lookups, upstream calls, masking log
+    writes) add child spans through span()/start_span(), which find their
+    parent in a context variable and so need no plumbing. Unsampled requests
+    only pay for that variable read.
+
+    Finished traces go to an in-memory ring (served by /debug/traces) and/or
+    are appended as one JSON object per line to a file by a background
+    thread, so exporting never blocks a request.
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 1.0, export: str = "ring",
+                 path: str = "traces.ndjson", max_bytes: int = 100 * 1024 * 1024, ring_size: int = 1000,
+                 queue_size: int = 10000):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        exporters = {name.strip() for name in export.split(",")}
+        self.ring: Optional[deque] = deque(maxlen=ring_size) if "ring" in exporters else None
+        self.path = path if "file" in exporters else ""
+        self.max_bytes = max_bytes
+        self.sampled = 0
+        self.exported = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        if self.enabled and self.path:
+            self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._writer, name="trace-export", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """
+        Each forked server worker appends to its own file, e.g. traces.<pid>.ndjson
+        """
+        directory, name = os.path.split(self.path)
+        stem, dot, extensions = name.partition(".")
+        self.path = os.path.join(directory, f"{stem}.{os.getpid()}{dot}{extensions}")
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        atexit.unregister(self.stop)
+        self._thread = threading.Thread(target=self._writer, name="trace-export", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def trace(self, trace_id: str, name: str, **attributes: Any):
+        """
+        Root span for a request, or a no-op if tracing is off or the request is not sampled
+        """
+        if not self.enabled or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return NOOP_SPAN
+        self.sampled += 1
+        return _TraceScope(self, Span(_Trace(trace_id), name, None, attributes))
+
+    def export(self, trace: _Trace):
+        trace.finished = True
+        root = trace.spans[0]
+        record = {
+            "trace_id": trace.trace_id,
+            "timestamp": trace.started_at,
+            "duration_ms": round((root.end - root.start) * 1000, 3),
+            "spans": [{
+                "name": span.name,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "start_ms": round((span.start - root.start) * 1000, 3),
+                "duration_ms": round((span.end - span.start) * 1000, 3) if span.end is not None else None,
+                "attributes": span.attributes
+            } for span in trace.spans]
+        }
+        if self.ring is not None:
+            self.ring.append(record)
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+        self.exported += 1
+
+    def recent(self, limit: int = 20, min_duration_ms: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Traces from the ring, newest first, optionally only the slow ones
+        """
+        if self.ring is None:
+            return []
+        traces = []
+        for record in reversed(self.ring):
+            if record["duration_ms"] >= min_duration_ms:
+                traces.append(record)
+                if len(traces) >= limit:
+                    break
+        return traces
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        if self.ring is None:
+            return None
+        return next((record for record in reversed(self.ring) if record["trace_id"] == trace_id), None)
+
+    def _writer(self):
+        written = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with open(self.path, "ab") as f:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    record = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    record = False
+                if record is None:
+                    break
+                if record:
+                    line = json.dumps(record, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+                    if written + len(line) > self.max_bytes:
+                        self.dropped += 1
+                    else:
+                        f.write(line)
+                        written += len(line)
+                if time.monotonic() - last_flush >= 1.0:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "ring": len(self.ring) if self.ring is not None else None,
+            "path": self.path or None,
+            "sampled": self.sampled,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize()
+        }
+
+
+TRACER = Tracer(TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_EXPORT, TRACE_FILE_PATH, TRACE_FILE_MAX_BYTES,
+                TRACE_RING_SIZE)
@@ -0,0 +1,152 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from config import (
+    TRAFFIC_CAPTURE_ENABLED, TRAFFIC_CAPTURE_PATH, TRAFFIC_CAPTURE_CONTENT,
+    TRAFFIC_CAPTURE_SAMPLE_RATE, TRAFFIC_CAPTURE_MAX_BYTES
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficRecorder:
+    """
+    Opt-in capture of post-masking request shapes and timings for replay.
+
+    One JSON object per request is appended to a gzip file by a background
+    thread, so capture never blocks a request. In "shape" mode only sizes,
+    roles and parameters are kept; "masked" mode also keeps the masked
+    message text. Raw (unmasked) content is never recorded.
+    """
+
+    def __init__(self, enabled: bool = False, path: str = "traffic_capture.ndjson.gz", content: str = "shape",
+                 sample_rate: float = 1.0, max_bytes: int = 100 * 1024 * 1024, queue_size: int = 10000):
+        self.enabled = enabled
+        self.path = path
+        self.keep_content = content == "masked"
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.recorded = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        if self.enabled:
+            self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._writer, name="traffic-capture", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """
+        The writer thread does not survive fork(), and workers sharing one
+        gzip stream would corrupt it, so each forked server worker writes
+        its own file, e.g. traffic_capture.<pid>.ndjson.gz
+        """
+        directory, name = os.path.split(self.path)
+        stem, dot, extensions = name.partition(".")
+        self.path = os.path.join(directory, f"{stem}.{os.getpid()}{dot}{extensions}")
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        atexit.unregister(self.stop)
+        self._thread = threading.Thread(target=self._writer, name="traffic-capture", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def should_capture(self) -> bool:
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def record(self, entry: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _message_shape(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        content = message.get("content")
+        shape = {"role": message.get("role"), "length": len(content) if isinstance(content, str) else len(str(content))}
+        if self.keep_content:
+            shape["content"] = content
+        return shape
+
+    def chat_shape(self, body: Dict[str, Any], filtered_messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Shape of a /proxy/chat request as it was forwarded
+        """
+        shape = {
+            "model": body.get("model"),
+            "stream": bool(body.get("stream")),
+            "messages": [self._message_shape(message) for message in filtered_messages]
+        }
+        for key in ("target", "max_tokens", "temperature", "priority"):
+            if key in body:
+                shape[key] = body[key]
+        return shape
+
+    def text_shape(self, masked_text: str, **params: Any) -> Dict[str, Any]:
+        """
+        Shape of a single-text request such as /chat
+        """
+        shape = dict(params, length=len(masked_text))
+        if self.keep_content:
+            shape["content"] = masked_text
+        return shape
+
+    def _writer(self):
+        written = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with gzip.open(self.path, "ab") as f:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    entry = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    entry = False
+                if entry is None:
+                    break
+                if entry:
+                    line = json.dumps(entry, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+                    if written + len(line) > self.max_bytes:
+                        self.dropped += 1
+                    else:
+                        f.write(line)
+                        # Uncompressed size; keeps the cap conservative
+                        written += len(line)
+                        self.recorded += 1
+                if time.monotonic() - last_flush >= 1.0:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get capture statistics
+        """
+        return {
+            "enabled": self.enabled,
+            "path": self.path if self.enabled else None,
+            "content": "masked" if self.keep_content else "shape",
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize()
+        }
+
+
+TRAFFIC_RECORDER = TrafficRecorder(
+    TRAFFIC_CAPTURE_ENABLED, TRAFFIC_CAPTURE_PATH, TRAFFIC_CAPTURE_CONTENT,
+    TRAFFIC_CAPTURE_SAMPLE_RATE, TRAFFIC_CAPTURE_MAX_BYTES
+)
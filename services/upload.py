@@ -0,0 +1,202 @@
+import asyncio
+import codecs
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import HTTPException, Request
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from masking.stream_masking import StreamMasker
+from services.token_budget import TOKEN_BUDGET, estimate_tokens
+from config import UPLOAD_MAX_BYTES, STREAM_MASK_SAMPLE_CHARS, COMPACT_PREAMBLE
+
+# Masking works on pieces of about this many characters, however the body arrives
+PIECE_CHARS = 64 * 1024
+
+_PERSONAL_PREAMBLE = " PERSONAL MODE: Content is being processed without security filtering.\n\n"
+
+
+class StreamingUpload:
+    """
+    Text of an uploaded file, decoded as the request body arrives.
+
+    The body is either the raw file or multipart/form-data, in which case the
+    first part with a filename (or named "file") is used. Nothing but the
+    current piece is held in memory. More than max_bytes fails with 413.
+    """
+
+    def __init__(self, request: Request, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.request = request
+        self.max_bytes = max_bytes
+        self.filename: Optional[str] = None
+        self.bytes_received = 0
+        self.started = time.perf_counter()
+
+    async def pieces(self) -> AsyncIterator[str]:
+        """
+        Decoded text in pieces of about PIECE_CHARS characters
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending: List[str] = []
+        pending_chars = 0
+        async for data in self._file_bytes():
+            text = decoder.decode(data)
+            if not text:
+                continue
+            pending.append(text)
+            pending_chars += len(text)
+            if pending_chars >= PIECE_CHARS:
+                yield "".join(pending)
+                pending, pending_chars = [], 0
+        pending.append(decoder.decode(b"", final=True))
+        tail = "".join(pending)
+        if tail:
+            yield tail
+
+    async def _body(self) -> AsyncIterator[bytes]:
+        async for chunk in self.request.stream():
+            self.bytes_received += len(chunk)
+            if self.bytes_received > self.max_bytes:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {self.max_bytes} bytes")
+            if chunk:
+                yield chunk
+
+    async def _file_bytes(self) -> AsyncIterator[bytes]:
+        content_type, params = parse_options_header(self.request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data":
+            async for chunk in self._body():
+                yield chunk
+            return
+
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="Missing multipart boundary")
+
+        output: List[bytes] = []
+        part = {"headers": {}, "field": b"", "value": b""}
+        state = {"file_seen": False, "in_file": False}
+
+        def on_part_begin():
+            part.update(headers={}, field=b"", value=b"")
+
+        def on_header_field(data, start, end):
+            part["field"] += data[start:end]
+
+        def on_header_value(data, start, end):
+            part["value"] += data[start:end]
+
+        def on_header_end():
+            part["headers"][part["field"].lower()] = part["value"]
+            part["field"], part["value"] = b"", b""
+
+        def on_headers_finished():
+            _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+            is_file = not state["file_seen"] and (b"filename" in disposition or disposition.get(b"name") == b"file")
+            state["in_file"] = is_file
+            if is_file:
+                state["file_seen"] = True
+                filename = disposition.get(b"filename")
+                if filename:
+                    self.filename = filename.decode("utf-8", "replace")
+
+        def on_part_data(data, start, end):
+            if state["in_file"]:
+                output.append(data[start:end])
+
+        def on_part_end():
+            state["in_file"] = False
+
+        parser = MultipartParser(boundary, {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end
+        })
+        async for chunk in self._body():
+            try:
+                parser.write(chunk)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+            if output:
+                yield b"".join(output)
+                output.clear()
+        parser.finalize()
+        if not state["file_seen"]:
+            raise HTTPException(status_code=400, detail="No file part in the multipart body")
+
+
+async def masked_prompt(upload: StreamingUpload, file_name: Optional[str], use_secure_filter: bool, model: str,
+                        report: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    The final prompt for an upload, in pieces: the preamble, then the masked
+    file text within the model's token budget.
+
+    Content type and context clues come from the first STREAM_MASK_SAMPLE_CHARS
+    characters; the number of masked elements follows the text. Masking runs
+    in a worker thread. Sizes, masking and token figures are added to report.
+    Without file_name, the uploaded file's own name is used.
+    """
+    pieces = upload.pieces()
+    sample: List[str] = []
+    sample_chars = 0
+    async for text in pieces:
+        sample.append(text)
+        sample_chars += len(text)
+        if sample_chars >= STREAM_MASK_SAMPLE_CHARS:
+            break
+
+    masker = None
+    if use_secure_filter:
+        masker = await asyncio.to_thread(StreamMasker.from_sample, "".join(sample)[:STREAM_MASK_SAMPLE_CHARS])
+        preamble = masker.preamble(COMPACT_PREAMBLE)
+    else:
+        preamble = _PERSONAL_PREAMBLE
+    preamble_tokens = estimate_tokens(preamble)
+    truncator = TOKEN_BUDGET.stream_truncator(model, reserved=preamble_tokens)
+    yield preamble
+
+    async def all_pieces():
+        for text in sample:
+            yield text
+        async for text in pieces:
+            yield text
+
+    original_chars = 0
+    async for text in all_pieces():
+        original_chars += len(text)
+        masked = await asyncio.to_thread(masker.feed, text) if masker is not None else text
+        out = truncator.feed(masked) if truncator is not None and masked else masked
+        if out:
+            yield out
+
+    closing = await asyncio.to_thread(masker.finish) if masker is not None else ""
+    if truncator is not None:
+        out = (truncator.feed(closing) if closing else "") + truncator.finish()
+    else:
+        out = closing
+    if masker is not None:
+        out += masker.summary()
+    if out:
+        yield out
+
+    tokens = TOKEN_BUDGET.finish_stream(truncator) if truncator is not None else {}
+    if tokens:
+        tokens["before"] += preamble_tokens
+        tokens["after"] += preamble_tokens
+        tokens["preamble"] = "compact" if COMPACT_PREAMBLE else "full"
+        tokens["preamble_tokens"] = preamble_tokens
+
+    file_name = file_name or upload.filename or "upload.txt"
+    if masker is not None:
+        await asyncio.to_thread(masker.log_events, file_name.split('.')[-1] if '.' in file_name else "txt")
+    report.update(
+        filename=file_name,
+        bytes_received=upload.bytes_received,
+        original_length=original_chars,
+        masked_length=masker.chars_out if masker is not None else original_chars,
+        masking=masker.get_stats() if masker is not None else None,
+        tokens=tokens,
+        upload_seconds=round(time.perf_counter() - upload.started, 3)
+    )
@@ -5,7 +5,7 @@ A standalone chatbot that demonstrates privacy protection features
 """
 
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import json
 import time
 import hashlib
@@ -18,6 +18,12 @@ import re
 
 ENHANCED_MASKING_AVAILABLE = False
 
+# Files are uploaded through the gateway, which masks them while they stream in
+GATEWAY_URL = os.getenv("GATEWAY_URL", "http://localhost:8000")
+# Sent as X-API-Key; the gateway rejects requests without one
+GATEWAY_API_KEY = os.getenv("GATEWAY_API_KEY", "")
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
 class SimpleChatbotGUI:
     def __init__(self, root):
         self.root = root
@@ -477,7 +483,22 @@ class SimpleChatbotGUI:
             pady=5,
             cursor="hand2"
         )
-        export_button.pack(side=tk.LEFT)
+        export_button.pack(side=tk.LEFT, padx=(0, 5))
+        
+        
+        self.upload_button = tk.Button(
+            left_controls,
+            text="Upload",
+            command=self.upload_file,
+            font=("Segoe UI", 10),
+            bg=self.colors['secondary'],
+            fg='white',
+            relief=tk.FLAT,
+            padx=10,
+            pady=5,
+            cursor="hand2"
+        )
+        self.upload_button.pack(side=tk.LEFT)
         
        
         input_frame = tk.Frame(controls_frame, bg=self.colors['background'])
@@ -532,6 +553,15 @@ class SimpleChatbotGUI:
             bg='#424242'
         )
         status_label.pack(side=tk.LEFT)
+        
+        self.upload_status_label = tk.Label(
+            status_frame,
+            text="",
+            font=("Segoe UI", 9),
+            fg='white',
+            bg='#424242'
+        )
+        self.upload_status_label.pack(side=tk.RIGHT)
     
     def show_signin_dialog(self):
         """Show sign in dialog with 3 hardcoded users"""
@@ -933,12 +963,15 @@ class SimpleChatbotGUI:
             while True:
                 result_type, response = self.response_queue.get_nowait()
                 
+                if result_type == "progress":
+                    self._show_upload_progress(*response)
+                    continue
                 if result_type == "success":
                     self.add_bot_message(response)
                     self._update_last_log_response(response)
                 else:
                     self.add_system_message(f"{response}")
-                     fallback_response = self._get_fallback_response("")
+                    fallback_response = self._get_fallback_response("")
                     self.add_bot_message(fallback_response)
                     self._update_last_log_response(fallback_response)
                 
@@ -950,6 +983,69 @@ class SimpleChatbotGUI:
         
         self.root.after(100, self.check_api_responses)
     
+    def upload_file(self):
+        """Send a file through the gateway's streaming upload for masking and analysis"""
+        if self.is_loading:
+            return
+        path = filedialog.askopenfilename(title="Upload a file for analysis")
+        if not path:
+            return
+        
+        file_name = os.path.basename(path)
+        self.add_user_message(f"Uploaded file: {file_name} ({os.path.getsize(path):,} bytes)")
+        self.show_loading_indicator()
+        self._log_action("file_uploaded", {"size": os.path.getsize(path)})
+        
+        threading.Thread(
+            target=self._upload_file_async,
+            args=(path, file_name),
+            daemon=True
+        ).start()
+    
+    def _upload_file_async(self, path, file_name):
+        """Stream the file to the gateway in a background thread, reporting progress"""
+        total = os.path.getsize(path)
+        
+        def chunks():
+            sent = 0
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    # The gateway masks as it reads, so this is also masking progress
+                    self.response_queue.put(("progress", (sent, total)))
+                    yield chunk
+        
+        try:
+            response = requests.post(
+                f"{GATEWAY_URL}/chat/upload",
+                params={"filename": file_name, "use_secure_filter": str(self.redaction_enabled).lower()},
+                data=chunks(),
+                headers={"Content-Type": "application/octet-stream", "X-API-Key": GATEWAY_API_KEY},
+                timeout=600
+            )
+            response.raise_for_status()
+            result = response.json()
+            if result.get("error"):
+                raise Exception(result["error"])
+            
+            upload = result.get("upload") or {}
+            masked = sum(((upload.get("masking") or {}).get("masked") or {}).values())
+            self.response_queue.put(("progress", (total, total, masked)))
+            self.response_queue.put(("success", result["proxy_response"]["choices"][0]["message"]["content"]))
+        except Exception as e:
+            self.response_queue.put(("error", f"Upload failed: {str(e)}"))
+    
+    def _show_upload_progress(self, sent, total, masked=None):
+        """Show upload progress in the status bar"""
+        if masked is not None:
+            self.upload_status_label.config(text=f"Uploaded {total:,} bytes, {masked} sensitive element(s) masked")
+            return
+        percent = int(sent * 100 / total) if total else 100
+        self.upload_status_label.config(text=f"Uploading and masking: {percent}% ({sent:,} of {total:,} bytes)")
+    
     def _update_last_log_response(self, response):
         """Update the last log entry with the actual response"""
         if self.anonymous_logs:
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from services.admission import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, AdmissionController, AdmissionRejected, UpstreamLimiter, parse_priority
+)
+
+
+def test_full_queue_rejects_with_retry_after():
+    limiter = UpstreamLimiter("openai", max_concurrency=1, max_queue=0, max_wait=2.5)
+
+    async def run():
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.reason == "queue full" and rejected.retry_after == 3
+    assert limiter.in_flight == 1 and limiter.rejected == 1
+
+
+def test_released_slot_goes_to_interactive_before_bulk():
+    limiter = UpstreamLimiter("openai", max_concurrency=1, max_queue=10, max_wait=5)
+    order = []
+
+    async def waiter(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        limiter.release()
+
+    async def run():
+        await limiter.acquire()
+        bulk = asyncio.ensure_future(waiter("bulk", PRIORITY_BULK))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(waiter("interactive", PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(bulk, interactive)
+
+    asyncio.run(run())
+    assert order == ["interactive", "bulk"]
+    assert limiter.in_flight == 0
+
+
+def test_interactive_request_preempts_queued_bulk():
+    limiter = UpstreamLimiter("openai", max_concurrency=1, max_queue=1, max_wait=5)
+
+    async def run():
+        await limiter.acquire()
+        bulk = asyncio.ensure_future(limiter.acquire(PRIORITY_BULK))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(limiter.acquire(PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await bulk
+        limiter.release()
+        await interactive
+
+    asyncio.run(run())
+    assert limiter.preempted == 1 and limiter.in_flight == 1
+
+
+def test_queue_wait_times_out():
+    limiter = UpstreamLimiter("openai", max_concurrency=1, max_queue=1, max_wait=0.01)
+
+    async def run():
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected):
+            await limiter.acquire()
+
+    asyncio.run(run())
+    assert limiter.timed_out == 1 and limiter.queued == 0
+
+
+def test_slot_is_released_when_the_block_fails():
+    admission = AdmissionController(["openai"], max_concurrency=1)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            async with admission.slot("openai"):
+                assert admission.in_flight() == 1
+                raise RuntimeError("upstream failed")
+
+    asyncio.run(run())
+    assert admission.in_flight() == 0
+
+
+def test_parse_priority():
+    assert parse_priority("Bulk") == PRIORITY_BULK
+    assert parse_priority(None) == PRIORITY_INTERACTIVE
+    assert parse_priority("urgent") == PRIORITY_INTERACTIVE
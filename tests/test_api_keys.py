@@ -0,0 +1,67 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from middleware.security import SecurityMiddleware
+from services.api_keys import APIKeyStore
+from services.request_log import RequestLog
+
+
+def test_keys_are_validated_against_their_hash(tmp_path):
+    store = APIKeyStore(str(tmp_path / "keys.db"))
+    key = store.create("ci", {"allowed_paths": ["/proxy/"]}, rate_limit_per_minute=10)
+    key_id = store.list()[0]["id"]
+
+    record = store.validate(key)
+    assert record == {"id": key_id, "name": "ci", "permissions": {"allowed_paths": ["/proxy/"]},
+                      "rate_limit_per_minute": 10}
+    assert store.validate(key + "x") is None
+    assert store.validate("not-a-key") is None
+    assert store.validate(key) is record
+    assert store.get_stats()["cache_hits"] == 1
+
+    assert store.revoke(key_id)
+    assert store.validate(key) is None
+
+
+def test_changes_from_another_process_are_picked_up(tmp_path):
+    path = str(tmp_path / "keys.db")
+    store = APIKeyStore(path, reload_interval=0)
+    key = store.create("ci")
+    assert store.validate(key) is not None
+
+    APIKeyStore(path).revoke(store.list()[0]["id"])
+    assert store.validate(key) is None
+    assert store.get_stats()["reloads"] == 1
+
+
+def test_allowed_paths_are_prefixes():
+    record = {"permissions": {"allowed_paths": ["/proxy/"]}}
+    assert APIKeyStore.allows(record, "/proxy/chat")
+    assert not APIKeyStore.allows(record, "/chat")
+    assert APIKeyStore.allows({"permissions": {}}, "/chat")
+
+
+def test_middleware_enforces_stored_keys(tmp_path):
+    store = APIKeyStore(str(tmp_path / "keys.db"))
+    limited = store.create("limited", {"allowed_paths": ["/proxy/"]}, rate_limit_per_minute=2)
+    app = FastAPI()
+
+    @app.get("/proxy/status")
+    async def status():
+        return {}
+
+    @app.post("/chat")
+    async def chat():
+        return {}
+
+    app.add_middleware(SecurityMiddleware, key_store=store, request_log=RequestLog(capacity=100))
+    client = TestClient(app)
+    headers = {"X-API-Key": limited}
+
+    assert client.post("/chat", headers={"X-API-Key": "made-up"}).status_code == 401
+    assert client.post("/chat", headers=headers).status_code == 403
+    for _ in range(2):
+        assert client.get("/proxy/status", headers=headers).status_code == 200
+    response = client.get("/proxy/status", headers=headers)
+    assert response.status_code == 429
+    assert response.json() == {"error": "API key rate limit exceeded"}
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import httpx
+from starlette.requests import Request
+
+from services.proxy_service import ProxyService
+
+
+def completion(text: str) -> bytes:
+    return json.dumps({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]
+    }).encode()
+
+
+def batch_request(headers=None) -> Request:
+    return Request({
+        "type": "http", "method": "POST", "path": "/proxy/chat/batch", "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    })
+
+
+def run_batch(service: ProxyService, items, **kwargs):
+    async def run():
+        response = await service.forward_chat_batch(batch_request(), items, **kwargs)
+        return b"".join([chunk async for chunk in response.body_iterator]), response.headers
+
+    body, headers = asyncio.run(run())
+    return {line["index"]: line for line in map(json.loads, body.splitlines())}, headers
+
+
+def test_items_are_masked_and_sent_concurrently_with_per_item_errors():
+    service = ProxyService()
+    prompts = []
+
+    async def upstream(provider, request_body):
+        prompt = request_body["messages"][-1]["content"]
+        prompts.append(prompt)
+        await asyncio.sleep(0.01)
+        request = httpx.Request("POST", "http://upstream/chat/completions")
+        return httpx.Response(200, content=completion(f"Reply to {prompt}"), request=request)
+
+    service._post_upstream = upstream
+    lines, headers = run_batch(service, [
+        {"messages": [{"role": "user", "content": "mail jane.doe@example.com"}]},
+        {"messages": []},
+        {"messages": [{"role": "user", "content": "second"}], "target": "nowhere"}
+    ], target_service="openai")
+
+    assert headers["x-batch-size"] == "3"
+    assert lines[0]["status"] == 200
+    assert lines[0]["response"]["choices"][0]["message"]["content"].startswith("Reply to")
+    assert "jane.doe@example.com" not in prompts[0]
+    assert (lines[1]["status"], lines[1]["error"]) == (400, "No messages provided")
+    assert lines[2]["status"] == 400
+    assert len(prompts) == 1
+
+
+def test_parallelism_caps_concurrent_upstream_calls():
+    service = ProxyService()
+    running = [0, 0]
+
+    async def upstream(provider, request_body):
+        running[0] += 1
+        running[1] = max(running[1], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        request = httpx.Request("POST", "http://upstream/chat/completions")
+        return httpx.Response(200, content=completion("ok"), request=request)
+
+    service._post_upstream = upstream
+    items = [{"messages": [{"role": "user", "content": f"question {index}"}]} for index in range(6)]
+    lines, _ = run_batch(service, items, target_service="openai", parallelism=2)
+
+    assert [lines[index]["status"] for index in range(6)] == [200] * 6
+    assert running[1] == 2
+
+
+def test_batch_masks_responses_when_asked():
+    service = ProxyService()
+
+    async def upstream(provider, request_body):
+        prompt = request_body["messages"][-1]["content"]
+        request = httpx.Request("POST", "http://upstream/chat/completions")
+        return httpx.Response(200, content=completion(f"Reply to {prompt}: write to jane.doe@example.com"),
+                              request=request)
+
+    service._post_upstream = upstream
+    lines, _ = run_batch(service, [
+        {"messages": [{"role": "user", "content": "first"}], "mask_response": True},
+        {"messages": [{"role": "user", "content": "second"}], "mask_response": False}
+    ], target_service="openai")
+
+    assert [lines[index]["status"] for index in (0, 1)] == [200, 200]
+    masked = lines[0]["response"]["choices"][0]["message"]["content"]
+    unmasked = lines[1]["response"]["choices"][0]["message"]["content"]
+    assert "jane.doe@example.com" not in masked and "<EMAIL>" in masked
+    assert "jane.doe@example.com" in unmasked
@@ -0,0 +1,134 @@
+import gzip
+import zlib
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from middleware.compression import CompressionMiddleware
+from services.compression import BodyTooLarge, Decoder, Encoder, accepts, negotiate
+from services.proxy_service import ProxyService
+
+
+def make_client(**options) -> TestClient:
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        body = await request.body()
+        return {"length": len(body), "text": body.decode()}
+
+    @app.get("/big")
+    async def big():
+        return {"text": "x" * 5000}
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def events():
+            for i in range(3):
+                yield f"data: {i}\n\n".encode()
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app.add_middleware(CompressionMiddleware, **options)
+    return TestClient(app)
+
+
+def test_negotiate_honours_quality_values():
+    assert negotiate("") is None
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("gzip;q=0.5, deflate") == "deflate"
+    assert negotiate("gzip;q=0, identity") is None
+    assert negotiate("*") in ("br", "gzip")
+
+
+def test_decoder_stops_at_the_size_limit():
+    bomb = gzip.compress(b"\0" * 1_000_000)
+    decoder = Decoder("gzip", max_size=10_000)
+    with pytest.raises(BodyTooLarge):
+        decoder.decompress(bomb)
+
+
+def test_decoder_rejects_truncated_data():
+    data = gzip.compress(b"hello world" * 100)
+    decoder = Decoder("gzip", max_size=100_000)
+    decoder.decompress(data[:-10])
+    with pytest.raises(ValueError):
+        decoder.finish()
+
+
+def test_decoder_accepts_raw_and_wrapped_deflate():
+    for data in (zlib.compress(b"payload"), zlib.compress(b"payload")[2:-4]):
+        decoder = Decoder("deflate", max_size=100)
+        assert decoder.decompress(data) + decoder.finish() == b"payload"
+
+
+def test_flushed_chunks_decode_before_the_stream_ends():
+    encoder = Encoder("gzip")
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decoder.decompress(encoder.compress(b"first event", flush=True)) == b"first event"
+    assert decoder.decompress(encoder.finish(b" and the rest")) == b" and the rest"
+
+
+def test_compressed_request_bodies_are_decoded():
+    client = make_client()
+    body = gzip.compress(b"hello " * 1000)
+    response = client.post("/echo", content=body, headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.json()["length"] == 6000
+
+
+def test_bad_request_bodies_are_rejected():
+    client = make_client(max_request_size=1000)
+    headers = {"Content-Encoding": "gzip"}
+    assert client.post("/echo", content=gzip.compress(b"x" * 5000), headers=headers).status_code == 413
+    assert client.post("/echo", content=b"not gzip", headers=headers).status_code == 400
+    assert client.post("/echo", content=b"x", headers={"Content-Encoding": "zstd"}).status_code == 415
+
+
+def test_large_responses_are_compressed_and_small_ones_are_not():
+    client = make_client(min_size=500)
+    big = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert big.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in big.headers["vary"]
+    assert big.json()["text"] == "x" * 5000
+
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in client.get("/big", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_streaming_responses_are_compressed_per_chunk():
+    response = make_client().get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "data: 0\n\ndata: 1\n\ndata: 2\n\n"
+
+
+def test_accepts_checks_one_encoding():
+    assert accepts("gzip, br", "gzip")
+    assert accepts("*", "deflate")
+    assert not accepts("gzip;q=0", "gzip")
+    assert not accepts(None, "gzip")
+
+
+def test_relayed_upstream_body_keeps_its_encoding_and_cookies():
+    body = gzip.compress(b'{"ok": true}')
+    upstream = httpx.Response(200, content=body, headers=[
+        ("Content-Type", "application/json"), ("Content-Encoding", "gzip"), ("Content-Length", "999"),
+        ("Connection", "keep-alive"), ("Set-Cookie", "a=1"), ("Set-Cookie", "b=2")
+    ])
+    relayed = ProxyService._relay_response(upstream, body, keep_encoding=True)
+    headers = relayed.headers
+    assert headers["content-encoding"] == "gzip"
+    assert headers["content-length"] == str(len(body))
+    assert "connection" not in headers
+    assert headers.getlist("set-cookie") == ["a=1", "b=2"]
+
+    decoded = ProxyService._relay_response(upstream, b'{"ok": true}', keep_encoding=False)
+    assert "content-encoding" not in decoded.headers
+    assert decoded.body == b'{"ok": true}'
@@ -0,0 +1,63 @@
+import asyncio
+
+from services.hedging import HedgePolicy, LatencyTracker
+
+
+def warmed_policy(**kwargs) -> HedgePolicy:
+    policy = HedgePolicy(enabled=True, min_samples=5, min_delay=0.01, **kwargs)
+    for _ in range(5):
+        policy.record_latency("key", 0.01)
+    return policy
+
+
+def test_percentile():
+    tracker = LatencyTracker()
+    for latency in range(1, 101):
+        tracker.record(latency / 1000)
+    assert tracker.percentile(50) == 0.051
+    assert tracker.percentile(95) == 0.095
+
+
+def test_no_hedge_before_enough_samples():
+    policy = HedgePolicy(enabled=True, min_samples=20)
+    policy.record_latency("key", 0.01)
+    assert policy.hedge_delay("key") is None
+
+
+def test_slow_primary_is_hedged_and_the_faster_attempt_wins():
+    policy = warmed_policy(max_ratio=1.0)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "primary"
+
+    async def fast():
+        return "hedge"
+
+    assert asyncio.run(policy.run("key", slow, fast)) == "hedge"
+    assert policy.hedges == 1 and policy.hedge_wins == 1
+    assert cancelled == [True]
+
+
+def test_hedges_stay_within_the_load_budget():
+    policy = warmed_policy(max_ratio=0.5, burst=1.0)
+
+    async def slow():
+        await asyncio.sleep(0.03)
+        return "primary"
+
+    async def fast():
+        return "hedge"
+
+    async def run():
+        return [await policy.run("key", slow, fast) for _ in range(4)]
+
+    results = asyncio.run(run())
+    # Half a token per request: every second request may hedge
+    assert results == ["primary", "hedge", "primary", "hedge"]
+    assert policy.budget_denied == 2
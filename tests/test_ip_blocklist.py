@@ -0,0 +1,38 @@
+import pytest
+
+from services.ip_blocklist import IPPrefixTree
+
+
+def test_ranges_match_the_addresses_they_contain():
+    tree = IPPrefixTree()
+    tree.add("10.0.0.0/8", reason="internal")
+    tree.add("2001:db8::/32", reason="docs")
+    assert tree.match("10.20.30.40") == ("10.0.0.0/8", "internal")
+    assert tree.match("11.0.0.1") is None
+    assert "2001:db8::1" in tree
+    assert "2001:db9::1" not in tree
+    assert tree.match("not-an-ip") is None
+    with pytest.raises(ValueError):
+        tree.add("10.0.0.0/33")
+
+
+def test_entries_expire():
+    tree = IPPrefixTree()
+    tree.add("192.0.2.7", ttl=10, reason="suspicious activity", now=1000.0)
+    assert tree.match("192.0.2.7", now=1005.0) == ("192.0.2.7/32", "suspicious activity")
+    assert tree.match("192.0.2.7", now=1011.0) is None
+    assert len(tree) == 0
+
+
+def test_bulk_load_skips_comments_and_junk():
+    tree = IPPrefixTree()
+    count = tree.load(["# feed", "198.51.100.0/24", "", "garbage", "203.0.113.5  # one host", "198.51.100.128/25"])
+    assert count == 3
+    assert len(tree) == 3
+    assert tree.match("198.51.100.200")[0] in ("198.51.100.0/24", "198.51.100.128/25")
+    assert tree.match("203.0.113.5") is not None
+    assert [entry["network"] for entry in tree.entries()] == sorted(
+        ["198.51.100.0/24", "198.51.100.128/25", "203.0.113.5/32"]
+    )
+    assert tree.remove("203.0.113.5/32")
+    assert tree.match("203.0.113.5") is None
@@ -0,0 +1,29 @@
+from services.ip_rates import IPRateTracker
+
+
+def test_requests_expire_after_the_window():
+    tracker = IPRateTracker(window=60)
+    for second in range(30):
+        tracker.hit("10.0.0.1", now=1000 + second)
+    assert tracker.count("10.0.0.1", now=1029) == 30
+    assert tracker.count("10.0.0.1", now=1069) == 20
+    assert tracker.count("10.0.0.1", now=1200) == 0
+
+
+def test_counts_are_per_ip():
+    tracker = IPRateTracker(window=60)
+    for _ in range(150):
+        tracker.hit("10.0.0.1", now=1000)
+    assert tracker.hit("10.0.0.2", now=1000) == 1
+    assert tracker.top(now=1000) == [("10.0.0.1", 150), ("10.0.0.2", 1)]
+
+
+def test_least_recently_seen_ip_is_evicted():
+    tracker = IPRateTracker(window=60, max_ips=2)
+    tracker.hit("a", now=1000)
+    tracker.hit("b", now=1000)
+    tracker.hit("a", now=1001)
+    tracker.hit("c", now=1002)
+    assert tracker.count("b", now=1002) == 0
+    assert tracker.count("a", now=1002) == 2
+    assert tracker.get_stats()["evictions"] == 1
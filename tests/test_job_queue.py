@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from services.job_queue import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JobQueue, JobStore
+
+
+def test_jobs_are_claimed_oldest_first(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    first = store.insert("chat", {"message": "first"}, max_age=60)
+    second = store.insert("chat", {"message": "second"}, max_age=60)
+
+    job = store.claim()
+    assert job == {"id": first, "kind": "chat", "payload": {"message": "first"}, "attempts": 1}
+    assert store.get(first)["status"] == JOB_RUNNING
+    assert store.claim()["id"] == second
+    assert store.claim() is None
+
+
+def test_finished_result_is_kept_until_it_expires(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    kept = store.insert("chat", {}, max_age=60)
+    expired = store.insert("chat", {}, max_age=60)
+    store.claim()
+    store.claim()
+    store.finish(kept, JOB_SUCCEEDED, {"response": "hi"}, None, ttl=60)
+    store.finish(expired, JOB_FAILED, None, "boom", ttl=0)
+
+    job = store.get(kept)
+    assert job["status"] == JOB_SUCCEEDED
+    assert job["progress"] == 1.0
+    assert job["result"] == {"response": "hi"}
+    assert store.get(expired) is None
+    assert store.purge_expired(max_age=60) == 1
+    assert store.counts() == {JOB_SUCCEEDED: 1}
+
+
+def test_interrupted_jobs_are_requeued_until_out_of_attempts(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    retried = store.insert("chat", {}, max_age=60)
+    store.claim()
+    assert store.recover(max_attempts=2) == 1
+    assert store.get(retried)["status"] == JOB_QUEUED
+
+    store.claim()
+    assert store.recover(max_attempts=2) == 0
+    assert store.counts() == {JOB_FAILED: 1}
+
+
+def test_running_jobs_cannot_be_cancelled(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    running = store.insert("chat", {}, max_age=60)
+    queued = store.insert("chat", {}, max_age=60)
+    store.claim()
+    statuses = [JOB_QUEUED, JOB_SUCCEEDED, JOB_FAILED]
+    assert not store.delete(running, statuses)
+    assert store.delete(queued, statuses)
+    assert store.get(queued) is None
+
+
+def test_workers_run_registered_handlers(tmp_path):
+    async def run():
+        queue = JobQueue(str(tmp_path / "jobs.db"), workers=2, poll_interval=0.05)
+
+        async def echo(payload, progress):
+            await progress(0.5)
+            return {"echo": payload["message"]}
+
+        async def broken(payload, progress):
+            raise RuntimeError("upstream down")
+
+        queue.register("echo", echo)
+        queue.register("broken", broken)
+        await queue.start()
+        try:
+            ok = await queue.submit("echo", {"message": "hi"})
+            bad = await queue.submit("broken", {})
+            for _ in range(100):
+                jobs = [await queue.get(ok), await queue.get(bad)]
+                if all(job["status"] in (JOB_SUCCEEDED, JOB_FAILED) for job in jobs):
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await queue.stop()
+        return jobs, await queue.get_stats()
+
+    (ok, bad), stats = asyncio.run(run())
+    assert ok["status"] == JOB_SUCCEEDED
+    assert ok["result"] == {"echo": "hi"}
+    assert bad["status"] == JOB_FAILED
+    assert bad["error"] == "upstream down"
+    assert stats["completed"] == 1
+    assert stats["failed"] == 1
+
+
+def test_unknown_kind_is_rejected(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    try:
+        asyncio.run(queue.submit("missing", {}))
+    except ValueError as e:
+        assert "missing" in str(e)
+    else:
+        raise AssertionError("submit accepted an unregistered kind")
+
+
+def test_recovery_can_be_limited_to_one_worker(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    mine = store.insert("chat", {}, max_age=60)
+    theirs = store.insert("chat", {}, max_age=60)
+    store.claim()
+    store.claim()
+    store._conn.execute('UPDATE jobs SET owner = ? WHERE id = ?', (999999, theirs))
+
+    assert store.recover(max_attempts=3, owner=999999) == 1
+    assert store.get(theirs)["status"] == JOB_QUEUED
+    assert store.get(mine)["status"] == JOB_RUNNING
+    store.close()
+
+
+def payload_of(store: JobStore, job_id: str) -> str:
+    return store._conn.execute('SELECT payload FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+
+def test_finished_job_drops_its_payload(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.insert("chat", {"message": "my email is jane@example.com"}, max_age=60)
+    assert "jane@example.com" in payload_of(store, job_id)
+
+    assert store.claim()["id"] == job_id
+    store.finish(job_id, JOB_SUCCEEDED, {"ok": True}, None, ttl=60)
+    assert "jane@example.com" not in payload_of(store, job_id)
+    assert store.get(job_id)["result"] == {"ok": True}
+
+
+def test_unfinished_jobs_expire(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    stale = store.insert("chat", {"message": "stale"}, max_age=0)
+    running = store.insert("chat", {"message": "running"}, max_age=60)
+    assert store.claim()["id"] == running
+    store._conn.execute('UPDATE jobs SET expires_at = ? WHERE id = ?', (time.time() - 1, running))
+
+    assert store.claim() is None
+    assert store.get(stale) is None
+    assert store.purge_expired(max_age=60) == 1
+    assert store.counts() == {JOB_RUNNING: 1}
+
+
+def test_legacy_jobs_get_an_expiry(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.insert("chat", {"message": "old"}, max_age=60)
+    store._conn.execute('UPDATE jobs SET expires_at = NULL, created_at = ? WHERE id = ?', (time.time() - 120, job_id))
+    assert store.purge_expired(max_age=60) == 1
+    assert store.counts().get(JOB_QUEUED) is None
+
+
+def test_stats_read_counts_off_the_event_loop(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), workers=0)
+    queue.store.insert("chat", {"message": "hi"}, max_age=60)
+    assert asyncio.run(queue.get_stats())["jobs"] == {JOB_QUEUED: 1}
@@ -0,0 +1,31 @@
+import json
+
+from services import json_codec
+from services.proxy_service import ProxyService
+
+
+def test_splice_field_adds_a_field_without_touching_the_rest():
+    body = b'{"id": "chatcmpl-1", "choices": [{"text": "caf\\u00e9"}]}\n'
+    spliced = json_codec.splice_field(body, "security_metadata", {"cache": "miss"})
+    assert spliced.startswith(b'{"id": "chatcmpl-1", "choices": [{"text": "caf\\u00e9"}]')
+    assert json.loads(spliced) == {"id": "chatcmpl-1", "choices": [{"text": "café"}],
+                                   "security_metadata": {"cache": "miss"}}
+
+
+def test_splice_field_into_an_empty_object():
+    assert json.loads(json_codec.splice_field(b" {} ", "a", 1)) == {"a": 1}
+
+
+def test_splice_field_leaves_non_objects_to_the_caller():
+    for body in (b"[1, 2]", b"", b"not json", b"{"):
+        assert json_codec.splice_field(body, "a", 1) is None
+
+
+def test_chat_response_passes_upstream_bytes_through():
+    upstream = b'{"id":"chatcmpl-1","choices":[]}'
+    metadata = {"proxy_service": "openai", "secure_filtering_applied": True, "cache": "miss", "coalesced": False}
+    response = ProxyService._chat_response(upstream, metadata)
+
+    assert response.headers["x-proxy-service"] == "openai"
+    assert response.headers["x-cache"] == "miss" and response.headers["x-coalesced"] == "false"
+    assert json.loads(response.body) == {"id": "chatcmpl-1", "choices": [], "security_metadata": metadata}
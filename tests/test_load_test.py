@@ -0,0 +1,100 @@
+import argparse
+
+from fastapi.testclient import TestClient
+
+from tools import load_test, stub_upstream
+
+
+def make_args(**overrides):
+    args = dict(model="anthropic/claude-3-haiku", target=None, proxy_path="models",
+                max_p99_ms=None, max_error_rate=None, min_rps=None, max_rss_mb=None)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def test_scenario_report_counts_errors_and_percentiles():
+    stats = load_test.ScenarioStats("proxy-chat")
+    for i in range(1, 101):
+        stats.record("200", i / 1000.0, ok=True)
+    stats.record("503", 1.0, ok=False)
+
+    report = stats.report(elapsed=10.0)
+    assert report["requests"] == 101
+    assert report["errors"] == 1
+    assert report["statuses"] == {"200": 100, "503": 1}
+    assert report["throughput_rps"] == 10.1
+    assert report["p50_ms"] == 51.0
+    assert report["max_ms"] == 1000.0
+
+
+def test_thresholds_list_every_violation():
+    report = {"total": {"p99_ms": 800.0, "error_rate": 0.05, "throughput_rps": 40.0},
+              "gateway": {"rss_mb_max": 300.0}}
+    assert load_test.check_thresholds(report, make_args()) == []
+
+    failures = load_test.check_thresholds(
+        report, make_args(max_p99_ms=500, max_error_rate=0.01, min_rps=100, max_rss_mb=256)
+    )
+    assert len(failures) == 4
+    assert failures[0] == "p99 800.0 ms > 500 ms"
+
+
+def test_proxy_chat_requests_can_be_pinned_to_a_target():
+    spec = load_test.build_request("proxy-chat-stream", make_args(target="openai"))
+    assert spec["path"] == "/proxy/chat"
+    assert spec["json"]["stream"] is True
+    assert spec["json"]["target"] == "openai"
+    assert load_test.build_request("proxy-path", make_args())["params"] == {"target": "openrouter"}
+
+
+def test_stub_injects_errors_and_streams_tokens():
+    saved = dict(stub_upstream.settings)
+    stub_upstream.settings.update(latency_ms=0.0, jitter_ms=0.0, tokens_per_sec=0.0, stream_tokens=3)
+    try:
+        with TestClient(stub_upstream.app) as client:
+            body = {"model": "stub", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+            response = client.post("/v1/chat/completions", json=body)
+            assert response.text.count("data: ") == 4
+            assert response.text.endswith("data: [DONE]\n\n")
+
+            client.post("/_stub/config", json={"error_rate": 1.0, "error_status": 429})
+            assert client.post("/v1/chat/completions", json=dict(body, stream=False)).status_code == 429
+    finally:
+        stub_upstream.settings.clear()
+        stub_upstream.settings.update(saved)
+
+
+def test_fixed_latency_has_no_jitter():
+    saved = dict(stub_upstream.settings)
+    stub_upstream.settings.update(latency_ms=80.0, jitter_ms=30.0, latency_dist="fixed")
+    try:
+        assert stub_upstream._sample_latency_ms() == 80.0
+        stub_upstream.settings["latency_dist"] = "uniform"
+        assert 80.0 <= stub_upstream._sample_latency_ms() <= 110.0
+    finally:
+        stub_upstream.settings.clear()
+        stub_upstream.settings.update(saved)
+
+
+def test_spawned_gateway_does_not_rate_limit_or_block_the_load(monkeypatch):
+    launched = []
+
+    class FakeProcess:
+        pid = 4321
+
+        def __init__(self, command, **kwargs):
+            launched.append((command, kwargs))
+
+    monkeypatch.setattr(load_test.subprocess, "Popen", FakeProcess)
+    monkeypatch.setattr(load_test, "_wait_for", lambda url: None)
+    monkeypatch.delenv("SECURITY_MAX_REQUESTS_PER_MINUTE", raising=False)
+    monkeypatch.delenv("SECURITY_BLOCK_TTL", raising=False)
+    args = make_args(stub_latency_ms=0, stub_jitter_ms=0, stub_latency_dist="fixed", stub_error_rate=0,
+                     stub_port=9100, gateway_port=9200)
+
+    assert len(load_test.spawn_stack(args)) == 3
+    env = launched[-1][1]["env"]
+    assert int(env["SECURITY_MAX_REQUESTS_PER_MINUTE"]) >= 1_000_000
+    assert float(env["SECURITY_BLOCK_TTL"]) <= 1
+    assert env["OPENAI_BASE_URL"] == "http://127.0.0.1:9101/v1"
+    assert args.url == "http://127.0.0.1:9200"
@@ -0,0 +1,53 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from middleware.metrics import MetricsMiddleware
+from services.metrics import MetricsRegistry, REGISTRY
+
+
+def test_render_in_prometheus_text_format():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Jobs run", ("kind",))
+    histogram = registry.histogram("job_seconds", "Job time", buckets=(0.1, 1.0))
+    counter.inc('chat "bulk"')
+    counter.inc('chat "bulk"', amount=2)
+    histogram.observe(0.05)
+    histogram.observe(2.0)
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Jobs run",
+        "# TYPE jobs_total counter",
+        'jobs_total{kind="chat \\"bulk\\""} 3',
+        "# HELP job_seconds Job time",
+        "# TYPE job_seconds histogram",
+        'job_seconds_bucket{le="0.1"} 1',
+        'job_seconds_bucket{le="1"} 1',
+        'job_seconds_bucket{le="+Inf"} 2',
+        "job_seconds_sum 2.05",
+        "job_seconds_count 2"
+    ]
+
+
+def test_gauge_reads_its_callback_at_scrape_time():
+    registry = MetricsRegistry()
+    values = {("openai",): 1}
+    registry.gauge("in_flight", "Calls in flight", ("target",), callback=lambda: values)
+    values[("openai",)] = 4
+    assert 'in_flight{target="openai"} 4' in registry.render()
+
+
+def test_requests_are_labelled_by_route_template():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {}
+
+    app.add_middleware(MetricsMiddleware)
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+
+    rendered = REGISTRY.render()
+    assert 'gateway_requests_total{route="/items/{item_id}",target="none",method="GET",status="200"} 2' in rendered
+    assert "/items/1" not in rendered
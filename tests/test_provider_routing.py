@@ -0,0 +1,151 @@
+import asyncio
+
+import httpx
+
+from services.provider_router import CircuitBreaker, ProviderRouter
+from services.proxy_service import ProxyService
+
+SERVICES = {
+    "openrouter": {"api_key": "k", "models": ["openai/gpt-4", "anthropic/claude-3-haiku"]},
+    "openai": {"api_key": "k", "models": ["gpt-4", "gpt-3.5-turbo"]},
+    "anthropic": {"api_key": "", "models": ["claude-3-haiku-20240307"]}
+}
+
+
+def test_breaker_opens_after_consecutive_failures_and_recovers_through_a_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.0, half_open_probes=1)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_model_names_map_across_providers():
+    router = ProviderRouter(SERVICES)
+    assert router.resolve_model("openai", "openai/gpt-4") == "gpt-4"
+    assert router.resolve_model("openrouter", "gpt-4") == "openai/gpt-4"
+    assert router.resolve_model("anthropic", "claude-3-haiku") == "claude-3-haiku-20240307"
+    assert router.resolve_model("openai", "claude-3-haiku") is None
+
+
+def test_candidates_rank_by_latency_and_skip_open_breakers():
+    router = ProviderRouter(SERVICES, failure_threshold=1, explore_ratio=0.0)
+    router.record("openrouter", "openai/gpt-4", 0.5, ok=True)
+    router.record("openai", "gpt-4", 0.1, ok=True)
+    assert router.candidates("gpt-4") == [("openai", "gpt-4"), ("openrouter", "openai/gpt-4")]
+
+    router.record("openai", "gpt-4", 0.1, ok=False)
+    assert router.candidates("gpt-4") == [("openrouter", "openai/gpt-4")]
+    # A pinned target is used whatever its health; providers without a key are never picked
+    assert router.candidates("gpt-4", pinned="openai") == [("openai", "gpt-4")]
+    assert router.candidates("claude-3-haiku") == [("openrouter", "anthropic/claude-3-haiku")]
+
+
+def test_upstream_5xx_fails_over_to_the_next_provider():
+    service = ProxyService()
+
+    async def upstream(provider, request_body):
+        request = httpx.Request("POST", f"http://{provider}/chat/completions")
+        if provider == "openai":
+            raise httpx.HTTPStatusError("unavailable", request=request, response=httpx.Response(503, request=request))
+        return httpx.Response(200, json={"choices": []}, request=request)
+
+    service._post_upstream = upstream
+    candidates = [("openai", "gpt-4"), ("openrouter", "openai/gpt-4")]
+    provider, response = asyncio.run(service._post_with_failover(candidates, {"messages": []}, pinned=False))
+
+    assert provider == "openrouter" and response.status_code == 200
+    assert service.router.failovers == 1
+    assert service.router.health[("openai", "gpt-4")].failures == 1
+
+
+def half_open_service():
+    """A ProxyService whose openai:gpt-4 breaker is half open with its one probe slot free"""
+    service = ProxyService()
+    service.router.reset_timeout = 0.0
+    service.router.half_open_probes = 1
+    for _ in range(service.router.failure_threshold):
+        service.router.record("openai", "gpt-4", 0.1, ok=False)
+    assert service.router.acquire("openai", "gpt-4")
+    assert service.router.health[("openai", "gpt-4")].breaker.state == CircuitBreaker.HALF_OPEN
+    return service
+
+
+def test_cancelled_probe_frees_its_slot():
+    service = half_open_service()
+
+    async def hang(provider, request_body):
+        await asyncio.sleep(60)
+
+    service._post_upstream = hang
+
+    async def run():
+        attempt = asyncio.create_task(service._post_attempt("openai", "gpt-4", {"messages": []}))
+        await asyncio.sleep(0.01)
+        attempt.cancel()
+        try:
+            await attempt
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    assert service.router.acquire("openai", "gpt-4")
+
+
+def test_client_error_is_not_a_health_sample():
+    service = ProxyService()
+
+    async def reject(provider, request_body):
+        request = httpx.Request("POST", "http://upstream/chat/completions")
+        raise httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(400, request=request))
+
+    service._post_upstream = reject
+
+    async def run():
+        try:
+            await service._post_attempt("openai", "gpt-4", {"messages": []})
+        except httpx.HTTPStatusError:
+            pass
+
+    asyncio.run(run())
+    health = service.router.health[("openai", "gpt-4")]
+    assert health.client_errors == 1
+    assert health.failures == 0
+    assert health.latency is None
+    assert health.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_rejected_key_fails_over_and_counts_against_the_provider():
+    service = ProxyService()
+
+    async def upstream(provider, request_body):
+        request = httpx.Request("POST", f"http://{provider}/chat/completions")
+        if provider == "anthropic":
+            raise httpx.HTTPStatusError("unauthorized", request=request, response=httpx.Response(401, request=request))
+        return httpx.Response(200, json={"choices": []}, request=request)
+
+    service._post_upstream = upstream
+    candidates = [("anthropic", "claude-3-haiku"), ("openrouter", "claude-3-haiku")]
+    provider, response = asyncio.run(service._post_with_failover(candidates, {"messages": []}, pinned=False))
+
+    assert provider == "openrouter" and response.status_code == 200
+    assert service.router.failovers == 1
+    health = service.router.health[("anthropic", "claude-3-haiku")]
+    assert health.failures == 1 and health.client_errors == 0
+
+
+def test_provider_that_only_failed_ranks_last():
+    router = ProviderRouter({
+        "openrouter": {"api_key": "k", "models": ["gpt-4"]},
+        "openai": {"api_key": "k", "models": ["gpt-4"]}
+    }, explore_ratio=0.0)
+    router.record("openrouter", "gpt-4", 0.5, ok=True)
+    router.record("openai", "gpt-4", 0.01, ok=False)
+
+    assert router.candidates("gpt-4") == [("openrouter", "gpt-4"), ("openai", "gpt-4")]
@@ -0,0 +1,37 @@
+from services.request_log import RequestLog
+
+
+def fill(log: RequestLog, count: int):
+    for i in range(count):
+        seq = log.append(1000.0 + i, f"10.0.0.{i % 3}", "GET", "/proxy/status", "curl")
+        log.complete(seq, 200, 0.002)
+
+
+def test_oldest_records_are_overwritten():
+    log = RequestLog(capacity=5)
+    fill(log, 8)
+    assert len(log) == 5
+    assert log.get(2) is None
+    record = log.get(7)
+    assert (record["ip"], record["status_code"], record["duration_ms"]) == ("10.0.0.1", 200, 2.0)
+
+
+def test_pages_newest_first_by_ip_and_time():
+    log = RequestLog(capacity=100)
+    fill(log, 30)
+
+    page, cursor = log.query(ip="10.0.0.0", limit=4)
+    assert [record["id"] for record in page] == [27, 24, 21, 18]
+    page, _ = log.query(ip="10.0.0.0", before=cursor, limit=2)
+    assert [record["id"] for record in page] == [15, 12]
+
+    page, cursor = log.query(start=1010.0, end=1012.0)
+    assert [record["id"] for record in page] == [12, 11, 10]
+    assert cursor is None
+
+
+def test_api_keys_in_the_query_are_redacted():
+    log = RequestLog(capacity=10)
+    seq = log.append(1.0, "10.0.0.1", "GET", "/chat", "curl", "target=openai&api_key=sk-live-secret")
+    assert "sk-live-secret" not in log.get(seq)["query_string"]
+    assert log.get(seq)["status_code"] is None
@@ -0,0 +1,58 @@
+import asyncio
+
+from services.response_cache import ResponseCache, parse_cache_control
+
+
+def test_only_deterministic_completions_are_cacheable():
+    cache = ResponseCache(enabled=True)
+    assert cache.is_cacheable({"temperature": 0}, {})
+    assert not cache.is_cacheable({"temperature": 0.7}, {})
+    assert not cache.is_cacheable({"temperature": 0, "stream": True}, {})
+    assert not cache.is_cacheable({"temperature": 0}, parse_cache_control("no-store"))
+    assert not ResponseCache(enabled=False).is_cacheable({"temperature": 0}, {})
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('no-cache, max-age="60"') == {"no-cache": True, "max-age": 60}
+    assert parse_cache_control(None) == {}
+
+
+def test_key_ignores_field_order_but_not_content():
+    key = ResponseCache.make_key("openai", {"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]})
+    assert key == ResponseCache.make_key("openai", {"messages": [{"content": "hi", "role": "user"}], "model": "gpt-4"})
+    assert key != ResponseCache.make_key("openrouter", {"model": "gpt-4", "messages": [{"role": "user", "content": "hi"}]})
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResponseCache(enabled=True, max_entries=2)
+
+    async def run():
+        await cache.put("a", b"1")
+        await cache.put("b", b"2")
+        assert await cache.get("a") == b"1"
+        await cache.put("c", b"3")
+        return await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    assert asyncio.run(run()) == (b"1", None, b"3")
+    assert cache.evictions == 1 and cache.hits == 3 and cache.misses == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "response_cache.db")
+
+    async def run():
+        await ResponseCache(enabled=True, disk_path=path).put("key", b"body")
+        restarted = ResponseCache(enabled=True, disk_path=path)
+        return await restarted.get("key"), restarted.disk_hits
+
+    assert asyncio.run(run()) == (b"body", 1)
+
+
+def test_expired_entries_are_misses():
+    cache = ResponseCache(enabled=True)
+
+    async def run():
+        await cache.put("key", b"body", ttl=0)
+        return await cache.get("key")
+
+    assert asyncio.run(run()) is None
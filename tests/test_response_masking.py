@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from services.response_masking import ResponseMasking
+
+
+def make_masking(max_hold: float = 5.0) -> ResponseMasking:
+    return ResponseMasking(True, ["emails", "phone_numbers"], holdback=16, max_hold=max_hold)
+
+
+def sse(*deltas: str) -> list:
+    events = [
+        f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': delta}}]})}\n\n".encode()
+        for delta in deltas
+    ]
+    return events + [b"data: [DONE]\n\n"]
+
+
+def relay(masking: ResponseMasking, chunks: list, pause: float = 0.0) -> str:
+    async def upstream():
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(pause)
+
+    async def run():
+        return [chunk async for chunk in masking.mask_stream(upstream())]
+
+    out = asyncio.run(run())
+    text = ""
+    for event in b"".join(out).decode().split("\n\n"):
+        if event.startswith("data: {"):
+            for choice in json.loads(event[len("data: "):])["choices"]:
+                text += choice.get("delta", {}).get("content") or ""
+    assert b"".join(out).endswith(b"data: [DONE]\n\n")
+    return text
+
+
+def test_per_request_flag_overrides_the_default():
+    masking = ResponseMasking(False, ["emails"], holdback=16, max_hold=0.5)
+    assert masking.requested(None) is False
+    assert masking.requested("true") is True
+    assert make_masking().requested("0") is False
+
+
+def test_complete_response_is_masked():
+    masking = make_masking()
+    body = json.dumps({"choices": [{"index": 0, "message": {"role": "assistant",
+                                                             "content": "Mail jane.doe@example.com"}}]}).encode()
+    masked, count = masking.mask_completion_bytes(body)
+    assert count == 1
+    assert "<EMAIL>" in json.loads(masked)["choices"][0]["message"]["content"]
+    assert masking.mask_completion_bytes(b"not json") == (b"not json", 0)
+
+
+def test_match_split_across_deltas_is_masked():
+    masking = make_masking()
+    text = relay(masking, sse("Write to jane.", "doe@exam", "ple.com and wait ", "for a reply."))
+    assert text == "Write to <EMAIL> and wait for a reply."
+    assert masking.get_stats()["masked"] == {"emails": 1}
+
+
+def test_quiet_upstream_releases_held_text_early():
+    masking = make_masking(max_hold=0.01)
+    text = relay(masking, sse("The answer is forty two ", "and that is final."), pause=0.05)
+    assert text == "The answer is forty two and that is final."
+    assert masking.forced_flushes >= 1
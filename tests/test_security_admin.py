@@ -0,0 +1,92 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from middleware.security import SecurityMiddleware
+from services.api_keys import APIKeyStore
+from services.request_log import RequestLog
+
+
+def make_client(**kwargs) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/admin/security/requests")
+    async def security_requests():
+        return {"requests": []}
+
+    @app.api_route("/debug/prompts", methods=["GET", "DELETE"])
+    async def debug_prompts():
+        return {"prompts": []}
+
+    @app.get("/debug/traces")
+    @app.get("/debug/traces/{trace_id}")
+    async def debug_traces(trace_id: str = ""):
+        return {"traces": []}
+
+    @app.get("/admin/other")
+    async def other():
+        return {}
+
+    app.add_middleware(SecurityMiddleware, request_log=RequestLog(capacity=100), **kwargs)
+    return TestClient(app)
+
+
+def test_admin_path_needs_an_admin_key():
+    client = make_client(admin_keys=["admin-secret"])
+
+    assert client.get("/admin/security/requests").status_code == 401
+    assert client.get("/admin/security/requests", headers={"X-API-Key": "any-key"}).status_code == 403
+    # A rejected caller is not blocked: the admin can still get in from the same address
+    response = client.get("/admin/security/requests", headers={"X-API-Key": "admin-secret"})
+    assert response.status_code == 200
+    assert response.json() == {"requests": []}
+
+
+def test_admin_paths_are_closed_without_admin_keys():
+    client = make_client(admin_keys=[])
+
+    assert client.get("/admin/security/requests", headers={"X-API-Key": "test"}).status_code == 403
+
+
+def test_other_admin_paths_are_still_probing():
+    client = make_client(admin_keys=["admin-secret"])
+
+    response = client.get("/admin/other", headers={"X-API-Key": "admin-secret"})
+    assert response.status_code == 403
+    assert response.json()["reason"] == "Suspicious activity detected"
+
+
+def test_stored_keys_with_the_admin_permission_get_in(tmp_path):
+    store = APIKeyStore(str(tmp_path / "keys.db"))
+    admin = store.create("ops", {"admin": True})
+    user = store.create("app")
+    client = make_client(admin_keys=[], key_store=store)
+
+    assert client.get("/admin/security/requests", headers={"X-API-Key": user}).status_code == 403
+    assert client.get("/admin/security/requests", headers={"X-API-Key": admin}).status_code == 200
+
+
+def test_api_keys_are_kept_in_memory_without_a_key_store():
+    security = SecurityMiddleware(None, request_log=RequestLog(capacity=100), key_store=None)
+    security.key_store = None  # even if API_KEY_STORE_ENABLED is set here
+
+    assert security.add_api_key("local-key", {"allowed_paths": ["/proxy"]}) == "local-key"
+    assert security.get_security_stats()["total_api_keys"] == 1
+    security.remove_api_key("local-key")
+    security.remove_api_key("missing-key")
+    assert security.get_security_stats()["total_api_keys"] == 0
+
+
+def test_captured_prompts_need_an_admin_key():
+    client = make_client(admin_keys=["admin-secret"])
+
+    for method in ("GET", "DELETE"):
+        assert client.request(method, "/debug/prompts", headers={"X-API-Key": "test"}).status_code == 403
+        assert client.request(method, "/debug/prompts", headers={"X-API-Key": "admin-secret"}).status_code == 200
+
+
+def test_traces_need_an_admin_key():
+    client = make_client(admin_keys=["admin-secret"])
+
+    for path in ("/debug/traces", "/debug/traces/0123456789abcdef0123456789abcdef"):
+        assert client.get(path, headers={"X-API-Key": "test"}).status_code == 403
+        assert client.get(path, headers={"X-API-Key": "admin-secret"}).status_code == 200
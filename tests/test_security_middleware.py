@@ -0,0 +1,112 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import main
+from middleware.security import SecurityMiddleware
+
+CLIENT_IP = "203.0.113.9"
+
+
+def make_gateway(**options):
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/chat")
+    async def chat():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"chunk {i}\n".encode()
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    security = SecurityMiddleware(app, **options)
+    return security, TestClient(security, raise_server_exceptions=False, client=(CLIENT_IP, 50000))
+
+
+def test_api_key_is_required_outside_public_paths():
+    _, client = make_gateway()
+    assert client.get("/health").status_code == 200
+    response = client.post("/chat")
+    assert response.status_code == 401
+    assert response.json() == {"error": "Invalid or missing API key"}
+
+    for kwargs in ({"headers": {"X-API-Key": "k"}}, {"headers": {"Authorization": "Bearer k"}},
+                   {"params": {"api_key": "k"}}):
+        assert client.post("/chat", **kwargs).status_code == 200
+
+
+def test_security_headers_are_added_to_streamed_responses():
+    _, client = make_gateway()
+    response = client.get("/stream", headers={"X-API-Key": "k"})
+    assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+    assert response.headers["x-security-proxy"] == "enabled"
+    assert len(response.headers["x-request-id"]) == 32
+
+
+def test_blocked_ips_and_crawlers_are_refused():
+    security, client = make_gateway()
+    assert client.get("/health", headers={"User-Agent": "friendly-crawler"}).status_code == 403
+
+    security.block_ip("203.0.113.0/24")
+    response = client.get("/health")
+    assert response.status_code == 403
+    assert response.json()["reason"] == "IP address blocked"
+    security.unblock_ip("203.0.113.0/24")
+    security.unblock_ip(CLIENT_IP)
+    assert client.get("/health").status_code == 200
+
+
+def test_allowlist_wins_and_automatic_blocks_expire():
+    security, client = make_gateway(block_ttl=0.2)
+    security.block_ip("203.0.113.0/24")
+    security.allowlist.add(CLIENT_IP)
+    assert client.get("/health").status_code == 200
+
+    security, client = make_gateway(block_ttl=0.2)
+    assert client.get("/health", headers={"User-Agent": "friendly-crawler"}).status_code == 403
+    assert client.get("/health").status_code == 403
+    time.sleep(0.3)
+    assert client.get("/health").status_code == 200
+
+
+def test_errors_before_the_response_become_a_json_500():
+    async def broken(scope, receive, send):
+        raise RuntimeError("broken app")
+
+    client = TestClient(SecurityMiddleware(broken), raise_server_exceptions=False)
+    response = client.get("/chat", headers={"X-API-Key": "k"})
+    assert response.status_code == 500
+    assert response.json() == {"error": "Internal server error"}
+
+
+def test_web_ui_sends_the_api_key_the_gateway_requires():
+    client = TestClient(main.app)
+
+    page = client.get("/")
+    assert page.status_code == 200
+    assert 'id="apiKey"' in page.text and "'X-API-Key'" in page.text
+
+    response = client.post("/chat", json={"message": "hello"})
+    assert response.status_code == 401
+    assert response.json() == {"error": "Invalid or missing API key"}
+
+
+def test_per_ip_rate_limit_is_exact_under_load():
+    security, client = make_gateway()
+    security.max_requests_per_minute = 5
+    for _ in range(5):
+        assert client.get("/health").status_code == 200
+    assert client.get("/health").status_code == 403
+
+    security.unblock_ip(CLIENT_IP)
+    assert client.get("/health").status_code == 200
+    assert security.get_security_stats()["requests_per_minute"] == {CLIENT_IP: 1}
@@ -0,0 +1,30 @@
+import gzip
+import json
+import os
+
+import serve
+from services.traffic_capture import TrafficRecorder
+
+
+def test_process_stats_reads_own_process():
+    stats = serve.process_stats(os.getpid())
+    assert stats["cpu_seconds"] >= 0
+    assert stats["rss_mb"] > 0
+
+
+def test_process_stats_of_missing_process_is_empty():
+    assert serve.process_stats(2 ** 22 + 1) == {}
+
+
+def test_forked_worker_captures_to_its_own_file(tmp_path):
+    recorder = TrafficRecorder(enabled=True, path=str(tmp_path / "capture.ndjson.gz"))
+    # In a real fork the parent's writer thread does not exist in the child
+    recorder.stop()
+    recorder._after_fork()
+    recorder.record({"ts": 1.0, "path": "/chat"})
+    recorder.stop()
+
+    assert recorder.path == str(tmp_path / f"capture.{os.getpid()}.ndjson.gz")
+    with gzip.open(recorder.path, "rt") as f:
+        assert [json.loads(line)["path"] for line in f] == ["/chat"]
+
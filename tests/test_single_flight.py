@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "response"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", upstream) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["response"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert flight.get_stats()["in_flight"] == 0
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", upstream) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+def test_a_cancelled_caller_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.02)
+        return "response"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", upstream))
+        second = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == ("response", True)
+
+
+def test_late_stream_subscribers_replay_from_the_start():
+    flight = SingleFlight()
+
+    async def source(metadata):
+        metadata["provider"] = "openai"
+        for chunk in (b"a", b"b", b"c"):
+            await asyncio.sleep(0.005)
+            yield chunk
+
+    async def read(stream):
+        return b"".join([chunk async for chunk in stream])
+
+    async def run():
+        leader, leader_shared, _ = flight.stream("key", source)
+        first = asyncio.ensure_future(read(leader))
+        await asyncio.sleep(0.008)
+        follower, follower_shared, metadata = flight.stream("key", source)
+        return await first, await read(follower), leader_shared, follower_shared, metadata
+
+    assert asyncio.run(run()) == (b"abc", b"abc", False, True, {"provider": "openai"})
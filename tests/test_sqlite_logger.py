@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from ai_proxy_admin_dashboard import sqlite_logger
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_logger, "DB_PATH", str(tmp_path / "masking_logs.db"))
+    sqlite_logger.init_db()
+    rows = [
+        ("2024-05-01T09:00:00", "emails", "text", 1),
+        ("2024-05-01T10:00:00", "phone_numbers", "pdf", 3),
+        ("2024-05-02T08:00:00", "emails", "pdf", 5),
+        ("2024-05-02T08:00:00", "emails", "text", 2),
+        ("2024-05-03T12:00:00", "names", "text", 4),
+    ]
+    with sqlite3.connect(sqlite_logger.DB_PATH) as conn:
+        conn.executemany("INSERT INTO masking_events (timestamp, masked_type, masked_value, count) "
+                         "VALUES (?, ?, ?, ?)", rows)
+    return sqlite_logger.DB_PATH
+
+
+def test_filters_run_together(db):
+    assert [log["count"] for log in sqlite_logger.get_logs()] == [4, 2, 5, 3, 1]
+    assert [log["count"] for log in sqlite_logger.get_logs(masked_type="emails", min_count=2)] == [2, 5]
+    assert [log["count"] for log in sqlite_logger.get_logs(file_type="pdf")] == [5, 3]
+    assert [log["count"] for log in sqlite_logger.get_logs(date="2024-05-01")] == [3, 1]
+    assert sqlite_logger.get_logs(masked_type="emails", file_type="pdf", date="2024-05-02")[0]["count"] == 5
+    with pytest.raises(ValueError):
+        sqlite_logger.get_logs(date="05/01/2024")
+
+
+def test_keyset_pages_cover_every_event_once(db):
+    seen, before = [], None
+    while True:
+        page = sqlite_logger.get_logs(limit=2, before=before)
+        if not page:
+            break
+        seen += [log["id"] for log in page]
+        before = (page[-1]["timestamp"], page[-1]["id"])
+    assert seen == [log["id"] for log in sqlite_logger.get_logs()]
+    assert len(set(seen)) == 5
+
+
+def test_default_and_filtered_views_read_off_an_index(db):
+    with sqlite3.connect(db) as conn:
+        for where in ("", "WHERE masked_type = 'emails'", "WHERE masked_value = 'pdf'"):
+            plan = " ".join(row[-1] for row in conn.execute(
+                f"EXPLAIN QUERY PLAN SELECT * FROM masking_events {where} ORDER BY timestamp DESC, id DESC LIMIT 100"
+            ))
+            assert "USING INDEX" in plan
+            assert "TEMP B-TREE" not in plan
+
+
+def test_events_are_logged_with_their_request_id(db):
+    sqlite_logger.log_masking_events([("emails", "text", 1), ("names", "text", 2)], request_id="req-1")
+    sqlite_logger.log_masking_event("emails", "pdf", 7)
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM masking_events WHERE request_id = 'req-1'").fetchone() == (2,)
+    assert sqlite_logger.get_logs(limit=1)[0]["count"] == 7
+    assert set(sqlite_logger.get_masked_types()) == {"emails", "phone_numbers", "names"}
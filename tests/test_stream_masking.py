@@ -0,0 +1,66 @@
+import random
+import time
+
+from masking.smart_masking import smart_mask
+from masking.stream_masking import StreamMasker
+
+WORDS = ("the a meeting billing service team plan rollout customer support review budget draft owner "
+         "date week month report data account invoice we will should share update status before after "
+         "with for and but of to in on").split()
+
+
+def prose(chars: int, seed: int = 1) -> str:
+    """Wrapped sentences of varying length, with a contact line every so often"""
+    rng = random.Random(seed)
+    lines, line, total = [], [], 0
+    while total < chars:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 16))]
+        line.append(" ".join(words).capitalize() + rng.choice([".", ".", ",", ";", " -"]))
+        if sum(map(len, line)) > 70:
+            if len(lines) % 20 == 0:
+                line.append(f"Questions go to ops{len(lines)}@example.com.")
+            lines.append(" ".join(line) + "\n")
+            total += len(lines[-1])
+            line = []
+    return "".join(lines)
+
+
+def test_prose_is_released_before_flush():
+    text = prose(48 * 1024)
+    piece = 8 * 1024
+    masker = StreamMasker.from_sample(text[:piece], holdback=256)
+    released = []
+    for start in range(0, len(text), piece):
+        released.append(masker.feed(text[start:start + piece]))
+    streamed = "".join(released)
+    out = streamed + masker.finish()
+
+    assert all(released[:-1])
+    assert len(streamed) > len(out) * 0.9
+    assert masker.peak_buffer < piece + 2048
+    assert masker.forced_cuts == 0
+    assert "@example.com" not in out
+
+
+def test_secret_split_across_pieces_is_masked():
+    text = prose(2000) + "Reach me at jane.doe@example.com today.\n" + prose(500, seed=2)
+    split = text.index("doe@")
+    masker = StreamMasker(holdback=64)
+    out = masker.feed(text[:split]) + masker.feed(text[split:]) + masker.finish()
+    assert "jane.doe" not in out
+    assert "<EMAIL>" in out
+
+
+def test_buffer_stays_bounded():
+    masker = StreamMasker(holdback=64, max_buffer=4096)
+    for _ in range(50):
+        masker.feed("word " * 400)
+    masker.finish()
+    assert masker.chars_in == 100000
+    assert masker.peak_buffer < 4096 + 2000
+
+
+def test_capitalised_runs_do_not_backtrack():
+    start = time.perf_counter()
+    smart_mask("Acme " * 40 + "x" + "\nrevenue Q3 " * 5, "notes.txt")
+    assert time.perf_counter() - start < 2
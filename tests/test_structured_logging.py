@@ -0,0 +1,54 @@
+import json
+import logging
+import queue
+
+from services.structured_logging import (
+    DroppingQueueHandler, PromptRingBuffer, SamplingFilter, StructuredFormatter
+)
+
+
+def record(message: str, level: int = logging.INFO, **extra) -> logging.LogRecord:
+    log_record = logging.LogRecord("gateway", level, __file__, 1, message, (), None)
+    for key, value in extra.items():
+        setattr(log_record, key, value)
+    return log_record
+
+
+def test_json_lines_carry_fields_and_cap_long_values():
+    formatter = StructuredFormatter("json", max_field_chars=16)
+    line = json.loads(formatter.format(record("Request logged", event="request",
+                                              fields={"status": 200, "path": "/proxy/chat/completions"})))
+    assert line["msg"] == "Request logged" and line["event"] == "request" and line["status"] == 200
+    assert line["path"] == "/proxy/chat/comp...(+7 chars)"
+
+
+def test_text_lines_are_message_then_key_values():
+    line = StructuredFormatter("text").format(record("Response logged", fields={"status_code": 200}))
+    assert line == "INFO:gateway:Response logged status_code=200"
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(record("first"))
+    handler.handle(record("second"))
+    assert handler.queue.qsize() == 1 and handler.dropped == 1
+
+
+def test_sampling_never_drops_warnings():
+    sampling = SamplingFilter({"request": 0.0})
+    assert not sampling.filter(record("Request logged", event="request"))
+    assert sampling.filter(record("Upstream failed", logging.WARNING, event="request"))
+    assert sampling.filter(record("Response logged", event="response"))
+
+
+def test_prompt_capture_is_bounded_and_newest_first():
+    capture = PromptRingBuffer(enabled=True, size=2, max_chars=4)
+    for prompt in ("first", "second", "third"):
+        capture.capture(prompt, target="openai")
+    entries = capture.recent()
+    assert [entry["prompt"] for entry in entries] == ["thir", "seco"]
+    assert entries[0]["truncated"] and entries[0]["length"] == 5 and entries[0]["target"] == "openai"
+
+    PromptRingBuffer(enabled=False).capture("ignored")
+    capture.clear()
+    assert capture.recent() == []
@@ -0,0 +1,147 @@
+from services.token_budget import RESPONSE_RESERVE_TOKENS, TokenBudget, estimate_tokens, truncate_to_tokens
+
+
+def test_estimate_counts_words_or_characters():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a b c d") == 4
+    assert estimate_tokens("x" * 400) == 100
+
+
+def test_truncation_keeps_both_ends():
+    text = "start " + "word " * 2000 + "end"
+    truncated = truncate_to_tokens(text, 200)
+    assert truncated.startswith("start ")
+    assert truncated.endswith("end")
+    assert "characters truncated" in truncated
+    assert estimate_tokens(truncated) <= 220
+
+
+def test_budget_is_looked_up_by_full_or_bare_model_name():
+    budget = TokenBudget(enabled=True, default_budget=16000, model_budgets={"gpt-4": 8000})
+    assert budget.budget_for("gpt-4") == 8000
+    assert budget.budget_for("openai/gpt-4") == 8000
+    assert budget.budget_for("some/unknown-model") == 16000
+
+
+def test_oldest_turns_are_dropped_before_truncating():
+    long = "word " * 2000
+    messages = [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": long},
+        {"role": "assistant", "content": long},
+        {"role": "user", "content": "and now?"}
+    ]
+    kept, report = TokenBudget(enabled=True, default_budget=3000).compact_messages(messages, "local/model")
+    assert kept == [messages[0], messages[3]]
+    assert report["dropped_messages"] == 2
+    assert report["truncated"] is False
+    assert report["after"] <= 3000
+
+
+def test_latest_message_is_truncated_when_nothing_else_can_go():
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "word " * 5000}]
+    budget = TokenBudget(enabled=True, default_budget=1000)
+    kept, report = budget.compact_messages(messages, "local/model")
+    assert len(kept) == 2
+    assert report["truncated"] is True
+    assert report["after"] <= 1000
+    assert budget.get_stats()["tokens_saved"] == report["before"] - report["after"]
+
+
+def test_disabled_budget_leaves_messages_alone():
+    messages = [{"role": "user", "content": "word " * 5000}]
+    kept, report = TokenBudget(enabled=False, default_budget=100).compact_messages(messages, "gpt-4")
+    assert kept is messages
+    assert report["after"] == report["before"]
+
+
+def test_back_to_back_repeats_collapse_when_over_budget():
+    long = "word " * 2000
+    messages = [
+        {"role": "user", "content": "ping"},
+        {"role": "assistant", "content": "pong"},
+        {"role": "user", "content": long},
+        {"role": "user", "content": long}
+    ]
+    kept, report = TokenBudget(enabled=True, default_budget=3000).compact_messages(messages, "local/model")
+    assert kept == messages[:3]
+    assert report["deduplicated"] == 1
+    assert report["dropped_messages"] == 0
+
+
+def test_stream_truncator_keeps_head_and_tail():
+    truncator = TokenBudget(enabled=True, default_budget=312).stream_truncator("local/model")
+    text = "".join(f"line {i} of the upload\n" for i in range(2000))
+    out = "".join(truncator.feed(text[start:start + 500]) for start in range(0, len(text), 500))
+    out += truncator.finish()
+
+    assert truncator.truncated
+    assert out.startswith("line 0 of the upload\n")
+    assert out.endswith("line 1999 of the upload\n")
+    assert "characters truncated" in out
+    assert estimate_tokens(out) <= 340
+
+
+def test_stream_truncator_passes_short_text_through():
+    truncator = TokenBudget(enabled=True, default_budget=1000).stream_truncator("local/model")
+    assert truncator.feed("short prompt") == "short prompt"
+    assert truncator.finish() == ""
+    assert not truncator.truncated
+
+
+def test_off_by_default():
+    messages = [{"role": "user", "content": "word " * 50000}]
+    kept, report = TokenBudget().compact_messages(messages, "gpt-4")
+    assert kept == messages
+    assert report["compacted"] is False
+
+
+def test_budget_follows_the_model_context_window():
+    budget = TokenBudget(enabled=True, default_budget=16000, model_budgets={"gpt-3.5-turbo": 4000})
+    assert budget.budget_for("anthropic/claude-3-haiku") == 200000 - RESPONSE_RESERVE_TOKENS
+    assert budget.budget_for("openai/gpt-4") == 8192 - RESPONSE_RESERVE_TOKENS
+    assert budget.budget_for("gpt-3.5-turbo") == 4000
+    assert budget.budget_for("some/unknown-model") == 16000
+
+
+def test_report_flags_dropped_content():
+    budget = TokenBudget(enabled=True)
+    large = [{"role": "user", "content": "word " * 50000}]
+    _, report = budget.compact_messages(large, "anthropic/claude-3-haiku")
+    assert report["compacted"] is False
+
+    _, report = budget.compact_messages(large, "gpt-4")
+    assert report["compacted"] is True and report["truncated"] is True
+
+    repeated = [{"role": "user", "content": "word " * 4000}, {"role": "user", "content": "word " * 4000}]
+    _, report = budget.compact_messages(repeated, "gpt-4")
+    assert report["compacted"] is True and report["deduplicated"] == 1
+
+
+def test_prompt_within_budget_is_untouched():
+    messages = [
+        {"role": "user", "content": "Delete the temp files?"},
+        {"role": "assistant", "content": "Shall I delete them?"},
+        {"role": "user", "content": "yes"},
+        {"role": "assistant", "content": "Also the logs?"},
+        {"role": "user", "content": "yes"}
+    ]
+    kept, report = TokenBudget(enabled=True).compact_messages(messages, "gpt-4")
+    assert kept == messages
+    assert report["compacted"] is False
+
+
+def test_turns_are_dropped_with_their_replies():
+    long = "word " * 2000
+    messages = [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": long},
+        {"role": "assistant", "content": long},
+        {"role": "user", "content": "yes"},
+        {"role": "assistant", "content": long},
+        {"role": "user", "content": "yes"}
+    ]
+    kept, report = TokenBudget(enabled=True, model_budgets={"gpt-4": 4000}).compact_messages(messages, "gpt-4")
+    assert [message["role"] for message in kept] == ["system", "user", "assistant", "user"]
+    assert [message["content"] for message in kept[1::2]] == ["yes", "yes"]
+    assert report["dropped_messages"] == 2 and report["deduplicated"] == 0
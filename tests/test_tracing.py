@@ -0,0 +1,75 @@
+import json
+import logging
+
+from services.structured_logging import RequestIdFilter
+from services.tracing import IDS, NOOP_SPAN, Tracer, current_request_id, current_span, span, start_span
+
+
+def test_ids_are_unique_and_fixed_width():
+    ids = {IDS.trace_id() for _ in range(1000)}
+    assert len(ids) == 1000
+    assert all(len(trace_id) == 32 for trace_id in ids)
+    assert len(IDS.span_id()) == 16
+
+
+def test_spans_nest_under_the_current_span():
+    tracer = Tracer(enabled=True)
+    with tracer.trace("t1", "request", path="/chat") as root:
+        with span("security.checks"):
+            with span("cache.get") as lookup:
+                lookup.set(hit=False)
+        upstream = start_span("upstream")
+        upstream.finish()
+        root.set(status_code=200)
+
+    [record] = tracer.recent()
+    names = {s["name"]: s for s in record["spans"]}
+    assert list(names) == ["request", "security.checks", "cache.get", "upstream"]
+    assert names["cache.get"]["parent_id"] == names["security.checks"]["span_id"]
+    assert names["upstream"]["parent_id"] == names["request"]["span_id"]
+    assert names["cache.get"]["attributes"] == {"hit": False}
+    assert names["request"]["attributes"] == {"path": "/chat", "status_code": 200}
+    assert tracer.get("t1") is record
+    assert tracer.recent(min_duration_ms=60_000) == []
+    assert current_span.get() is None
+
+
+def test_unsampled_requests_record_nothing():
+    tracer = Tracer(enabled=True, sample_rate=0.0)
+    with tracer.trace("t2", "request") as root:
+        assert root is NOOP_SPAN
+        assert span("cache.get") is NOOP_SPAN
+    assert tracer.recent() == []
+    assert tracer.get_stats()["sampled"] == 0
+
+
+def test_errors_are_recorded_on_the_span():
+    tracer = Tracer(enabled=True)
+    try:
+        with tracer.trace("t3", "request"):
+            with span("upstream"):
+                raise TimeoutError()
+    except TimeoutError:
+        pass
+    assert tracer.get("t3")["spans"][1]["attributes"] == {"error": "TimeoutError"}
+
+
+def test_file_export_writes_one_trace_per_line(tmp_path):
+    tracer = Tracer(enabled=True, export="file", path=str(tmp_path / "traces.ndjson"))
+    for trace_id in ("a", "b"):
+        with tracer.trace(trace_id, "request"):
+            pass
+    tracer.stop()
+    with open(tracer.path) as f:
+        assert [json.loads(line)["trace_id"] for line in f] == ["a", "b"]
+    assert tracer.ring is None
+
+
+def test_log_records_carry_the_request_id():
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", None, None)
+    token = current_request_id.set("abc123")
+    try:
+        RequestIdFilter().filter(record)
+    finally:
+        current_request_id.reset(token)
+    assert record.request_id == "abc123"
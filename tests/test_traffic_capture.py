@@ -0,0 +1,110 @@
+import gzip
+import json
+import os
+import sys
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from middleware.traffic_capture import TrafficCaptureMiddleware, scrub_query
+from services.traffic_capture import TrafficRecorder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+import replay  # noqa: E402
+
+
+def capture_app(recorder: TrafficRecorder) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/proxy/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        masked = [dict(message, content=message["content"].replace("jane@example.com", "[EMAIL]"))
+                  for message in body["messages"]]
+        if getattr(request.state, "capture", False):
+            request.state.capture_shape = recorder.chat_shape(body, masked)
+        return {"ok": True}
+
+    app.add_middleware(TrafficCaptureMiddleware, recorder=recorder)
+    return app
+
+
+def read_capture(path: str):
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_shape_mode_records_sizes_not_text(tmp_path):
+    recorder = TrafficRecorder(enabled=True, path=str(tmp_path / "capture.ndjson.gz"))
+    body = {"model": "gpt-4", "messages": [{"role": "user", "content": "mail jane@example.com"}], "max_tokens": 5}
+    TestClient(capture_app(recorder)).post("/proxy/chat", json=body)
+    recorder.stop()
+
+    [entry] = read_capture(recorder.path)
+    assert entry["route"] == "/proxy/chat"
+    assert entry["status"] == 200
+    assert entry["shape"] == {"model": "gpt-4", "stream": False, "max_tokens": 5,
+                              "messages": [{"role": "user", "length": len("mail [EMAIL]")}]}
+    assert recorder.get_stats()["recorded"] == 1
+
+
+def test_masked_mode_never_keeps_raw_text(tmp_path):
+    recorder = TrafficRecorder(enabled=True, path=str(tmp_path / "capture.ndjson.gz"), content="masked")
+    body = {"model": "gpt-4", "messages": [{"role": "user", "content": "mail jane@example.com"}]}
+    TestClient(capture_app(recorder)).post("/proxy/chat", json=body)
+    recorder.stop()
+
+    [entry] = read_capture(recorder.path)
+    assert entry["shape"]["messages"][0]["content"] == "mail [EMAIL]"
+    assert "jane@example.com" not in json.dumps(entry)
+
+
+def test_unsampled_requests_are_not_recorded(tmp_path):
+    recorder = TrafficRecorder(enabled=True, path=str(tmp_path / "capture.ndjson.gz"), sample_rate=0.0)
+    TestClient(capture_app(recorder)).post("/proxy/chat", json={"model": "gpt-4", "messages": []})
+    recorder.stop()
+    assert read_capture(recorder.path) == []
+
+
+def test_replay_rebuilds_requests_of_the_captured_size(tmp_path):
+    recorder = TrafficRecorder(enabled=True, path=str(tmp_path / "capture.ndjson.gz"))
+    body = {"model": "gpt-4", "messages": [{"role": "system", "content": "x" * 40},
+                                           {"role": "user", "content": "y" * 900}]}
+    TestClient(capture_app(recorder)).post("/proxy/chat?target=openai", json=body)
+    recorder.stop()
+
+    [entry] = replay.load_capture([recorder.path])
+    request = replay.build_request(entry)
+    assert request["method"] == "POST"
+    assert request["url"] == "/proxy/chat?target=openai"
+    assert [message["role"] for message in request["json"]["messages"]] == ["system", "user"]
+    assert [len(message["content"]) for message in request["json"]["messages"]] == [40, 900]
+
+
+def test_replay_merges_per_worker_captures_by_time(tmp_path):
+    paths = []
+    for worker, timestamps in (("101", [1.0, 3.0]), ("102", [2.0])):
+        path = str(tmp_path / f"capture.{worker}.ndjson.gz")
+        with gzip.open(path, "wt") as f:
+            for ts in timestamps:
+                f.write(json.dumps({"ts": ts, "path": "/chat"}) + "\n")
+        paths.append(path)
+    assert [entry["ts"] for entry in replay.load_capture(paths)] == [1.0, 2.0, 3.0]
+
+
+def test_credentials_are_not_captured(tmp_path):
+    recorder = TrafficRecorder(enabled=True, path=str(tmp_path / "capture.ndjson.gz"))
+    TestClient(capture_app(recorder)).post("/proxy/chat?target=openai&api_key=sk-live-secret",
+                                           json={"model": "gpt-4", "messages": []})
+    recorder.stop()
+
+    [entry] = read_capture(recorder.path)
+    assert entry["query"] == "target=openai"
+    assert "sk-live-secret" not in json.dumps(entry)
+    assert replay.build_request(entry)["url"] == "/proxy/chat?target=openai"
+
+
+def test_scrub_query_drops_only_credential_params():
+    assert scrub_query(b"target=openai&limit=5") == "target=openai&limit=5"
+    assert scrub_query(b"API_KEY=a&Token=b&password=c&target=x") == "target=x"
+    assert scrub_query(b"monkey=1") == "monkey=1"
@@ -0,0 +1,53 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from services.upload import StreamingUpload, masked_prompt
+
+
+def make_client(max_bytes: int = 1_000_000) -> TestClient:
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        stream = StreamingUpload(request, max_bytes=max_bytes)
+        text = "".join([piece async for piece in stream.pieces()])
+        return {"text": text, "filename": stream.filename, "bytes": stream.bytes_received}
+
+    @app.post("/prompt")
+    async def prompt(request: Request):
+        report = {}
+        pieces = [piece async for piece in masked_prompt(StreamingUpload(request), None, False, "gpt-4", report)]
+        return {"prompt": "".join(pieces), "report": report}
+
+    return TestClient(app)
+
+
+def test_raw_body_is_decoded_as_utf8():
+    response = make_client().post("/upload", content="naïve café\n".encode() * 3)
+    assert response.json()["text"] == "naïve café\n" * 3
+    assert response.json()["filename"] is None
+
+
+def test_multipart_upload_uses_the_file_part():
+    response = make_client().post("/upload", data={"note": "ignored"},
+                                  files={"file": ("report.py", b"print('hi')\n", "text/x-python")})
+    assert response.json()["text"] == "print('hi')\n"
+    assert response.json()["filename"] == "report.py"
+
+
+def test_multipart_without_a_file_is_rejected():
+    response = make_client().post("/upload", files={"note": (None, b"just a field")})
+    assert response.status_code == 400
+
+
+def test_oversized_upload_is_rejected():
+    assert make_client(max_bytes=100).post("/upload", content=b"x" * 1000).status_code == 413
+
+
+def test_personal_mode_prompt_keeps_the_text():
+    response = make_client().post("/prompt", files={"file": ("notes.txt", b"plain notes\n")})
+    body = response.json()
+    assert body["prompt"].endswith("plain notes\n")
+    assert "PERSONAL MODE" in body["prompt"]
+    assert body["report"]["filename"] == "notes.txt"
+    assert body["report"]["original_length"] == len("plain notes\n")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Manage the gateway's API keys
+
+    python tools/api_keys.py create ci-runner --allowed-paths /chat,/proxy/ --rate-limit 60
+    python tools/api_keys.py list
+    python tools/api_keys.py update <id> --rate-limit 120
+    python tools/api_keys.py revoke <id>
+
+Keys live as salted hashes in API_KEY_DB_PATH (or --db) and are enforced
+when the gateway runs with API_KEY_STORE_ENABLED=true. A running gateway
+picks changes up within API_KEY_RELOAD_INTERVAL seconds, without a
+restart. create prints the new key; it cannot be recovered later.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from config import API_KEY_DB_PATH
+from services.api_keys import APIKeyStore
+
+
+def permissions_from(args):
+    if args.allowed_paths is None:
+        return None
+    return {"allowed_paths": [prefix for prefix in args.allowed_paths.split(",") if prefix]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, list, update and revoke gateway API keys")
+    parser.add_argument("--db", default=API_KEY_DB_PATH, help="Key database (default: API_KEY_DB_PATH)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="Create a key and print it")
+    create.add_argument("name")
+    create.add_argument("--allowed-paths", help="Comma-separated path prefixes the key may call (default: any)")
+    create.add_argument("--rate-limit", type=int, help="Requests per minute (default: no per-key limit)")
+
+    listing = commands.add_parser("list", help="List keys (never the keys themselves)")
+    listing.add_argument("--all", action="store_true", help="Include revoked keys")
+
+    update = commands.add_parser("update", help="Change a key's permissions or rate limit")
+    update.add_argument("id")
+    update.add_argument("--allowed-paths", help="Comma-separated path prefixes; empty string for none")
+    update.add_argument("--rate-limit", type=int, help="Requests per minute; 0 removes the limit")
+
+    revoke = commands.add_parser("revoke", help="Revoke a key")
+    revoke.add_argument("id")
+
+    args = parser.parse_args()
+    store = APIKeyStore(args.db)
+
+    if args.command == "create":
+        print(store.create(args.name, permissions_from(args), args.rate_limit))
+    elif args.command == "list":
+        print(json.dumps(store.list(include_revoked=args.all), indent=2))
+    elif args.command == "update":
+        rate_limit = args.rate_limit or None
+        if not store.update(args.id, permissions_from(args), rate_limit, clear_rate_limit=args.rate_limit == 0):
+            sys.exit(f"No API key with id {args.id}")
+        print(json.dumps(store.get(args.id), indent=2))
+    elif args.command == "revoke":
+        if not store.revoke(args.id):
+            sys.exit(f"No active API key with id {args.id}")
+        print(f"Revoked {args.id}")
+
+
+if __name__ == "__main__":
+    main()
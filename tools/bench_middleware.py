@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Per-request overhead of SecurityMiddleware, measured in process
+
+    python tools/bench_middleware.py --requests 20000 --baseline HEAD~1
+
+Requests are driven straight through the ASGI interface (no sockets) into
+a trivial app, once bare and once behind the middleware, so the difference
+is the middleware alone. "plain" returns a small JSON body, "stream" sends
+the body in --chunks pieces; for it the time to the first body chunk is
+reported too, which shows whether the middleware lets streaming through.
+
+--baseline loads middleware/security.py from a git revision for a before
+and after comparison. A revision with the older call_next-style class is
+run under Starlette's BaseHTTPMiddleware, as that is how it would have to
+be mounted.
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import types
+from typing import Any, Callable, Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BODY = b'{"status":"healthy","service":"Secure AI Proxy Gateway"}'
+
+
+def make_app(chunks: int, chunk_delay: float):
+    async def plain(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(BODY)).encode())]})
+        await send({"type": "http.response.body", "body": BODY})
+
+    async def stream(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        for index in range(chunks):
+            if chunk_delay and index:
+                await asyncio.sleep(chunk_delay)
+            await send({"type": "http.response.body", "body": b"data: tok\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def app(scope, receive, send):
+        await (stream if scope["path"] == "/stream" else plain)(scope, receive, send)
+
+    return app
+
+
+def load_middleware(revision: str):
+    """
+    The SecurityMiddleware class at a git revision, or the working tree's for None
+    """
+    if revision is None:
+        from middleware.security import SecurityMiddleware
+        return SecurityMiddleware
+    source = subprocess.run(["git", "show", f"{revision}:middleware/security.py"], cwd=REPO_ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    module = types.ModuleType(f"security_{revision}")
+    exec(compile(source, f"{revision}:middleware/security.py", "exec"), module.__dict__)
+    return module.SecurityMiddleware
+
+
+def wrap(cls, app):
+    if len(inspect.signature(cls.__init__).parameters) > 1:
+        return cls(app)
+    # call_next style: the instance is the dispatch function
+    from starlette.middleware.base import BaseHTTPMiddleware
+    return BaseHTTPMiddleware(app, dispatch=cls())
+
+
+async def drive(app, path: str, requests: int, clients: int) -> Dict[str, float]:
+    """
+    Send requests one after another; returns mean microseconds per request and to the first body chunk
+    """
+    first_body = []
+
+    async def run_one(index: int):
+        sent = asyncio.Event()
+        started = time.perf_counter()
+        seen = [False]
+
+        async def receive():
+            if not sent.is_set():
+                sent.set()
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Never disconnects; anything listening for it is cancelled at the end
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.body" and not seen[0]:
+                seen[0] = True
+                first_body.append(time.perf_counter() - started)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": b"", "server": ("127.0.0.1", 8000),
+            # Spread over many client addresses so none trips the per-IP rate check
+            "client": (f"10.0.{index % clients // 250}.{index % 250}", 50000),
+            "headers": [(b"host", b"127.0.0.1:8000"), (b"user-agent", b"bench/1.0"),
+                        (b"authorization", b"Bearer bench-key"), (b"accept", b"*/*")]
+        }
+        await app(scope, receive, send)
+
+    start = time.perf_counter()
+    for index in range(requests):
+        await run_one(index)
+    elapsed = time.perf_counter() - start
+    return {
+        "us_per_request": elapsed / requests * 1e6,
+        "us_to_first_body": sum(first_body) / len(first_body) * 1e6
+    }
+
+
+def measure(label: str, factory: Callable[[Any], Any], args) -> Dict[str, Any]:
+    results = {"variant": label}
+    for scenario, path in (("plain", "/"), ("stream", "/stream")):
+        app = factory(make_app(args.chunks, args.chunk_delay_ms / 1000.0))
+        # Warm-up, then the best of a few rounds to damp scheduler noise
+        asyncio.run(drive(app, path, min(500, args.requests), args.clients))
+        rounds = [asyncio.run(drive(factory(make_app(args.chunks, args.chunk_delay_ms / 1000.0)), path,
+                                    args.requests, args.clients)) for _ in range(args.rounds)]
+        best = min(rounds, key=lambda r: r["us_per_request"])
+        results[f"{scenario}_us"] = round(best["us_per_request"], 1)
+        if scenario == "stream":
+            results["stream_first_body_us"] = round(best["us_to_first_body"], 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SecurityMiddleware per-request overhead")
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per round")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=5000, help="Distinct client addresses")
+    parser.add_argument("--chunks", type=int, default=20, help="Body chunks in the stream scenario")
+    parser.add_argument("--chunk-delay-ms", type=float, default=0.0, help="Pause between stream chunks")
+    parser.add_argument("--baseline", help="Git revision to compare against, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    # Measure the middleware, not the log pipeline
+    logging.disable(logging.INFO)
+
+    variants = [("bare", lambda app: app)]
+    if args.baseline:
+        baseline = load_middleware(args.baseline)
+        variants.append((f"security@{args.baseline}", lambda app: wrap(baseline, app)))
+    current = load_middleware(None)
+    variants.append(("security", lambda app: wrap(current, app)))
+
+    rows = [measure(label, factory, args) for label, factory in variants]
+    bare = rows[0]
+    for row in rows[1:]:
+        row["plain_overhead_us"] = round(row["plain_us"] - bare["plain_us"], 1)
+        row["stream_overhead_us"] = round(row["stream_us"] - bare["stream_us"], 1)
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Memory per retained request in SecurityMiddleware's security history
+
+    python tools/bench_request_log.py --requests 100000
+
+Fills the history with synthetic traffic (a few hundred client IPs, a
+handful of paths and user agents, some query strings) and measures the
+memory held per request with tracemalloc, for the per-request dicts the
+middleware used to keep and for services.request_log.RequestLog. As in the
+middleware, every request's strings are freshly decoded from bytes, so the
+dicts do not get to share them by accident.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from services.request_log import RequestLog
+
+PATHS = [b"/proxy/chat", b"/chat", b"/api/chat", b"/health", b"/proxy/status", b"/metrics",
+         b"/chat/upload", b"/jobs/chat", b"/proxy/v1/models", b"/"]
+USER_AGENTS = [b"python-httpx/0.28.1", b"curl/8.5.0", b"okhttp/4.12.0",
+               b"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36",
+               b"Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15"]
+QUERIES = [b"", b"", b"", b"", b"", b"", b"", b"", b"mask_response=true", b"limit=20&offset=40"]
+
+
+def traffic(requests: int, clients: int, seed: int) -> List[tuple]:
+    rng = random.Random(seed)
+    ips = [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}".encode() for i in range(clients)]
+    now = time.time()
+    return [(now + index * 0.01, rng.choice(ips), rng.choice((b"GET", b"POST")), rng.choice(PATHS),
+             rng.choice(USER_AGENTS), rng.choice(QUERIES), True) for index in range(requests)]
+
+
+def legacy(requests: List[tuple]) -> Callable[[], Any]:
+    """The dict per request the middleware kept before, in a bounded deque"""
+    def fill():
+        from collections import deque
+        logs = deque(maxlen=len(requests))
+        for timestamp, ip, method, path, user_agent, query, has_api_key in requests:
+            logs.append({
+                "timestamp": timestamp,
+                "ip": ip.decode("latin-1"),
+                "method": method.decode("latin-1"),
+                "path": path.decode("latin-1"),
+                "user_agent": user_agent.decode("latin-1"),
+                "has_api_key": has_api_key,
+                "query_string": query.decode("latin-1")
+            })
+        return logs
+    return fill
+
+
+def ring(requests: List[tuple]) -> Callable[[], Any]:
+    def fill():
+        log = RequestLog(len(requests))
+        for timestamp, ip, method, path, user_agent, query, has_api_key in requests:
+            seq = log.append(timestamp, ip.decode("latin-1"), method.decode("latin-1"), path.decode("latin-1"),
+                             user_agent.decode("latin-1"), query.decode("latin-1"), has_api_key)
+            log.complete(seq, 200, 0.012)
+        return log
+    return fill
+
+
+def measure(label: str, fill: Callable[[], Any], requests: int) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    kept = fill()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {
+        "variant": label,
+        "requests": requests,
+        "bytes_held": held,
+        "bytes_per_request": round(held / requests, 1),
+        # tracemalloc slows allocation down, so this is only good for comparing the two
+        "us_per_append_traced": round(elapsed / requests * 1e6, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure security history memory per retained request")
+    parser.add_argument("--requests", type=int, default=100000, help="Requests retained (the log capacity)")
+    parser.add_argument("--clients", type=int, default=500, help="Distinct client IPs")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    requests = traffic(args.requests, args.clients, args.seed)
+    rows = [measure("dict per request", legacy(requests), args.requests),
+            measure("RequestLog", ring(requests), args.requests)]
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
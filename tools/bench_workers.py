@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Startup time and memory of serve.py for different worker counts
+
+    python tools/bench_workers.py --workers 1,4,16
+
+For each worker count the server is started with and without preloading.
+Startup is the time from launching the master until every worker accepts
+connections. Memory is read from /proc after a few requests: summed RSS
+counts pages shared copy-on-write once per worker, summed PSS is the
+real footprint and private is what each worker owns alone.
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(workers: int, preload: bool, args) -> Dict[str, Any]:
+    command = [sys.executable, os.path.join(REPO_ROOT, "serve.py"), "--app", args.app,
+               "--workers", str(workers), "--port", str(args.port), "--stats-port", str(args.stats_port),
+               "--log-level", "warning"]
+    if not preload:
+        command.append("--no-preload")
+    env = dict(os.environ, LOG_LEVEL="WARNING", TRAFFIC_CAPTURE_ENABLED="false")
+
+    start = time.perf_counter()
+    master = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    try:
+        # The stats endpoint comes up once every worker has reported ready
+        deadline = time.monotonic() + args.timeout
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{args.stats_port}/workers", timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if master.poll() is not None or time.monotonic() > deadline:
+                raise SystemExit(f"serve.py with {workers} worker(s) did not start")
+            time.sleep(0.02)
+        startup = time.perf_counter() - start
+
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}") as client:
+            for _ in range(args.requests):
+                client.get("/health")
+        time.sleep(0.5)
+        stats = httpx.get(f"http://127.0.0.1:{args.stats_port}/workers").json()
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+
+    count = max(1, len(stats["workers"]))
+    return {
+        "workers": workers,
+        "preload": preload,
+        "startup_s": round(startup, 2),
+        "master_rss_mb": stats["master"].get("rss_mb"),
+        "workers_rss_mb": stats["totals"]["rss_mb"],
+        "total_pss_mb": round(stats["totals"]["pss_mb"] + stats["master"].get("pss_mb", 0), 1),
+        "private_per_worker_mb": round(stats["totals"]["private_mb"] / count, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serve.py startup and memory per worker count")
+    parser.add_argument("--workers", default="1,4,16", help="Comma-separated worker counts")
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--port", type=int, default=8110)
+    parser.add_argument("--stats-port", type=int, default=8111)
+    parser.add_argument("--requests", type=int, default=50, help="Requests sent before memory is read")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json-out")
+    args = parser.parse_args()
+
+    results = []
+    for workers in [int(count) for count in args.workers.split(",")]:
+        for preload in (True, False):
+            results.append(measure(workers, preload, args))
+
+    print(f"{'workers':>8}{'preload':>9}{'startup s':>11}{'master RSS':>12}{'workers RSS':>13}"
+          f"{'total PSS':>11}{'private/worker':>16}")
+    for row in results:
+        print(f"{row['workers']:>8}{'yes' if row['preload'] else 'no':>9}{row['startup_s']:>11}"
+              f"{row['master_rss_mb']:>12}{row['workers_rss_mb']:>13}{row['total_pss_mb']:>11}"
+              f"{row['private_per_worker_mb']:>16}")
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Load generator for the gateway, runnable fully offline against stub upstreams
+
+Drives /chat, /proxy/chat and /proxy/{path} either at a fixed arrival
+rate (--rps, open loop) or with a fixed number of concurrent clients
+(--concurrency, closed loop), then reports latency percentiles,
+throughput, error rates and the gateway's CPU and RSS.
+
+With --spawn it starts two stub upstreams and the gateway itself on
+local ports, so a release check is a single command:
+
+    python tools/load_test.py --spawn --scenario chat,proxy-chat,proxy-path \\
+        --concurrency 32 --duration 30 --max-p99-ms 500 --max-error-rate 0.01
+
+Against an already running gateway, pass --url and (for CPU/RSS) --pid.
+The exit status is 1 when any --max-*/--min-* threshold is violated.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("chat", "proxy-chat", "proxy-chat-stream", "proxy-path")
+
+SAMPLE_TEXT = (
+    "Please review this function. Contact john.doe@example.com or call 555-123-4567 if it fails.\n"
+    "def charge(card_number, amount):\n"
+    "    api_key = 'sk-test-1234567890abcdef'\n"
+    "    return gateway.charge(card_number, amount)\n"
+)
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ScenarioStats:
+    """
+    Latencies and outcomes for one scenario
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+
+    def record(self, status: str, latency: float, ok: bool):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+            "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+            "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+            "statuses": self.statuses
+        }
+
+
+class ProcessSampler:
+    """
+    Samples CPU and RSS of a process and its children from /proc
+    """
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_samples: List[float] = []
+        self.rss_samples: List[float] = []
+        self._ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def _tree(self) -> List[int]:
+        pids = [self.pid]
+        try:
+            entries = [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+        except OSError:
+            return pids
+        parents = {}
+        for pid in entries:
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    parents[pid] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+        frontier = [self.pid]
+        while frontier:
+            parent = frontier.pop()
+            children = [pid for pid, ppid in parents.items() if ppid == parent]
+            pids.extend(children)
+            frontier.extend(children)
+        return pids
+
+    def _read(self):
+        cpu_ticks = 0
+        rss_pages = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu_ticks += int(fields[11]) + int(fields[12])
+                with open(f"/proc/{pid}/statm") as f:
+                    rss_pages += int(f.read().split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+        return cpu_ticks / self._ticks, rss_pages * self._page_size
+
+    async def run(self, stop: asyncio.Event):
+        last_cpu, _ = self._read()
+        last_time = time.monotonic()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            cpu, rss = self._read()
+            now = time.monotonic()
+            if now > last_time:
+                self.cpu_samples.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss_samples.append(rss / (1024 * 1024))
+            last_cpu, last_time = cpu, now
+
+    def report(self) -> Dict[str, Any]:
+        if not self.rss_samples:
+            return {}
+        return {
+            "pid": self.pid,
+            "cpu_percent_avg": round(sum(self.cpu_samples) / len(self.cpu_samples), 1) if self.cpu_samples else 0.0,
+            "cpu_percent_max": round(max(self.cpu_samples), 1) if self.cpu_samples else 0.0,
+            "rss_mb_avg": round(sum(self.rss_samples) / len(self.rss_samples), 1),
+            "rss_mb_max": round(max(self.rss_samples), 1)
+        }
+
+
+def build_request(scenario: str, args) -> Dict[str, Any]:
+    """
+    Method, path and body for one request of a scenario
+    """
+    if scenario == "chat":
+        return {"method": "POST", "path": "/chat",
+                "json": {"message": SAMPLE_TEXT, "filename": "payment.py"}}
+    if scenario in ("proxy-chat", "proxy-chat-stream"):
+        body = {
+            "model": args.model,
+            "messages": [{"role": "user", "content": SAMPLE_TEXT}],
+            "stream": scenario == "proxy-chat-stream"
+        }
+        if args.target:
+            body["target"] = args.target
+        return {"method": "POST", "path": "/proxy/chat", "json": body}
+    return {"method": "GET", "path": f"/proxy/{args.proxy_path}", "params": {"target": args.target or "openrouter"}}
+
+
+async def send_one(client: httpx.AsyncClient, scenario: str, args, stats: Dict[str, ScenarioStats]):
+    spec = build_request(scenario, args)
+    start = time.perf_counter()
+    try:
+        head = b""
+        async with client.stream(spec["method"], spec["path"], json=spec.get("json"),
+                                 params=spec.get("params")) as response:
+            async for chunk in response.aiter_bytes():
+                if len(head) < 64:
+                    head += chunk
+        status = str(response.status_code)
+        ok = response.status_code < 400
+        if ok and scenario == "chat" and head.startswith(b'{"proxy_response":null'):
+            # /chat reports upstream failures in the body with a 200 status
+            status = "200-error"
+            ok = False
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+        ok = False
+    stats[scenario].record(status, time.perf_counter() - start, ok)
+
+
+async def run_load(args) -> Dict[str, Any]:
+    scenarios = [name.strip() for name in args.scenario.split(",") if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+
+    stats = {name: ScenarioStats(name) for name in scenarios}
+    headers = {"Authorization": f"Bearer {args.api_key}", "User-Agent": "gateway-load-test"}
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    stop_sampling = asyncio.Event()
+    sampler = ProcessSampler(args.pid) if args.pid else None
+    sampler_task = asyncio.create_task(sampler.run(stop_sampling)) if sampler else None
+
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits,
+                                 timeout=args.timeout) as client:
+        if args.warmup > 0:
+            warmup_stats = {name: ScenarioStats(name) for name in scenarios}
+            warmup_end = time.monotonic() + args.warmup
+            while time.monotonic() < warmup_end:
+                await send_one(client, random.choice(scenarios), args, warmup_stats)
+
+        start = time.monotonic()
+        deadline = start + args.duration
+        in_flight = asyncio.Semaphore(args.max_in_flight)
+        tasks = set()
+
+        async def guarded(scenario: str):
+            try:
+                await send_one(client, scenario, args, stats)
+            finally:
+                in_flight.release()
+
+        if args.rps:
+            # Open loop: arrivals follow a Poisson process at the target rate
+            next_arrival = start
+            while next_arrival < deadline:
+                delay = next_arrival - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await in_flight.acquire()
+                task = asyncio.create_task(guarded(random.choice(scenarios)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_arrival += random.expovariate(args.rps)
+            if tasks:
+                await asyncio.gather(*tasks)
+        else:
+            async def client_loop():
+                while time.monotonic() < deadline:
+                    await send_one(client, random.choice(scenarios), args, stats)
+
+            await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+        elapsed = time.monotonic() - start
+
+    stop_sampling.set()
+    if sampler_task is not None:
+        await sampler_task
+
+    total = ScenarioStats("total")
+    for scenario_stats in stats.values():
+        total.latencies.extend(scenario_stats.latencies)
+        total.errors += scenario_stats.errors
+        for status, count in scenario_stats.statuses.items():
+            total.statuses[status] = total.statuses.get(status, 0) + count
+
+    return {
+        "mode": f"open loop at {args.rps} rps" if args.rps else f"closed loop with {args.concurrency} clients",
+        "duration_s": round(elapsed, 2),
+        "scenarios": {name: scenario_stats.report(elapsed) for name, scenario_stats in stats.items()},
+        "total": total.report(elapsed),
+        "gateway": sampler.report() if sampler else {}
+    }
+
+
+def check_thresholds(report: Dict[str, Any], args) -> List[str]:
+    total = report["total"]
+    failures = []
+    if args.max_p99_ms is not None and total["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {total['p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.max_error_rate is not None and total["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {total['error_rate']} > {args.max_error_rate}")
+    if args.min_rps is not None and total["throughput_rps"] < args.min_rps:
+        failures.append(f"throughput {total['throughput_rps']} rps < {args.min_rps} rps")
+    rss = report["gateway"].get("rss_mb_max")
+    if args.max_rss_mb is not None and rss is not None and rss > args.max_rss_mb:
+        failures.append(f"RSS {rss} MB > {args.max_rss_mb} MB")
+    return failures
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n{report['mode']}, {report['duration_s']} s")
+    print(f"{'scenario':<20}{'reqs':>8}{'rps':>9}{'err%':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    rows = list(report["scenarios"].items()) + [("total", report["total"])]
+    for name, row in rows:
+        print(f"{name:<20}{row['requests']:>8}{row['throughput_rps']:>9}{row['error_rate'] * 100:>7.2f}%"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['max_ms']:>9}")
+    print(f"statuses: {report['total']['statuses']}")
+    if report["gateway"]:
+        gateway = report["gateway"]
+        print(f"gateway pid {gateway['pid']}: CPU avg {gateway['cpu_percent_avg']}% max {gateway['cpu_percent_max']}%, "
+              f"RSS avg {gateway['rss_mb_avg']} MB max {gateway['rss_mb_max']} MB")
+
+
+def _wait_for(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def spawn_stack(args) -> List[subprocess.Popen]:
+    """
+    Start two stub upstreams and the gateway; returns the processes (gateway last)
+    """
+    stub = os.path.join(REPO_ROOT, "tools", "stub_upstream.py")
+    stub_args = ["--latency-ms", str(args.stub_latency_ms), "--jitter-ms", str(args.stub_jitter_ms),
+                 "--latency-dist", args.stub_latency_dist, "--error-rate", str(args.stub_error_rate)]
+    processes = []
+    for port in (args.stub_port, args.stub_port + 1):
+        processes.append(subprocess.Popen([sys.executable, stub, "--port", str(port)] + stub_args))
+    for port in (args.stub_port, args.stub_port + 1):
+        _wait_for(f"http://127.0.0.1:{port}/_stub/config")
+
+    env = dict(os.environ)
+    env.update({
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.stub_port}/v1",
+        "OPENROUTER_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.stub_port + 1}/v1",
+        "OPENAI_API_KEY": "stub",
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{args.stub_port + 1}/v1",
+        "ANTHROPIC_API_KEY": "stub",
+        # The default limits of 60/min and 1000/h would turn most of the load into 429s
+        "RATE_LIMIT_PER_MINUTE": env.get("RATE_LIMIT_PER_MINUTE", "100000000"),
+        "RATE_LIMIT_PER_HOUR": env.get("RATE_LIMIT_PER_HOUR", "100000000"),
+        # Likewise SecurityMiddleware, which would block 127.0.0.1 after 100
+        # requests in a minute, for the rest of the run
+        "SECURITY_MAX_REQUESTS_PER_MINUTE": env.get("SECURITY_MAX_REQUESTS_PER_MINUTE", "100000000"),
+        "SECURITY_BLOCK_TTL": env.get("SECURITY_BLOCK_TTL", "1"),
+        # Never record the synthetic traffic over a real capture
+        "TRAFFIC_CAPTURE_ENABLED": "false",
+    })
+    gateway = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.gateway_port), "--log-level", "warning"],
+        cwd=getattr(args, "gateway_dir", None) or REPO_ROOT, env=env
+    )
+    processes.append(gateway)
+    args.url = f"http://127.0.0.1:{args.gateway_port}"
+    args.pid = gateway.pid
+    _wait_for(f"{args.url}/health")
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway load generator")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Gateway base URL")
+    parser.add_argument("--pid", type=int, help="Gateway process id, for CPU/RSS sampling")
+    parser.add_argument("--scenario", default="proxy-chat", help=f"Comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("--rps", type=float, help="Target arrival rate (open loop)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients (closed loop)")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--api-key", default="load-test")
+    parser.add_argument("--model", default="anthropic/claude-3-haiku")
+    parser.add_argument("--target", help="Pin /proxy requests to one upstream")
+    parser.add_argument("--proxy-path", default="models", help="Path used by the proxy-path scenario")
+    parser.add_argument("--json-out", help="Also write the report as JSON to this file")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--max-error-rate", type=float)
+    parser.add_argument("--min-rps", type=float)
+    parser.add_argument("--max-rss-mb", type=float)
+    parser.add_argument("--spawn", action="store_true", help="Start stub upstreams and the gateway locally")
+    parser.add_argument("--gateway-port", type=int, default=8100)
+    parser.add_argument("--stub-port", type=int, default=9101)
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--stub-latency-dist", default="lognormal")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    processes = spawn_stack(args) if args.spawn else []
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        for process in reversed(processes):
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = check_thresholds(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Replay captured gateway traffic and compare two builds
+
+Capture is enabled on the gateway with TRAFFIC_CAPTURE_ENABLED=true. It
+writes post-masking request shapes and timings to TRAFFIC_CAPTURE_PATH.
+Replay that file against a build backed by stub upstreams:
+
+    python tools/replay.py run traffic_capture.ndjson.gz --spawn --out base.json
+    python tools/replay.py run traffic_capture.ndjson.gz --spawn --gateway-dir ../candidate --out candidate.json
+    python tools/replay.py diff base.json candidate.json --max-regression-pct 10
+
+A gateway started with serve.py --workers N writes one capture file per
+worker; pass them all and they are merged by timestamp.
+
+Requests keep their original inter-arrival times, divided by --speed;
+--speed 0 sends them as fast as --max-in-flight allows, which is the
+mode to use when comparing throughput. Shape-only captures are replayed
+with filler text of the recorded lengths.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import signal
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from load_test import SAMPLE_TEXT, ProcessSampler, ScenarioStats, spawn_stack
+
+
+def load_capture(paths: List[str]) -> List[Dict[str, Any]]:
+    entries = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entries.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # The gateway was killed mid-write; everything before the cut is still usable
+                pass
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries
+
+
+def _filler(length: int) -> str:
+    """
+    Text of the given length with the same mix of prose, PII and code as the load test sample
+    """
+    if length <= 0:
+        return ""
+    return (SAMPLE_TEXT * (length // len(SAMPLE_TEXT) + 1))[:length]
+
+
+def _messages(shape: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"role": message.get("role") or "user", "content": message.get("content", _filler(message.get("length", 0)))}
+        for message in shape.get("messages", [])
+    ]
+
+
+def _chat_body(shape: Dict[str, Any]) -> Dict[str, Any]:
+    body = {key: value for key, value in shape.items() if key != "messages"}
+    body["messages"] = _messages(shape)
+    return body
+
+
+def build_request(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild an HTTP request from a captured entry
+    """
+    route = entry.get("route")
+    shape = entry.get("shape") or {}
+    path = entry["path"] + (f"?{entry['query']}" if entry.get("query") else "")
+    request = {"method": entry["method"], "url": path}
+
+    if route == "/proxy/chat" and shape:
+        request["json"] = _chat_body(shape)
+    elif route == "/proxy/chat/batch" and shape:
+        request["json"] = {
+            "requests": [_chat_body(item) for item in shape.get("requests", [])],
+            "parallelism": shape.get("parallelism"),
+            "target": shape.get("target")
+        }
+    elif route == "/chat" and shape:
+        request["json"] = {
+            "message": shape.get("content", _filler(shape.get("length", 0))),
+            "filename": shape.get("filename", "user_code.py"),
+            "use_secure_filter": shape.get("use_secure_filter")
+        }
+    elif shape.get("body_length"):
+        request["json"] = {"input": _filler(max(0, shape["body_length"] - 12))}
+    return request
+
+
+async def replay(args) -> Dict[str, Any]:
+    entries = load_capture(args.capture)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        raise SystemExit("Capture file is empty")
+
+    stats: Dict[str, ScenarioStats] = {}
+    headers = {"Authorization": f"Bearer {args.api_key}", "User-Agent": "gateway-replay"}
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    stop_sampling = asyncio.Event()
+    sampler = ProcessSampler(args.pid) if args.pid else None
+    sampler_task = asyncio.create_task(sampler.run(stop_sampling)) if sampler else None
+
+    async def send(client: httpx.AsyncClient, entry: Dict[str, Any]):
+        route = entry.get("route", "unmatched")
+        request = build_request(entry)
+        start = time.perf_counter()
+        try:
+            async with client.stream(request["method"], request["url"], json=request.get("json")) as response:
+                async for _ in response.aiter_bytes():
+                    pass
+            status, ok = str(response.status_code), response.status_code < 400
+        except httpx.HTTPError as e:
+            status, ok = type(e).__name__, False
+        finally:
+            in_flight.release()
+        stats.setdefault(route, ScenarioStats(route)).record(status, time.perf_counter() - start, ok)
+
+    first_ts = entries[0]["ts"]
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=args.timeout) as client:
+        start = time.monotonic()
+        tasks = []
+        for entry in entries:
+            if args.speed > 0:
+                delay = start + (entry["ts"] - first_ts) / args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(send(client, entry)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+
+    stop_sampling.set()
+    if sampler_task is not None:
+        await sampler_task
+
+    # What the captured traffic saw in production, for reference
+    captured: Dict[str, ScenarioStats] = {}
+    for entry in entries:
+        route = entry.get("route", "unmatched")
+        captured.setdefault(route, ScenarioStats(route)).record(
+            str(entry.get("status")), entry.get("duration_ms", 0) / 1000.0, entry.get("status", 500) < 400
+        )
+    captured_span = max(entries[-1]["ts"] - first_ts, 0.001)
+
+    total = ScenarioStats("total")
+    for route_stats in stats.values():
+        total.latencies.extend(route_stats.latencies)
+        total.errors += route_stats.errors
+        for status, count in route_stats.statuses.items():
+            total.statuses[status] = total.statuses.get(status, 0) + count
+
+    return {
+        "capture": args.capture,
+        "url": args.url,
+        "speed": args.speed,
+        "requests": len(entries),
+        "duration_s": round(elapsed, 2),
+        "routes": {route: route_stats.report(elapsed) for route, route_stats in stats.items()},
+        "total": total.report(elapsed),
+        "captured": {route: route_stats.report(captured_span) for route, route_stats in captured.items()},
+        "gateway": sampler.report() if sampler else {}
+    }
+
+
+def _change(base: float, candidate: float) -> str:
+    if not base:
+        return "n/a"
+    return f"{(candidate - base) / base * 100:+.1f}%"
+
+
+def diff(args) -> int:
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    metrics = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "error_rate")
+    rows = [("total", base["total"], candidate["total"])]
+    for route in sorted(set(base["routes"]) | set(candidate["routes"])):
+        if route in base["routes"] and route in candidate["routes"]:
+            rows.append((route, base["routes"][route], candidate["routes"][route]))
+
+    print(f"{'route':<24}{'metric':<16}{'base':>12}{'candidate':>12}{'change':>10}")
+    regressions = []
+    for route, old, new in rows:
+        for metric in metrics:
+            print(f"{route:<24}{metric:<16}{old[metric]:>12}{new[metric]:>12}{_change(old[metric], new[metric]):>10}")
+            if args.max_regression_pct is None or not old[metric]:
+                continue
+            change = (new[metric] - old[metric]) / old[metric] * 100
+            worse = -change if metric == "throughput_rps" else change
+            if metric != "error_rate" and worse > args.max_regression_pct:
+                regressions.append(f"{route} {metric} {_change(old[metric], new[metric])}")
+        if args.max_regression_pct is not None and new["error_rate"] > old["error_rate"] + 0.01:
+            regressions.append(f"{route} error_rate {old['error_rate']} -> {new['error_rate']}")
+
+    gateway_old, gateway_new = base.get("gateway") or {}, candidate.get("gateway") or {}
+    for metric in ("cpu_percent_avg", "rss_mb_max"):
+        if metric in gateway_old and metric in gateway_new:
+            print(f"{'gateway':<24}{metric:<16}{gateway_old[metric]:>12}{gateway_new[metric]:>12}"
+                  f"{_change(gateway_old[metric], gateway_new[metric]):>10}")
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured gateway traffic and diff two builds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Replay a capture file against a gateway")
+    run.add_argument("capture", nargs="+", help="Capture file(s)")
+    run.add_argument("--url", default="http://127.0.0.1:8000")
+    run.add_argument("--pid", type=int, help="Gateway process id, for CPU/RSS sampling")
+    run.add_argument("--speed", type=float, default=1.0, help="Time compression factor; 0 sends as fast as possible")
+    run.add_argument("--limit", type=int, help="Replay only the first N requests")
+    run.add_argument("--max-in-flight", type=int, default=256)
+    run.add_argument("--timeout", type=float, default=60.0)
+    run.add_argument("--api-key", default="replay")
+    run.add_argument("--out", required=True, help="Write the results JSON here")
+    run.add_argument("--spawn", action="store_true", help="Start stub upstreams and the gateway locally")
+    run.add_argument("--gateway-dir", help="Checkout of the build to spawn (default: this one)")
+    run.add_argument("--gateway-port", type=int, default=8100)
+    run.add_argument("--stub-port", type=int, default=9101)
+    run.add_argument("--stub-latency-ms", type=float, default=50.0)
+    run.add_argument("--stub-jitter-ms", type=float, default=20.0)
+    run.add_argument("--stub-latency-dist", default="lognormal")
+    run.add_argument("--stub-error-rate", type=float, default=0.0)
+
+    compare = commands.add_parser("diff", help="Compare the results of two runs")
+    compare.add_argument("base")
+    compare.add_argument("candidate")
+    compare.add_argument("--max-regression-pct", type=float,
+                         help="Exit 1 if latency or throughput got worse by more than this")
+
+    args = parser.parse_args()
+    if args.command == "diff":
+        sys.exit(diff(args))
+
+    processes = spawn_stack(args) if args.spawn else []
+    try:
+        report = asyncio.run(replay(args))
+    finally:
+        for process in reversed(processes):
+            process.send_signal(signal.SIGINT)
+        for process in processes:
+            process.wait(timeout=10)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    total = report["total"]
+    print(f"Replayed {report['requests']} requests in {report['duration_s']} s: "
+          f"p50 {total['p50_ms']} ms, p99 {total['p99_ms']} ms, {total['throughput_rps']} rps, "
+          f"error rate {total['error_rate']}")
+
+
+if __name__ == "__main__":
+    main()
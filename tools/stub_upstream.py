@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local mock of an OpenAI-compatible upstream for routing, failover and load tests
+
+Run one per fake provider and point the gateway at them, e.g.:
+
+    python tools/stub_upstream.py --port 9101 --latency-ms 40
+    python tools/stub_upstream.py --port 9102 --latency-ms 300 --error-rate 0.3
+
+    OPENROUTER_BASE_URL=http://127.0.0.1:9101/v1 \\
+    OPENAI_BASE_URL=http://127.0.0.1:9102/v1 OPENAI_API_KEY=stub \\
+    uvicorn main:app
+
+Latency follows --latency-dist (fixed, uniform, normal, lognormal or
+exponential) around --latency-ms with a spread of --jitter-ms. Streams
+send --stream-tokens tokens after --ttft-ms at --tokens-per-sec.
+Failures can be injected as HTTP errors (--error-rate), hung requests
+(--timeout-rate) or streams cut off midway (--disconnect-rate).
+
+Everything can be changed at runtime with POST /_stub/config,
+e.g. {"latency_ms": 500, "error_rate": 1.0}, and GET /_stub/config
+returns the settings and request counters.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Stub AI Upstream")
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+settings = {
+    "latency_ms": 50.0,
+    "jitter_ms": 0.0,
+    "latency_dist": "uniform",
+    "error_rate": 0.0,
+    "error_status": 503,
+    "timeout_rate": 0.0,
+    "disconnect_rate": 0.0,
+    "ttft_ms": 0.0,
+    "tokens_per_sec": 200.0,
+    "stream_tokens": 5,
+    "response_tokens": 20,
+}
+stats = {"requests": 0, "errors": 0, "timeouts": 0, "disconnects": 0, "streams": 0}
+
+
+def _sample_latency_ms() -> float:
+    """
+    Draw one latency from the configured distribution
+    """
+    mean = settings["latency_ms"]
+    spread = settings["jitter_ms"]
+    dist = settings["latency_dist"]
+    if dist == "fixed" or (spread <= 0 and dist != "exponential"):
+        return mean
+    if dist == "uniform":
+        # Kept compatible with the original behaviour: latency plus up to jitter
+        return mean + random.uniform(0, spread)
+    if dist == "normal":
+        return max(0.0, random.gauss(mean, spread))
+    if dist == "lognormal":
+        # Median of latency_ms with a long right tail, as real upstreams have
+        sigma = math.log1p(spread / mean) if mean > 0 else 1.0
+        return random.lognormvariate(math.log(max(mean, 0.001)), sigma)
+    if dist == "exponential":
+        return random.expovariate(1.0 / mean) if mean > 0 else 0.0
+    return mean
+
+
+async def _inject_latency():
+    await asyncio.sleep(_sample_latency_ms() / 1000.0)
+
+
+async def _inject_failure():
+    """
+    Return an error response (or hang) if a failure is drawn, else None
+    """
+    if random.random() < settings["timeout_rate"]:
+        stats["timeouts"] += 1
+        await asyncio.sleep(3600)
+    if random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse(status_code=settings["error_status"], content={"error": "injected failure"})
+    return None
+
+
+def _completion(model: str, content: str, prompt_tokens: int) -> dict:
+    completion_tokens = settings["response_tokens"]
+    return {
+        "id": f"stub-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    await _inject_latency()
+
+    failure = await _inject_failure()
+    if failure is not None:
+        return failure
+
+    model = body.get("model", "stub")
+    prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in body.get("messages", []))
+    if not body.get("stream"):
+        content = " ".join(f"tok{i}" for i in range(settings["response_tokens"]))
+        return _completion(model, content, prompt_tokens)
+
+    stats["streams"] += 1
+    disconnect_at = None
+    if random.random() < settings["disconnect_rate"]:
+        stats["disconnects"] += 1
+        disconnect_at = random.randrange(max(1, settings["stream_tokens"]))
+
+    async def events():
+        await asyncio.sleep(settings["ttft_ms"] / 1000.0)
+        interval = 1.0 / settings["tokens_per_sec"] if settings["tokens_per_sec"] > 0 else 0.0
+        for i in range(settings["stream_tokens"]):
+            if i == disconnect_at:
+                raise ConnectionResetError("injected disconnect")
+            delta = {"choices": [{"index": 0, "delta": {"content": f"tok{i} "}}]}
+            yield f"data: {json.dumps(delta)}\n\n".encode()
+            await asyncio.sleep(interval)
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/v1/models")
+async def list_models():
+    stats["requests"] += 1
+    await _inject_latency()
+    failure = await _inject_failure()
+    if failure is not None:
+        return failure
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]}
+
+
+@app.get("/_stub/config")
+async def get_config():
+    return {"settings": settings, "stats": stats}
+
+
+@app.post("/_stub/config")
+async def set_config(request: Request):
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in settings:
+            settings[key] = type(settings[key])(value)
+    return {"settings": settings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="uniform")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--ttft-ms", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--stream-tokens", type=int, default=5)
+    parser.add_argument("--response-tokens", type=int, default=20)
+    args = parser.parse_args()
+
+    settings.update({
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "latency_dist": args.latency_dist,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "timeout_rate": args.timeout_rate,
+        "disconnect_rate": args.disconnect_rate,
+        "ttft_ms": args.ttft_ms,
+        "tokens_per_sec": args.tokens_per_sec,
+        "stream_tokens": args.stream_tokens,
+        "response_tokens": args.response_tokens,
+    })
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()